@@ -7,16 +7,26 @@ import os
 import shutil
 from abc import ABCMeta, abstractmethod
 import itertools
-import csv
 import glob
-import ast
-from pvactools.lib.run_utils import get_anchor_positions
+import multiprocessing
+from math import ceil
+from concurrent.futures import ProcessPoolExecutor
+from pvactools.lib.anchor_positions import AnchorPositions
+import pvactools.lib.epitope_table
 
 from pvactools.lib.prediction_class import PredictionClass
 
+#The aggregator and the all_epitopes table that the forked aggregation workers read,
+#so that they don't need to be sent to every worker
+worker_state = {}
+
+def get_best_mut_lines_for_keys(keys):
+    (aggregator, args) = worker_state['aggregation']
+    return aggregator.get_best_mut_lines(keys, *args)
+
 class AggregateAllEpitopes:
     def __init__(self):
-        self.hla_types = pd.read_csv(self.input_file, delimiter="\t", usecols=["HLA Allele"])['HLA Allele'].unique()
+        self.hla_types = pvactools.lib.epitope_table.read_csv(self.input_file, usecols=["HLA Allele"])['HLA Allele'].unique()
         allele_specific_binding_thresholds = {}
         for hla_type in self.hla_types:
             threshold = PredictionClass.cutoff_for_allele(hla_type)
@@ -36,10 +46,43 @@ class AggregateAllEpitopes:
     def read_input_file(self, used_columns, dtypes):
         raise Exception("Must implement method in child class")
     
+    @abstractmethod
+    def get_mutation_key_columns(self):
+        raise Exception("Must implement method in child class")
+
     @abstractmethod
     def get_sub_df(self, df, key):
         raise Exception("Must implement method in child class")
 
+    def get_rows_for_key(self, all_epitopes_df):
+        #Look up the rows of each variant from a single groupby instead of filtering the whole table for every variant
+        return all_epitopes_df.groupby(self.get_mutation_key_columns(), sort=False).indices
+
+    def get_sub_dfs(self, all_epitopes_df, keys, rows_for_key):
+        for key in keys:
+            rows = rows_for_key.get(tuple(key) if isinstance(key, list) else key, [])
+            yield self.get_sub_df(all_epitopes_df.iloc[rows], key)
+
+    def get_best_mut_lines(self, keys, all_epitopes_df, rows_for_key, prediction_algorithms, el_algorithms, vaf_clonal):
+        best_mut_lines = []
+        for (df, key_str) in self.get_sub_dfs(all_epitopes_df, keys, rows_for_key):
+            (best_mut_line, metrics_for_key) = self.get_best_mut_line(df, key_str, prediction_algorithms, el_algorithms, vaf_clonal)
+            best_mut_lines.append((key_str, best_mut_line, metrics_for_key))
+        return best_mut_lines
+
+    def get_best_mut_lines_in_parallel(self, keys, *args):
+        if self.n_threads <= 1 or len(keys) < 2:
+            return self.get_best_mut_lines(keys, *args)
+        #Batches of variants are aggregated in forked worker processes. The results are returned in the order of the keys.
+        batch_size = ceil(len(keys) / (self.n_threads * 4))
+        batches = [keys[i:i+batch_size] for i in range(0, len(keys), batch_size)]
+        worker_state['aggregation'] = (self, args)
+        try:
+            with ProcessPoolExecutor(max_workers=self.n_threads, mp_context=multiprocessing.get_context('fork')) as executor:
+                return [best_mut_line for batch in executor.map(get_best_mut_lines_for_keys, batches) for best_mut_line in batch]
+        finally:
+            del worker_state['aggregation']
+
     @abstractmethod
     def get_best_binder(self, df):
         raise Exception("Must implement method in child class")
@@ -88,6 +131,22 @@ class AggregateAllEpitopes:
     def copy_pvacview_r_files(self):
         raise Exception("Must implement method in child class")
 
+    def get_binding_threshold(self, hla_allele):
+        if self.use_allele_specific_binding_thresholds and hla_allele in self.allele_specific_binding_thresholds:
+            return self.allele_specific_binding_thresholds[hla_allele]
+        else:
+            return self.binding_threshold
+
+    def get_binding_thresholds(self, df):
+        #Look up the threshold of each allele once and map it onto the rows
+        return df['HLA Allele'].map({hla_allele: self.get_binding_threshold(hla_allele) for hla_allele in df['HLA Allele'].unique()})
+
+    def select_good_binders(self, df, ic50_column):
+        if self.use_allele_specific_binding_thresholds:
+            return df[df[ic50_column] < self.get_binding_thresholds(df)]
+        else:
+            return df[df[ic50_column] < self.aggregate_inclusion_binding_threshold]
+
     def get_best_mut_line(self, df, key, prediction_algorithms, el_algorithms, vaf_clonal):
         #order by best median score and get best ic50 peptide
         best = self.get_best_binder(df)
@@ -116,7 +175,7 @@ class AggregateAllEpitopes:
         return (out_dict, metric)
 
     def determine_used_prediction_algorithms(self):
-        headers = pd.read_csv(self.input_file, delimiter="\t", nrows=0).columns.tolist()
+        headers = pvactools.lib.epitope_table.read_csv(self.input_file, nrows=0).columns.tolist()
         potential_algorithms = PredictionClass.prediction_methods()
         prediction_algorithms = []
         for algorithm in potential_algorithms:
@@ -128,21 +187,21 @@ class AggregateAllEpitopes:
 
     def determine_used_epitope_lengths(self):
         col_name = self.determine_epitope_seq_column_name()
-        return list(set([len(s) for s in pd.read_csv(self.input_file, delimiter="\t", usecols=[col_name])[col_name]]))
+        return list(set([len(s) for s in pvactools.lib.epitope_table.read_csv(self.input_file, usecols=[col_name])[col_name]]))
 
     def determine_epitope_seq_column_name(self):
-        headers = pd.read_csv(self.input_file, delimiter="\t", nrows=0).columns.tolist()
+        headers = pvactools.lib.epitope_table.read_csv(self.input_file, nrows=0).columns.tolist()
         for header in ["MT Epitope Seq", "Epitope Seq"]:
             if header in headers:
                 return header
         raise Exception("No mutant epitope sequence header found.")
 
     def problematic_positions_exist(self):
-        headers = pd.read_csv(self.input_file, delimiter="\t", nrows=0).columns.tolist()
+        headers = pvactools.lib.epitope_table.read_csv(self.input_file, nrows=0).columns.tolist()
         return 'Problematic Positions' in headers
 
     def determine_used_el_algorithms(self):
-        headers = pd.read_csv(self.input_file, delimiter="\t", nrows=0).columns.tolist()
+        headers = pvactools.lib.epitope_table.read_csv(self.input_file, nrows=0).columns.tolist()
         potential_algorithms = ["MHCflurryEL Processing", "MHCflurryEL Presentation", "NetMHCpanEL", "NetMHCIIpanEL", "BigMHC_EL", 'BigMHC_IM', 'DeepImmuno']
         prediction_algorithms = []
         for algorithm in potential_algorithms:
@@ -235,9 +294,8 @@ class AggregateAllEpitopes:
         ## get a list of unique mutations
         keys = self.get_list_unique_mutation_keys(all_epitopes_df)
 
-        for key in keys:
-            (df, key_str) = self.get_sub_df(all_epitopes_df, key)
-            (best_mut_line, metrics_for_key) = self.get_best_mut_line(df, key_str, prediction_algorithms, el_algorithms, vaf_clonal)
+        rows_for_key = self.get_rows_for_key(all_epitopes_df)
+        for (key_str, best_mut_line, metrics_for_key) in self.get_best_mut_lines_in_parallel(keys, all_epitopes_df, rows_for_key, prediction_algorithms, el_algorithms, vaf_clonal):
             data.append(best_mut_line)
             metrics[key_str] = metrics_for_key
         peptide_table = pd.DataFrame(data=data)
@@ -266,9 +324,11 @@ class PvacseqAggregateAllEpitopes(AggregateAllEpitopes, metaclass=ABCMeta):
             allele_specific_anchors=False,
             anchor_contribution_threshold=0.8,
             aggregate_inclusion_binding_threshold=5000,
+            n_threads=1,
         ):
         self.input_file = input_file
         self.output_file = output_file
+        self.n_threads = n_threads
         self.tumor_purity = tumor_purity
         self.binding_threshold = binding_threshold
         self.use_allele_specific_binding_thresholds = allele_specific_binding_thresholds
@@ -285,41 +345,21 @@ class PvacseqAggregateAllEpitopes(AggregateAllEpitopes, metaclass=ABCMeta):
             self.mt_top_score_metric = "Best"
             self.wt_top_score_metric = "Corresponding"
         self.metrics_file = output_file.replace('.tsv', '.metrics.json')
-        anchor_probabilities = {}
-        for length in [8, 9, 10, 11]:
-            base_dir = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
-            file_name = os.path.join(base_dir, 'tools', 'pvacview', 'data', "Normalized_anchor_predictions_{}_mer.tsv".format(length))
-            probs = {}
-            with open(file_name, 'r') as fh:
-                reader = csv.DictReader(fh, delimiter="\t")
-                for line in reader:
-                    hla = line.pop('HLA')
-                    probs[hla] = line
-            anchor_probabilities[length] = probs
-        self.anchor_probabilities = anchor_probabilities
-
-        mouse_anchor_positions = {}
-        for length in [8, 9, 10, 11]:
-            base_dir = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
-            file_name = os.path.join(base_dir, 'tools', 'pvacview', 'data', "mouse_anchor_predictions_{}_mer.tsv".format(length))
-            values = {}
-            with open(file_name, 'r') as fh:
-                reader = csv.DictReader(fh, delimiter="\t")
-                for line in reader:
-                    allele = line.pop('Allele')
-                    values[allele] = {int(k): ast.literal_eval(v) for k, v in line.items()}
-            mouse_anchor_positions[length] = values
-        self.mouse_anchor_positions = mouse_anchor_positions
-
+        self.anchor_positions = AnchorPositions(allele_specific_anchors, anchor_contribution_threshold)
+        self.anchor_probabilities = self.anchor_positions.anchor_probabilities
+        self.mouse_anchor_positions = self.anchor_positions.mouse_anchor_positions
         self.allele_specific_anchors = allele_specific_anchors
         self.anchor_contribution_threshold = anchor_contribution_threshold
         super().__init__()
 
     def get_list_unique_mutation_keys(self, df):
-        keys = df[['Chromosome', 'Start', 'Stop', 'Reference', 'Variant']].values.tolist()
+        keys = df[self.get_mutation_key_columns()].values.tolist()
         keys = [list(i) for i in set(tuple(i) for i in keys)]
         return sorted(keys)
 
+    def get_mutation_key_columns(self):
+        return ['Chromosome', 'Start', 'Stop', 'Reference', 'Variant']
+
     def calculate_clonal_vaf(self):
         if self.tumor_purity:
             vaf_clonal =  self.tumor_purity * 0.5
@@ -327,7 +367,7 @@ class PvacseqAggregateAllEpitopes(AggregateAllEpitopes, metaclass=ABCMeta):
             return vaf_clonal
         else:
         #if no tumor purity is provided, make a rough estimate by taking the list of VAFs < 0.6 (assumption is that these are CN-neutral) and return the largest as the marker of the founding clone
-            vafs = np.sort(pd.read_csv(self.input_file, delimiter="\t", usecols=["Tumor DNA VAF"])['Tumor DNA VAF'].unique())[::-1]
+            vafs = np.sort(pvactools.lib.epitope_table.read_csv(self.input_file, usecols=["Tumor DNA VAF"])['Tumor DNA VAF'].unique())[::-1]
             vafs_clonal = list(filter(lambda vaf: vaf < 0.6, vafs))
             if len(vafs_clonal) == 0:
                 vaf_clonal = 0.6
@@ -339,9 +379,10 @@ class PvacseqAggregateAllEpitopes(AggregateAllEpitopes, metaclass=ABCMeta):
             return vaf_clonal
 
     def read_input_file(self, used_columns, dtypes):
-        df = pd.read_csv(self.input_file, delimiter='\t', float_precision='high', low_memory=False, na_values="NA", keep_default_na=False, usecols=used_columns, dtype=dtypes)
+        df = pvactools.lib.epitope_table.read_csv(self.input_file, float_precision='high', low_memory=False, na_values="NA", keep_default_na=False, usecols=used_columns, dtype=dtypes)
         df = df.dropna(subset=["{} MT IC50 Score".format(self.mt_top_score_metric)]).reset_index()
         df = df.astype({"{} MT IC50 Score".format(self.mt_top_score_metric):'float'})
+        df['anchor_residue_pass'] = self.anchor_residue_passes(df)
         return df
 
     def get_sub_df(self, all_epitopes_df, key):
@@ -376,7 +417,6 @@ class PvacseqAggregateAllEpitopes(AggregateAllEpitopes, metaclass=ABCMeta):
             prob_pos_df = tsl_df
 
         #subset prob_pos dataframe to only include entries that pass the anchor position check
-        prob_pos_df['anchor_residue_pass'] = prob_pos_df.apply(lambda x: self.is_anchor_residue_pass(x), axis=1)
         anchor_residue_pass_df = prob_pos_df[prob_pos_df['anchor_residue_pass']]
         if anchor_residue_pass_df.shape[0] == 0:
             anchor_residue_pass_df = prob_pos_df
@@ -385,32 +425,23 @@ class PvacseqAggregateAllEpitopes(AggregateAllEpitopes, metaclass=ABCMeta):
         anchor_residue_pass_df.sort_values(by=["{} MT IC50 Score".format(self.mt_top_score_metric), "Transcript Support Level", "Transcript Length"], inplace=True, ascending=[True, True, False])
         return anchor_residue_pass_df.iloc[0].to_dict()
 
-    def is_anchor_residue_pass(self, mutation):
-        if self.use_allele_specific_binding_thresholds and mutation['HLA Allele'] in self.allele_specific_binding_thresholds:
-            binding_threshold = self.allele_specific_binding_thresholds[mutation['HLA Allele']]
-        else:
-            binding_threshold = self.binding_threshold
+    def anchor_residue_passes(self, df):
+        return self.anchor_positions.anchor_residue_passes(
+            df['HLA Allele'],
+            df['MT Epitope Seq'].str.len(),
+            df['Mutation Position'],
+            df["{} WT IC50 Score".format(self.wt_top_score_metric)],
+            self.get_binding_thresholds(df),
+        )
 
-        anchor_residue_pass = True
-        anchors = get_anchor_positions(mutation['HLA Allele'], len(mutation['MT Epitope Seq']), self.allele_specific_anchors, self.anchor_probabilities, self.anchor_contribution_threshold, self.mouse_anchor_positions)
-        # parse out mutation position from str
-        position = mutation["Mutation Position"]
-        if pd.isna(position):
-            return anchor_residue_pass
-        elif '-' in position:
-            d_ind = position.index('-')
-            if all(pos in anchors for pos in range(int(position[0:d_ind]), int(position[d_ind+1:])+1)):
-                if pd.isna(mutation["{} WT IC50 Score".format(self.wt_top_score_metric)]):
-                    anchor_residue_pass = False
-                elif mutation["{} WT IC50 Score".format(self.wt_top_score_metric)] < binding_threshold:
-                    anchor_residue_pass = False
-        else:
-            if int(float(position)) in anchors:
-                if pd.isna(mutation["{} WT IC50 Score".format(self.wt_top_score_metric)]):
-                    anchor_residue_pass = False
-                elif mutation["{} WT IC50 Score".format(self.wt_top_score_metric)] < binding_threshold:
-                    anchor_residue_pass = False
-        return anchor_residue_pass
+    def is_anchor_residue_pass(self, mutation):
+        return self.anchor_positions.anchor_residue_pass(
+            mutation['HLA Allele'],
+            len(mutation['MT Epitope Seq']),
+            mutation["Mutation Position"],
+            mutation["{} WT IC50 Score".format(self.wt_top_score_metric)],
+            self.get_binding_threshold(mutation['HLA Allele']),
+        )
 
     #assign mutations to a "Classification" based on their favorability
     def get_tier(self, mutation, vaf_clonal):
@@ -419,7 +450,7 @@ class PvacseqAggregateAllEpitopes(AggregateAllEpitopes, metaclass=ABCMeta):
         else:
             binding_threshold = self.binding_threshold
 
-        anchor_residue_pass = self.is_anchor_residue_pass(mutation)
+        anchor_residue_pass = mutation['anchor_residue_pass']
 
         tsl_pass = True
         if mutation["Transcript Support Level"] == "Not Supported":
@@ -504,18 +535,7 @@ class PvacseqAggregateAllEpitopes(AggregateAllEpitopes, metaclass=ABCMeta):
         return "Poor"
 
     def get_good_binders(self, df):
-        if self.use_allele_specific_binding_thresholds:
-            selection = []
-            for index, row in df.iterrows():
-                if row['HLA Allele'] in self.allele_specific_binding_thresholds:
-                    binding_threshold = self.allele_specific_binding_thresholds[row['HLA Allele']]
-                else:
-                    binding_threshold = self.binding_threshold
-                if row["{} MT IC50 Score".format(self.mt_top_score_metric)] < binding_threshold:
-                    selection.append(index)
-            return df[df.index.isin(selection)]
-        else:
-            return df[df["{} MT IC50 Score".format(self.mt_top_score_metric)] < self.aggregate_inclusion_binding_threshold]
+        return self.select_good_binders(df, "{} MT IC50 Score".format(self.mt_top_score_metric))
 
     def get_unique_good_binders(self, good_binders):
         return pd.DataFrame(good_binders.groupby(['HLA Allele', 'MT Epitope Seq']).size().reset_index())
@@ -526,28 +546,46 @@ class PvacseqAggregateAllEpitopes(AggregateAllEpitopes, metaclass=ABCMeta):
     def round_to_ints(self, items):
         return [round(x) if (type(x) == float and not pd.isna(x)) else x for x in items]
 
+    def get_individual_call_columns(self, prediction_algorithms, el_algorithms):
+        columns = []
+        for peptide_type in ['MT', 'WT']:
+            for algorithm in prediction_algorithms:
+                columns.extend(["{} {} IC50 Score".format(algorithm, peptide_type), "{} {} Percentile".format(algorithm, peptide_type)])
+            for algorithm in el_algorithms:
+                columns.append("{} {} Score".format(algorithm, peptide_type))
+                if algorithm not in ['MHCflurryEL Processing', 'BigMHC_EL', 'BigMHC_IM', 'DeepImmuno']:
+                    columns.append("{} {} Percentile".format(algorithm, peptide_type))
+        return columns
+
     def get_good_binders_metrics(self, good_binders, prediction_algorithms, el_algorithms):
-        peptides = defaultdict(lambda: defaultdict(lambda: defaultdict(list)))
-        good_peptides = good_binders["MT Epitope Seq"].unique()
-        good_transcripts = good_binders['annotation'].unique()
+        #Plain dict factories keep the metrics picklable for the aggregation workers
+        peptides = defaultdict(dict)
+        good_binders_per_annotation = dict(tuple(good_binders.groupby('annotation', sort=False)))
         peptide_sets = {}
-        for annotation in good_transcripts:
-            good_binders_annotation = good_binders[good_binders['annotation'] == annotation]
+        for annotation, good_binders_annotation in good_binders_per_annotation.items():
             peptide_set = tuple(good_binders_annotation["MT Epitope Seq"].unique())
             if peptide_set in peptide_sets:
                 peptide_sets[peptide_set].append(annotation)
             else:
                 peptide_sets[peptide_set] = [annotation]
 
+        line_columns = ['MT Epitope Seq', 'WT Epitope Seq', 'HLA Allele', 'Mutation Position', 'Variant Type', 'anchor_residue_pass']
+        if 'Problematic Positions' in good_binders.columns:
+            line_columns.append('Problematic Positions')
+        for peptide_type, top_score_metric in zip(['MT', 'WT'], [self.mt_top_score_metric, self.wt_top_score_metric]):
+            line_columns.extend(['{} {} IC50 Score'.format(top_score_metric, peptide_type), '{} {} Percentile'.format(top_score_metric, peptide_type)])
+        line_columns.extend(self.get_individual_call_columns(prediction_algorithms, el_algorithms))
+
         set_number = 1
         for peptide_set, annotations in peptide_sets.items():
             set_name = "Transcript Set {}".format(set_number)
-            annotation = annotations[0]
-            good_binders_annotation = good_binders[good_binders['annotation'] == annotation]
-            results = defaultdict(lambda: defaultdict(list))
+            lines_per_peptide = defaultdict(list)
+            for line in good_binders_per_annotation[annotations[0]][line_columns].to_dict(orient='records'):
+                lines_per_peptide[line['MT Epitope Seq']].append(line)
+            results = defaultdict(dict)
             for peptide in list(peptide_set):
-                good_binders_peptide_annotation = good_binders_annotation[good_binders_annotation['MT Epitope Seq'] == peptide]
-                if len(good_binders_peptide_annotation) > 0:
+                peptide_lines = lines_per_peptide[peptide]
+                if len(peptide_lines) > 0:
                     individual_ic50_calls = { 'algorithms': prediction_algorithms }
                     individual_percentile_calls = { 'algorithms': prediction_algorithms }
                     individual_el_calls = { 'algorithms': el_algorithms }
@@ -560,35 +598,25 @@ class PvacseqAggregateAllEpitopes(AggregateAllEpitopes, metaclass=ABCMeta):
                         percentile_calls = {}
                         el_calls = {}
                         el_percentile_calls = {}
-                        for index, line in good_binders_peptide_annotation.to_dict(orient='index').items():
+                        for line in peptide_lines:
                             ic50s[line['HLA Allele']] = line['{} {} IC50 Score'.format(top_score_metric, peptide_type)]
                             percentiles[line['HLA Allele']] = line['{} {} Percentile'.format(top_score_metric, peptide_type)]
                             ic50_calls[line['HLA Allele']] = self.replace_nas([line["{} {} IC50 Score".format(algorithm, peptide_type)] for algorithm in prediction_algorithms])
                             percentile_calls[line['HLA Allele']] = self.replace_nas([line["{} {} Percentile".format(algorithm, peptide_type)] for algorithm in prediction_algorithms])
                             el_calls[line['HLA Allele']] = self.replace_nas([line["{} {} Score".format(algorithm, peptide_type)] for algorithm in el_algorithms])
                             el_percentile_calls[line['HLA Allele']] = self.replace_nas(['NA' if algorithm in ['MHCflurryEL Processing', 'BigMHC_EL', 'BigMHC_IM', 'DeepImmuno'] else line["{} {} Percentile".format(algorithm, peptide_type)] for algorithm in el_algorithms])
-                            if peptide_type == 'MT' and not self.is_anchor_residue_pass(line):
+                            if peptide_type == 'MT' and not line['anchor_residue_pass']:
                                 anchor_fails.append(line['HLA Allele'])
-                        sorted_ic50s = []
-                        sorted_percentiles = []
-                        for hla_type in sorted(self.hla_types):
-                            if hla_type in ic50s:
-                                sorted_ic50s.append(ic50s[hla_type])
-                            else:
-                                sorted_ic50s.append('X')
-                            if hla_type in percentiles:
-                                sorted_percentiles.append(percentiles[hla_type])
-                            else:
-                                sorted_percentiles.append('X')
-                        results[peptide]['ic50s_{}'.format(peptide_type)] = self.replace_nas(sorted_ic50s)
-                        results[peptide]['percentiles_{}'.format(peptide_type)] = self.replace_nas(sorted_percentiles)
+                        results[peptide]['ic50s_{}'.format(peptide_type)] = self.replace_nas([ic50s.get(hla_type, 'X') for hla_type in sorted(self.hla_types)])
+                        results[peptide]['percentiles_{}'.format(peptide_type)] = self.replace_nas([percentiles.get(hla_type, 'X') for hla_type in sorted(self.hla_types)])
                         individual_ic50_calls[peptide_type] = ic50_calls
                         individual_percentile_calls[peptide_type] = percentile_calls
                         individual_el_calls[peptide_type] = el_calls
                         individual_el_percentile_calls[peptide_type] = el_percentile_calls
+                    first_line = peptide_lines[0]
                     results[peptide]['hla_types'] = sorted(self.hla_types)
-                    results[peptide]['mutation_position'] = "NA" if pd.isna(good_binders_peptide_annotation.iloc[0]['Mutation Position']) else str(good_binders_peptide_annotation.iloc[0]['Mutation Position'])
-                    results[peptide]['problematic_positions'] = str(good_binders_peptide_annotation.iloc[0]['Problematic Positions']) if 'Problematic Positions' in good_binders_peptide_annotation.iloc[0] else 'None'
+                    results[peptide]['mutation_position'] = "NA" if pd.isna(first_line['Mutation Position']) else str(first_line['Mutation Position'])
+                    results[peptide]['problematic_positions'] = str(first_line['Problematic Positions']) if 'Problematic Positions' in first_line else 'None'
                     if len(anchor_fails) > 0:
                         results[peptide]['anchor_fails'] = ', '.join(anchor_fails)
                     else:
@@ -597,9 +625,9 @@ class PvacseqAggregateAllEpitopes(AggregateAllEpitopes, metaclass=ABCMeta):
                     results[peptide]['individual_percentile_calls'] = individual_percentile_calls
                     results[peptide]['individual_el_calls'] = individual_el_calls
                     results[peptide]['individual_el_percentile_calls'] = individual_el_percentile_calls
-                    wt_peptide = good_binders_peptide_annotation.iloc[0]['WT Epitope Seq']
+                    wt_peptide = first_line['WT Epitope Seq']
                     if pd.isna(wt_peptide):
-                        variant_type = good_binders_peptide_annotation.iloc[0]['Variant Type']
+                        variant_type = first_line['Variant Type']
                         if variant_type == 'FS':
                             wt_peptide = 'FS-NA'
                         elif variant_type == 'inframe_ins':
@@ -618,7 +646,7 @@ class PvacseqAggregateAllEpitopes(AggregateAllEpitopes, metaclass=ABCMeta):
             peptides[set_name]['peptide_count'] = len(peptide_set)
             peptides[set_name]['total_expr'] = sum([0 if x == 'NA' else (float(x)) for x in peptides[set_name]['transcript_expr']])
             set_number += 1
-        anno_count = len(good_transcripts)
+        anno_count = len(good_binders_per_annotation)
 
         return (peptides, anno_count)
 
@@ -635,17 +663,18 @@ class PvacseqAggregateAllEpitopes(AggregateAllEpitopes, metaclass=ABCMeta):
         return sorted_results
 
     def sort_transcripts(self, annotations, good_binders):
-        transcript_table = pd.DataFrame()
-        for annotation in annotations:
-            line = good_binders[good_binders['annotation'] == annotation].iloc[0]
-            data = {
+        #The first line of each transcript, in the order of the annotations
+        lines = good_binders[['annotation', 'Biotype', 'Transcript Support Level', 'Transcript Length', 'Transcript Expression']].drop_duplicates(subset='annotation').set_index('annotation', drop=False)
+        transcript_table = pd.DataFrame.from_records([
+            {
                 'Annotation': line['annotation'],
                 'Biotype': line['Biotype'],
                 'TSL': line['Transcript Support Level'],
                 'Length': line['Transcript Length'],
                 'Expr': line['Transcript Expression'],
             }
-            transcript_table = pd.concat([transcript_table, pd.DataFrame.from_records(data, index=[0])], ignore_index=True)
+            for line in lines.loc[annotations].to_dict(orient='records')
+        ])
         transcript_table['Biotype Sort'] = transcript_table.Biotype.map(lambda x: 1 if x == 'protein_coding' else 2)
         tsl_sort_criteria = {1: 1, 2: 2, 3: 3, 4: 4, 5: 5, 'NA': 6, 'Not Supported': 6}
         transcript_table['TSL Sort'] = transcript_table.TSL.map(tsl_sort_criteria)
@@ -765,9 +794,11 @@ class UnmatchedSequenceAggregateAllEpitopes(AggregateAllEpitopes, metaclass=ABCM
             allele_specific_binding_thresholds=False,
             top_score_metric="median",
             aggregate_inclusion_binding_threshold=5000,
+            n_threads=1,
         ):
         self.input_file = input_file
         self.output_file = output_file
+        self.n_threads = n_threads
         self.binding_threshold = binding_threshold
         self.percentile_threshold = percentile_threshold
         self.use_allele_specific_binding_thresholds = allele_specific_binding_thresholds
@@ -781,14 +812,17 @@ class UnmatchedSequenceAggregateAllEpitopes(AggregateAllEpitopes, metaclass=ABCM
 
 
     def get_list_unique_mutation_keys(self, df):
-        keys = df["Mutation"].values.tolist()
+        keys = df[self.get_mutation_key_columns()].values.tolist()
         return sorted(list(set(keys)))
 
+    def get_mutation_key_columns(self):
+        return "Mutation"
+
     def calculate_clonal_vaf(self):
         return None
 
     def read_input_file(self, used_columns, dtypes):
-        df = pd.read_csv(self.input_file, delimiter='\t', float_precision='high', low_memory=False, na_values="NA", keep_default_na=False, dtype={"Mutation": str})
+        df = pvactools.lib.epitope_table.read_csv(self.input_file, float_precision='high', low_memory=False, na_values="NA", keep_default_na=False, dtype={"Mutation": str})
         df = df[df["{} IC50 Score".format(self.top_score_metric)] != 'NA']
         df = df.astype({"{} IC50 Score".format(self.top_score_metric):'float'})
         return df
@@ -802,18 +836,7 @@ class UnmatchedSequenceAggregateAllEpitopes(AggregateAllEpitopes, metaclass=ABCM
         return df.iloc[0]
 
     def get_good_binders(self, df):
-        if self.use_allele_specific_binding_thresholds:
-            selection = []
-            for index, row in df.iterrows():
-                if row['HLA Allele'] in self.allele_specific_binding_thresholds:
-                    binding_threshold = self.allele_specific_binding_thresholds[row['HLA Allele']]
-                else:
-                    binding_threshold = self.binding_threshold
-                if row["{} IC50 Score".format(self.top_score_metric)] < binding_threshold:
-                    selection.append(index)
-            return df[df.index.isin(selection)]
-        else:
-            return df[df["{} IC50 Score".format(self.top_score_metric)] < self.aggregate_inclusion_binding_threshold]
+        return self.select_good_binders(df, "{} IC50 Score".format(self.top_score_metric))
 
     def get_unique_good_binders(self, good_binders):
         return pd.DataFrame(good_binders.groupby(['HLA Allele', 'Epitope Seq']).size().reset_index())
@@ -860,7 +883,8 @@ class PvacfuseAggregateAllEpitopes(UnmatchedSequenceAggregateAllEpitopes, metacl
         top_score_metric="median",
         read_support=5,
         expn_val=0.1,
-        aggregate_inclusion_binding_threshold=5000
+        aggregate_inclusion_binding_threshold=5000,
+        n_threads=1,
     ):
         UnmatchedSequenceAggregateAllEpitopes.__init__(
             self,
@@ -870,7 +894,8 @@ class PvacfuseAggregateAllEpitopes(UnmatchedSequenceAggregateAllEpitopes, metacl
             percentile_threshold=percentile_threshold,
             allele_specific_binding_thresholds=allele_specific_binding_thresholds,
             top_score_metric=top_score_metric,
-            aggregate_inclusion_binding_threshold=aggregate_inclusion_binding_threshold
+            aggregate_inclusion_binding_threshold=aggregate_inclusion_binding_threshold,
+            n_threads=n_threads,
         )
         self.read_support = read_support
         self.expn_val = expn_val
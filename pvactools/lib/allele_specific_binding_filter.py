@@ -22,44 +22,48 @@ class AlleleSpecificBindingFilter:
             writer.writeheader()
 
             for entry in reader:
-                if self.file_type == 'pVACbind' or self.file_type == 'pVACfuse':
-                    if self.top_score_metric == 'median':
-                        score = entry['Median IC50 Score']
-                        percentile_column = 'Median Percentile'
-                    elif self.top_score_metric == 'lowest':
-                        score = entry['Best IC50 Score']
-                        percentile_column = 'Best Percentile'
+                if self.passes(entry):
+                    writer.writerow(entry)
+            output_fh.close()
+
+    def passes(self, entry):
+        if self.file_type == 'pVACbind' or self.file_type == 'pVACfuse':
+            if self.top_score_metric == 'median':
+                score = entry['Median IC50 Score']
+                percentile_column = 'Median Percentile'
+            elif self.top_score_metric == 'lowest':
+                score = entry['Best IC50 Score']
+                percentile_column = 'Best Percentile'
+        else:
+            if self.top_score_metric == 'median':
+                score = entry['Median MT IC50 Score']
+                if self.exclude_nas and entry['Median Fold Change'] == 'NA':
+                    return False
                 else:
-                    if self.top_score_metric == 'median':
-                        score = entry['Median MT IC50 Score']
-                        if self.exclude_nas and entry['Median Fold Change'] == 'NA':
-                            continue
-                        else:
-                            fold_change = sys.maxsize if entry['Median Fold Change'] == 'NA' else float(entry['Median Fold Change'])
-                        percentile_column = 'Median MT Percentile'
-                    elif self.top_score_metric == 'lowest':
-                        score = entry['Best MT IC50 Score']
-                        if self.exclude_nas and entry['Corresponding Fold Change'] == 'NA':
-                            continue
-                        else:
-                            fold_change = sys.maxsize if entry['Corresponding Fold Change'] == 'NA' else float(entry['Corresponding Fold Change'])
-                        percentile_column = 'Best MT Percentile'
+                    fold_change = sys.maxsize if entry['Median Fold Change'] == 'NA' else float(entry['Median Fold Change'])
+                percentile_column = 'Median MT Percentile'
+            elif self.top_score_metric == 'lowest':
+                score = entry['Best MT IC50 Score']
+                if self.exclude_nas and entry['Corresponding Fold Change'] == 'NA':
+                    return False
+                else:
+                    fold_change = sys.maxsize if entry['Corresponding Fold Change'] == 'NA' else float(entry['Corresponding Fold Change'])
+                percentile_column = 'Best MT Percentile'
 
-                if self.percentile_threshold is not None:
-                    if float(entry[percentile_column]) > self.percentile_threshold:
-                        continue
+        if self.percentile_threshold is not None:
+            if float(entry[percentile_column]) > self.percentile_threshold:
+                return False
 
-                threshold = PredictionClass.cutoff_for_allele(entry['HLA Allele'])
-                threshold = self.default_threshold if threshold is None else float(threshold)
+        threshold = PredictionClass.cutoff_for_allele(entry['HLA Allele'])
+        threshold = self.default_threshold if threshold is None else float(threshold)
 
-                if score == 'NA':
-                    if self.exclude_nas:
-                        continue
-                elif float(score) > threshold:
-                    continue
+        if score == 'NA':
+            if self.exclude_nas:
+                return False
+        elif float(score) > threshold:
+            return False
 
-                if self.minimum_fold_change is not None and fold_change < self.minimum_fold_change:
-                    continue
+        if self.minimum_fold_change is not None and fold_change < self.minimum_fold_change:
+            return False
 
-                writer.writerow(entry)
-            output_fh.close()
+        return True
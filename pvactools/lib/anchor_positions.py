@@ -0,0 +1,105 @@
+import os
+import csv
+import ast
+import numpy as np
+import pandas as pd
+
+from pvactools.lib.run_utils import get_anchor_positions
+
+def positions_mask(positions):
+    mask = 0
+    for position in positions:
+        mask |= 1 << position
+    return mask
+
+def mutation_position_mask(mutation_position):
+    if pd.isna(mutation_position) or mutation_position == 'NA':
+        return None
+    mutation_position = str(mutation_position)
+    if '-' in mutation_position:
+        d_ind = mutation_position.index('-')
+        return positions_mask(range(int(mutation_position[0:d_ind]), int(mutation_position[d_ind+1:])+1))
+    else:
+        return positions_mask([int(float(mutation_position))])
+
+def masks_array(masks):
+    #Fall back to python ints for positions that don't fit into an int64
+    if all(mask.bit_length() < 63 for mask in masks):
+        return np.array(masks, dtype=np.int64)
+    else:
+        return np.array(masks, dtype=object)
+
+class AnchorPositions:
+    def __init__(self, allele_specific_anchors=False, anchor_contribution_threshold=0.8):
+        self.allele_specific_anchors = allele_specific_anchors
+        self.anchor_contribution_threshold = anchor_contribution_threshold
+        self.anchor_probabilities = self.read_anchor_probabilities()
+        self.mouse_anchor_positions = self.read_mouse_anchor_positions()
+        #(allele, epitope length) -> bitmask with bit n set if position n is an anchor position
+        self.anchor_masks = {}
+
+    def data_file(self, file_name):
+        base_dir = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+        return os.path.join(base_dir, 'tools', 'pvacview', 'data', file_name)
+
+    def read_anchor_probabilities(self):
+        anchor_probabilities = {}
+        for length in [8, 9, 10, 11]:
+            probs = {}
+            with open(self.data_file("Normalized_anchor_predictions_{}_mer.tsv".format(length)), 'r') as fh:
+                reader = csv.DictReader(fh, delimiter="\t")
+                for line in reader:
+                    hla = line.pop('HLA')
+                    probs[hla] = line
+            anchor_probabilities[length] = probs
+        return anchor_probabilities
+
+    def read_mouse_anchor_positions(self):
+        mouse_anchor_positions = {}
+        for length in [8, 9, 10, 11]:
+            values = {}
+            with open(self.data_file("mouse_anchor_predictions_{}_mer.tsv".format(length)), 'r') as fh:
+                reader = csv.DictReader(fh, delimiter="\t")
+                for line in reader:
+                    allele = line.pop('Allele')
+                    values[allele] = {int(k): ast.literal_eval(v) for k, v in line.items()}
+            mouse_anchor_positions[length] = values
+        return mouse_anchor_positions
+
+    def anchor_mask(self, hla_allele, epitope_length):
+        key = (hla_allele, epitope_length)
+        if key not in self.anchor_masks:
+            anchors = get_anchor_positions(hla_allele, epitope_length, self.allele_specific_anchors, self.anchor_probabilities, self.anchor_contribution_threshold, self.mouse_anchor_positions)
+            self.anchor_masks[key] = positions_mask(anchors)
+        return self.anchor_masks[key]
+
+    def mutated_positions_are_anchors(self, hla_allele, epitope_length, mutation_position):
+        position_mask = mutation_position_mask(mutation_position)
+        if position_mask is None:
+            return False
+        return (position_mask & ~self.anchor_mask(hla_allele, epitope_length)) == 0
+
+    def anchor_residue_pass(self, hla_allele, epitope_length, mutation_position, wt_ic50, binding_threshold):
+        if self.mutated_positions_are_anchors(hla_allele, epitope_length, mutation_position):
+            if pd.isna(wt_ic50) or wt_ic50 < binding_threshold:
+                return False
+        return True
+
+    def all_mutated_positions_are_anchors(self, hla_alleles, epitope_lengths, mutation_positions):
+        if len(hla_alleles) == 0:
+            return np.zeros(0, dtype=bool)
+        #Evaluate each distinct (allele, length) and mutation position once and broadcast the masks back to the rows
+        (allele_length_codes, allele_lengths) = pd.MultiIndex.from_arrays([list(hla_alleles), [int(l) for l in epitope_lengths]]).factorize()
+        anchor_masks = masks_array([self.anchor_mask(hla_allele, epitope_length) for (hla_allele, epitope_length) in allele_lengths])[allele_length_codes]
+        (position_codes, positions) = pd.factorize(np.asarray(mutation_positions, dtype=object))
+        position_masks = [mutation_position_mask(p) for p in positions]
+        #The extra last entry is picked up by the missing positions, which have a code of -1
+        has_position = np.array([m is not None for m in position_masks] + [False])[position_codes]
+        position_masks = masks_array([0 if m is None else m for m in position_masks] + [0])[position_codes]
+        return (has_position & ((position_masks & ~anchor_masks) == 0)).astype(bool)
+
+    def anchor_residue_passes(self, hla_alleles, epitope_lengths, mutation_positions, wt_ic50s, binding_thresholds):
+        mutated_anchors = self.all_mutated_positions_are_anchors(hla_alleles, epitope_lengths, mutation_positions)
+        wt_ic50s = np.asarray(wt_ic50s, dtype=float)
+        binding_thresholds = np.asarray(binding_thresholds, dtype=float)
+        return ~(mutated_anchors & (np.isnan(wt_ic50s) | (wt_ic50s < binding_thresholds)))
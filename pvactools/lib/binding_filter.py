@@ -19,10 +19,13 @@ class BindingFilter:
         self.file_type = file_type
 
     def execute(self):
+        self.row_filter().execute()
+
+    def row_filter(self):
         filter_criteria = []
 
         if self.allele_specific_cutoffs:
-            AlleleSpecificBindingFilter(self.input_file, self.output_file, self.binding_threshold, self.minimum_fold_change, self.top_score_metric, self.exclude_nas, self.percentile_threshold, self.file_type).execute()
+            return AlleleSpecificBindingFilter(self.input_file, self.output_file, self.binding_threshold, self.minimum_fold_change, self.top_score_metric, self.exclude_nas, self.percentile_threshold, self.file_type)
         else:
             if self.file_type == 'pVACbind' or self.file_type == 'pVACfuse':
                 if self.top_score_metric == 'median':
@@ -49,7 +52,7 @@ class BindingFilter:
                     column = 'Corresponding Fold Change'
                 filter_criteria.append(FilterCriterion(column, '>=', self.minimum_fold_change, exclude_nas=self.exclude_nas))
 
-            Filter(self.input_file, self.output_file, filter_criteria).execute()
+            return Filter(self.input_file, self.output_file, filter_criteria)
 
     @classmethod
     def parser(cls, tool):
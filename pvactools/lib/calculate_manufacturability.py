@@ -53,11 +53,14 @@ class CalculateManufacturability:
                 writer = csv.DictWriter(output_fh, delimiter = "\t", fieldnames=reader.fieldnames + self.manufacturability_headers(), extrasaction='ignore', restval='NA')
                 writer.writeheader()
                 for line in reader:
-                    if self.file_type == 'pVACbind' or self.file_type == 'pVACfuse':
-                        sequence = line['Epitope Seq']
-                    else:
-                        sequence = line['MT Epitope Seq']
-                    if len(sequence) >= 7:
-                        scores = ManufacturabilityScores.from_amino_acids(sequence)
-                        line = self.append_manufacturability_metrics(line, scores)
-                    writer.writerow(line)
+                    writer.writerow(self.annotate(line))
+
+    def annotate(self, line):
+        if self.file_type == 'pVACbind' or self.file_type == 'pVACfuse':
+            sequence = line['Epitope Seq']
+        else:
+            sequence = line['MT Epitope Seq']
+        if len(sequence) >= 7:
+            scores = ManufacturabilityScores.from_amino_acids(sequence)
+            line = self.append_manufacturability_metrics(line, scores)
+        return line
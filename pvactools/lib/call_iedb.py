@@ -2,21 +2,27 @@ import sys
 import os
 import argparse
 import re
+import tempfile
 from subprocess import run, PIPE
 
 from pvactools.lib.prediction_class import *
+from pvactools.lib.prediction_cache import PredictionCache
+import pvactools.lib.prediction_cache
 
 def main(args_input = sys.argv[1:]):
     parser = argparse.ArgumentParser('pvacseq call_iedb', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument('input_file',
                         help="Input FASTA file")
     parser.add_argument('output_file',
-                        help="Output file from iedb")
+                        help="Output file from iedb. "
+                             + "When predicting for multiple alleles, a comma-separated list of output files in the same order as the alleles.")
     parser.add_argument('method',
                         choices=PredictionClass.prediction_methods(),
                         help="The iedb analysis method to use")
     parser.add_argument('allele',
-                        help="Allele for which to make prediction")
+                        help="Allele for which to make prediction. "
+                             + "Multiple alleles can be specified using a comma-separated list. "
+                             + "Methods that support multi-allele input will predict all alleles in a single call.")
     parser.add_argument('-l', '--epitope-length', type=int, choices=[8,9,10,11,12,13,14,15,16,17,18,19,20,21,22,23,24,25,26,27,28,29,30],
                         help="Length of subpeptides (epitopes) to predict")
     parser.add_argument(
@@ -24,6 +30,21 @@ def main(args_input = sys.argv[1:]):
         default=5,
         help="Number of retries when making requests to the IEDB RESTful web interface. Must be less than or equal to 100."
     )
+    parser.add_argument(
+        "--iedb-requests-per-second", type=float,
+        help="Maximum number of requests per second made to the IEDB RESTful web interface. "
+             + "The limit is shared with all other call_iedb processes using the same --iedb-state-dir."
+    )
+    parser.add_argument(
+        "--iedb-max-concurrent-requests", type=int,
+        help="Maximum number of simultaneous requests to the IEDB RESTful web interface. "
+             + "The limit is shared with all other call_iedb processes using the same --iedb-state-dir."
+    )
+    parser.add_argument(
+        "--iedb-state-dir",
+        help="Directory of the request limits and backoffs shared by call_iedb processes making requests to the IEDB RESTful web interface. "
+             + "Defaults to --tmp-dir."
+    )
     parser.add_argument(
         "-e", "--iedb-executable-path",
         help="The executable path of the local IEDB install"
@@ -32,27 +53,123 @@ def main(args_input = sys.argv[1:]):
                         help="Location to write tmp files to")
     parser.add_argument('--log-dir',
                         help="Location to write log files to")
+    parser.add_argument('--prediction-cache',
+                        help="SQLite database of previously made predictions. Only peptides missing from the cache are predicted.")
+    parser.add_argument('--in-process', action='store_true', default=False,
+                        help="Load the prediction algorithm into this process instead of launching a new process for every prediction. "
+                             + "Models are loaded once and reused by subsequent calls from the same process. "
+                             + "Only supported by MHCflurry, MHCflurryEL, MHCnuggetsI, and MHCnuggetsII.")
     args = parser.parse_args(args_input)
 
+    if args.iedb_requests_per_second is not None and args.iedb_requests_per_second <= 0:
+        sys.exit("The number of IEDB requests per second must be greater than 0")
+    if args.iedb_max_concurrent_requests is not None and args.iedb_max_concurrent_requests < 1:
+        sys.exit("The maximum number of concurrent IEDB requests must be at least 1")
+    if args.iedb_state_dir is None:
+        args.iedb_state_dir = args.tmp_dir
+
+    alleles = args.allele.split(',')
+    output_files = args.output_file.split(',')
+    if len(alleles) != len(output_files):
+        sys.exit("The number of output files ({}) doesn't match the number of alleles ({}).".format(len(output_files), len(alleles)))
+
     prediction_class = getattr(sys.modules[__name__], args.method)
     prediction_class_object = prediction_class()
+    if args.in_process and prediction_class_object.supports_in_process:
+        prediction_class_object.in_process = True
+    if isinstance(prediction_class_object, IEDB):
+        prediction_class_object.iedb_requests_per_second = args.iedb_requests_per_second
+        prediction_class_object.iedb_max_concurrent_requests = args.iedb_max_concurrent_requests
+        if args.iedb_state_dir is None:
+            if args.iedb_requests_per_second is not None or args.iedb_max_concurrent_requests is not None:
+                sys.exit("--iedb-state-dir or --tmp-dir is required to limit the IEDB requests")
+            #Without limits the state is only used for the backoffs of this process
+            state_dir = tempfile.TemporaryDirectory()
+            args.iedb_state_dir = state_dir.name
+        prediction_class_object.iedb_state_dir = args.iedb_state_dir
+
+    if args.prediction_cache is None:
+        responses = predict_alleles(prediction_class_object, args.input_file, alleles, args)
+        predicted_peptides = None
+    else:
+        (responses, predicted_peptides) = predict_with_cache(prediction_class_object, alleles, args)
+
+    for (allele, output_file) in zip(alleles, output_files):
+        (response_text, output_mode) = responses[allele]
+        write_output(response_text, output_mode, output_file)
+
+    #The number of peptide and allele combinations that were predicted instead of taken from the prediction cache
+    return predicted_peptides
 
+def predict(prediction_class_object, input_file, allele, args):
     try:
-        (response_text, output_mode) = prediction_class_object.predict(args.input_file, args.allele, args.epitope_length, args.iedb_executable_path, args.iedb_retries, tmp_dir=args.tmp_dir, log_dir=args.log_dir)
+        return prediction_class_object.predict(input_file, allele, args.epitope_length, args.iedb_executable_path, args.iedb_retries, tmp_dir=args.tmp_dir, log_dir=args.log_dir)
     except Exception as err:
         if str(err) == 'len(peptide_list) != len(scores)':
-            (response_text, output_mode) = prediction_class_object.predict(args.input_file, args.allele, args.epitope_length, args.iedb_executable_path, args.iedb_retries, tmp_dir=args.tmp_dir, log_dir=args.log_dir)
+            return prediction_class_object.predict(input_file, allele, args.epitope_length, args.iedb_executable_path, args.iedb_retries, tmp_dir=args.tmp_dir, log_dir=args.log_dir)
         else:
             raise err
 
-    tmp_output_file = args.output_file + '.tmp'
+def predict_alleles(prediction_class_object, input_file, alleles, args):
+    if len(alleles) == 1:
+        return {alleles[0]: predict(prediction_class_object, input_file, alleles[0], args)}
+    if not prediction_class_object.supports_multiple_alleles:
+        return {allele: predict(prediction_class_object, input_file, allele, args) for allele in alleles}
+
+    (df, output_mode) = predict(prediction_class_object, input_file, alleles, args)
+    if df.empty:
+        return {allele: (df, output_mode) for allele in alleles}
+    unknown_alleles = set(df['allele']) - set(alleles)
+    if len(unknown_alleles) > 0:
+        raise Exception("Predictions for alleles {} don't match the requested alleles {}".format(", ".join(sorted(unknown_alleles)), ", ".join(alleles)))
+    return {allele: (df[df['allele'] == allele], output_mode) for allele in alleles}
+
+def predict_with_cache(prediction_class_object, alleles, args):
+    positions = pvactools.lib.prediction_cache.kmer_positions(args.input_file, args.epitope_length)
+    if len(positions) == 0:
+        return (predict_alleles(prediction_class_object, args.input_file, alleles, args), 0)
+
+    cache = PredictionCache(args.prediction_cache)
+    version = PredictionCache.predictor_version(args.method, prediction_class_object, args.iedb_executable_path)
+    peptides = set([peptide for (seq_num, start, peptide) in positions])
+    cached_rows = {}
+    missing_peptides = set()
+    alleles_with_missing_peptides = []
+    for allele in alleles:
+        cached_rows[allele] = cache.lookup(args.method, version, allele, peptides)
+        missing_allele_peptides = peptides - set(cached_rows[allele].keys())
+        if len(missing_allele_peptides) > 0:
+            missing_peptides.update(missing_allele_peptides)
+            alleles_with_missing_peptides.append(allele)
+
+    predicted_peptides = len(missing_peptides) * len(alleles_with_missing_peptides)
+    if len(missing_peptides) > 0:
+        missing_peptides_file = tempfile.NamedTemporaryFile('w', dir=args.tmp_dir, suffix='.fa', delete=False)
+        missing_peptides_file.close()
+        pvactools.lib.prediction_cache.write_missing_peptides_fasta(sorted(missing_peptides), missing_peptides_file.name)
+        try:
+            responses = predict_alleles(prediction_class_object, missing_peptides_file.name, alleles_with_missing_peptides, args)
+        finally:
+            os.unlink(missing_peptides_file.name)
+        for (allele, (response, output_mode)) in responses.items():
+            response_df = pvactools.lib.prediction_cache.response_to_dataframe(response, output_mode)
+            new_rows = pvactools.lib.prediction_cache.rows_by_peptide(response_df, missing_peptides)
+            cache.store(args.method, version, allele, new_rows)
+            cached_rows[allele].update(new_rows)
+    cache.close()
+
+    group_by_peptide = prediction_class_object.groups_rows_by_peptide
+    return ({allele: (pvactools.lib.prediction_cache.relocate_cached_rows(positions, cached_rows[allele], group_by_peptide), 'pandas') for allele in alleles}, predicted_peptides)
+
+def write_output(response_text, output_mode, output_file):
+    tmp_output_file = output_file + '.tmp'
     if output_mode == 'pandas':
         response_text.to_csv(tmp_output_file, index=False, sep="\t")
     else:
         tmp_output_filehandle = open(tmp_output_file, output_mode)
         tmp_output_filehandle.write(response_text)
         tmp_output_filehandle.close()
-    os.replace(tmp_output_file, args.output_file)
+    os.replace(tmp_output_file, output_file)
 
 if __name__ == "__main__":
     main()
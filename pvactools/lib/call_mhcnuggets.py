@@ -65,16 +65,14 @@ def main(args_input = sys.argv[1:]):
     os.unlink(tmp_output_file.name)
 
     df = pd.read_csv(rank_output_file_name)
-    processed_df = pd.DataFrame()
-    for index, row in df.iterrows():
-        seq_nums = epitope_seq_nums[row['peptide']]
-        for seq_num, start in seq_nums:
-            new_row = row.copy().to_dict()
-            new_row['seq_num'] = seq_num
-            new_row['start'] = start
-            new_row['allele'] = args.allele
-            new_row['percentile'] = float(row['human_proteome_rank']) * 100
-            processed_df = pd.concat([processed_df, pd.DataFrame.from_records(new_row, index=[0])], ignore_index=True)
+    positions_df = pd.DataFrame(
+        [(epitope, seq_num, start) for epitope, seq_nums in epitope_seq_nums.items() for seq_num, start in seq_nums],
+        columns=['peptide', 'seq_num', 'start']
+    )
+    df['row'] = range(len(df))
+    processed_df = df.merge(positions_df, on='peptide', how='inner').sort_values('row', kind='stable')
+    processed_df['allele'] = args.allele
+    processed_df['percentile'] = processed_df['human_proteome_rank'].astype(float) * 100
     processed_df['start'] = pd.to_numeric(processed_df['start'], downcast='integer')
     processed_df = processed_df[['peptide', 'ic50', 'percentile', 'seq_num', 'start', 'allele']]
     processed_df.to_csv(args.output_file, index=False)
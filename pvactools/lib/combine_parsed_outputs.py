@@ -1,14 +1,17 @@
 import argparse
 import sys
 import csv
+import itertools
 import pvactools.lib.sort
+import pvactools.lib.epitope_table
 
 def main(args_input = sys.argv[1:]):
     parser = argparse.ArgumentParser('pvacseq combine_parsed_outputs', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument(
         'input_files',
         nargs="+",
-        help="List of parsed epitope files for different allele-length combinations (same sample)."
+        help="List of parsed epitope files for different allele-length combinations (same sample). "
+             + "The files can be TSV or Parquet files."
     )
     parser.add_argument(
         'output_file', type=argparse.FileType('w'),
@@ -28,27 +31,59 @@ def main(args_input = sys.argv[1:]):
         default='pVACseq',
         help="Pipeline that created files to be combined."
     )
+    parser.add_argument(
+        '--sort',
+        action='store_true',
+        default=False,
+        help="Sort the combined rows by the top score metric. The rows are sorted in runs that are written "
+             + "to temporary files and merged so that the combined rows don't need to fit into memory."
+    )
     args = parser.parse_args(args_input)
 
+    input_fieldnames = {}
     fieldnames = []
     for input_file in args.input_files:
-        with open(input_file, 'r') as input_file_handle:
-            reader = csv.DictReader(input_file_handle, delimiter='\t')
-            if len(fieldnames) == 0:
-                fieldnames = reader.fieldnames
-            else:
-                for fieldname in reader.fieldnames:
-                    if fieldname not in fieldnames:
-                        fieldnames.append(fieldname)
+        input_fieldnames[input_file] = pvactools.lib.epitope_table.fieldnames(input_file)
+        for fieldname in input_fieldnames[input_file]:
+            if fieldname not in fieldnames:
+                fieldnames.append(fieldname)
 
-    tsv_writer = csv.DictWriter(args.output_file, list(fieldnames), delimiter = '\t', lineterminator = '\n', restval='NA')
+    tsv_writer = csv.DictWriter(args.output_file, fieldnames, delimiter = '\t', lineterminator = '\n', restval='NA')
     tsv_writer.writeheader()
-    for input_file in args.input_files:
-        with open(input_file, 'r') as input_file_handle:
-            reader = csv.DictReader(input_file_handle, delimiter='\t')
-            for row in reader:
-                tsv_writer.writerow(row)
+    if args.sort:
+        rows = itertools.chain(*[pvactools.lib.epitope_table.reader(input_file) for input_file in args.input_files])
+        tsv_writer.writerows(pvactools.lib.sort.external_sort(rows, sort_key(args.file_type, args.top_score_metric), fieldnames))
+    else:
+        for input_file in args.input_files:
+            if input_fieldnames[input_file] == fieldnames and not pvactools.lib.epitope_table.is_parquet(input_file):
+                copy_lines(input_file, fieldnames, args.output_file)
+            else:
+                tsv_writer.writerows(pvactools.lib.epitope_table.reader(input_file))
     args.output_file.close()
+    if args.output_file is not sys.stdout:
+        pvactools.lib.epitope_table.index_columnar_files(args.output_file.name, args.input_files)
+
+def sort_key(file_type, top_score_metric):
+    if file_type == 'pVACseq':
+        return pvactools.lib.sort.default_sort_key(top_score_metric)
+    else:
+        return pvactools.lib.sort.pvacbind_sort_key(top_score_metric)
+
+def copy_lines(input_file, fieldnames, output_fh):
+    #Lines of a TSV with the combined header are copied without parsing them. Once a line needs
+    #quoting or doesn't have one value per column the rest of the file is parsed as a TSV.
+    with open(input_file, 'r', newline='') as input_fh:
+        next(input_fh, None)
+        for line in input_fh:
+            stripped_line = line.rstrip('\r\n')
+            if '"' in stripped_line or '\r' in stripped_line or stripped_line.count('\t') != len(fieldnames) - 1:
+                break
+            output_fh.write(stripped_line + '\n')
+        else:
+            return
+        reader = csv.DictReader(itertools.chain([line], input_fh), fieldnames=fieldnames, delimiter='\t')
+        writer = csv.DictWriter(output_fh, fieldnames, delimiter = '\t', lineterminator = '\n', restval='NA')
+        writer.writerows(reader)
 
 if __name__ == "__main__":
     main()
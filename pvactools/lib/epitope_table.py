@@ -0,0 +1,126 @@
+import os
+import io
+import sys
+import csv
+import yaml
+import pandas as pd
+import polars as pl
+
+csv.field_size_limit(sys.maxsize)
+
+#Parsed epitope tables can be written as Parquet files instead of TSVs. All values are stored as strings so that
+#a table converted to TSV is identical to one that was written as a TSV directly. A TSV combined from Parquet files
+#gets an index of those files so that steps that only need some of its columns can read them from the Parquet files.
+#This only pays off for column-projected reads, i.e. the pVACseq aggregation. Reads of all columns and reads of a TSV
+#that has been rewritten since it was combined fall back to parsing the TSV.
+formats = ['tsv', 'parquet']
+
+def is_parquet(path):
+    with open(path, 'rb') as fh:
+        return fh.read(4) == b'PAR1'
+
+def fieldnames(path):
+    if is_parquet(path):
+        return pl.read_parquet(path, n_rows=0).columns
+    with open(path, 'r') as fh:
+        return csv.DictReader(fh, delimiter='\t').fieldnames
+
+def reader(path):
+    if is_parquet(path):
+        yield from pl.read_parquet(path).iter_rows(named=True)
+    else:
+        with open(path, 'r') as fh:
+            yield from csv.DictReader(fh, delimiter='\t')
+
+class DictWriter:
+    #Same interface as csv.DictWriter. In parquet format the rows are collected per column and
+    #written when the writer is closed.
+    def __init__(self, path, fieldnames, output_format='tsv', **kwargs):
+        if output_format not in formats:
+            raise Exception("Unknown output format {}".format(output_format))
+        self.path = path
+        self.fieldnames = list(fieldnames)
+        self.output_format = output_format
+        if output_format == 'tsv':
+            self.fh = open(path, 'w')
+            self.writer = csv.DictWriter(self.fh, self.fieldnames, delimiter='\t', **kwargs)
+        else:
+            self.restval = kwargs.get('restval', '')
+            self.columns = {fieldname: [] for fieldname in self.fieldnames}
+
+    def writeheader(self):
+        if self.output_format == 'tsv':
+            self.writer.writeheader()
+
+    def writerow(self, row):
+        if self.output_format == 'tsv':
+            return self.writer.writerow(row)
+        extra_fieldnames = [k for k in row.keys() if k not in self.columns]
+        if len(extra_fieldnames) > 0:
+            raise ValueError("dict contains fields not in fieldnames: {}".format(", ".join([repr(x) for x in extra_fieldnames])))
+        for (fieldname, values) in self.columns.items():
+            value = row.get(fieldname, self.restval)
+            values.append('' if value is None else str(value))
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def close(self):
+        if self.output_format == 'tsv':
+            self.fh.close()
+        else:
+            pl.DataFrame([pl.Series(fieldname, values, dtype=pl.Utf8) for (fieldname, values) in self.columns.items()]).write_parquet(self.path)
+
+def columnar_index_path(tsv_file):
+    return "{}.columnar.yml".format(tsv_file)
+
+def index_columnar_files(tsv_file, input_files):
+    #Records the Parquet files a TSV was combined from. The index is only valid as long as the TSV is unchanged.
+    index_file = columnar_index_path(tsv_file)
+    if len(input_files) == 0 or not all([is_parquet(input_file) for input_file in input_files]):
+        if os.path.exists(index_file):
+            os.unlink(index_file)
+        return
+    stat = os.stat(tsv_file)
+    index = {
+        'tsv_size': stat.st_size,
+        'tsv_mtime_ns': stat.st_mtime_ns,
+        'parquet_files': [os.path.relpath(os.path.abspath(f), os.path.dirname(os.path.abspath(tsv_file))) for f in input_files],
+    }
+    with open(index_file, 'w') as fh:
+        yaml.dump(index, fh, default_flow_style=False)
+
+def columnar_files(tsv_file):
+    index_file = columnar_index_path(tsv_file)
+    if not os.path.exists(index_file):
+        return None
+    with open(index_file, 'r') as fh:
+        index = yaml.load(fh, Loader=yaml.FullLoader)
+    stat = os.stat(tsv_file)
+    if stat.st_size != index['tsv_size'] or stat.st_mtime_ns != index['tsv_mtime_ns']:
+        return None
+    parquet_files = [os.path.join(os.path.dirname(os.path.abspath(tsv_file)), f) for f in index['parquet_files']]
+    if not all([os.path.exists(f) for f in parquet_files]):
+        return None
+    return parquet_files
+
+def read_csv(tsv_file, usecols=None, **kwargs):
+    #Equivalent to pd.read_csv(tsv_file, delimiter='\t', usecols=usecols, **kwargs) but only the used columns
+    #are read if the TSV was combined from Parquet files
+    parquet_files = None if usecols is None or 'nrows' in kwargs else columnar_files(tsv_file)
+    if parquet_files is None:
+        return pd.read_csv(tsv_file, delimiter='\t', usecols=usecols, **kwargs)
+    with open(tsv_file, 'r') as fh:
+        header = next(csv.reader(fh, delimiter='\t'))
+    columns = [c for c in header if c in usecols]
+    tsv = io.BytesIO()
+    tsv.write("{}\n".format("\t".join(columns)).encode())
+    for parquet_file in parquet_files:
+        available_columns = fieldnames(parquet_file)
+        df = pl.read_parquet(parquet_file, columns=[c for c in columns if c in available_columns] or available_columns[0:1])
+        df = df.select([pl.col(c) if c in available_columns else pl.lit('NA').alias(c) for c in columns])
+        if df.height > 0:
+            df.write_csv(tsv, has_header=False, separator='\t')
+    tsv.seek(0)
+    return pd.read_csv(tsv, delimiter='\t', usecols=usecols, **kwargs)
@@ -1,10 +1,15 @@
 import pandas as pd
 import csv
 import sys
+import operator
+import itertools
 
 pd.options.mode.chained_assignment = None
 
 class Filter:
+    #Number of rows whose criteria are evaluated together
+    batch_size = 100000
+
     def __init__(self, input_file, output_file, filter_criteria, int_filter_columns=[]):
         self.input_file = input_file
         self.output_file = output_file
@@ -16,27 +21,80 @@ class Filter:
             reader = csv.DictReader(read_fh, delimiter="\t")
             writer = csv.DictWriter(write_fh, delimiter='\t', fieldnames = reader.fieldnames, lineterminator="\n")
             writer.writeheader()
-            for line in reader:
-                to_filter = False
-                for criterion in self.filter_criteria:
-                    value = line[criterion.column]
-                    if value == 'inf':
-                        value = sys.maxsize
-                    if value == 'NA':
-                        if criterion.exclude_nas:
-                            to_filter = True
-                    elif criterion.skip_value is not None and value == criterion.skip_value:
-                        pass
-                    else:
-                        if not eval("{} {} {}".format(value, criterion.operator, criterion.threshold)):
-                            to_filter = True
-                if not to_filter:
-                    writer.writerow(line)
+            if len(self.filter_criteria) > 0 and reader.fieldnames is not None and all([c.column in reader.fieldnames for c in self.filter_criteria]):
+                for lines in iter(lambda: list(itertools.islice(reader, self.batch_size)), []):
+                    for (line, passes) in zip(lines, self.passing_rows(lines)):
+                        if passes:
+                            writer.writerow(line)
+            else:
+                for line in reader:
+                    if self.passes(line):
+                        writer.writerow(line)
+
+    def passing_rows(self, lines):
+        #Evaluates the criteria on the columns of the lines instead of line by line
+        columns = set(c.column for c in self.filter_criteria)
+        df = pd.DataFrame({column: [line[column] for line in lines] for column in columns}, index=range(len(lines)), dtype=str)
+        mask = pd.Series(True, index=df.index)
+        for criterion in self.filter_criteria:
+            mask &= criterion.passing_rows(df[criterion.column])
+        return mask.tolist()
+
+    def passes(self, line):
+        for criterion in self.filter_criteria:
+            if not criterion.passes(line[criterion.column]):
+                return False
+        return True
+
+def numeric_value(value):
+    #Values are compared as the Python number literals they represent
+    if isinstance(value, (int, float)):
+        return value
+    if value == 'inf':
+        return sys.maxsize
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
 
 class FilterCriterion:
+    comparators = {
+        '<' : operator.lt,
+        '<=': operator.le,
+        '==': operator.eq,
+        '!=': operator.ne,
+        '>=': operator.ge,
+        '>' : operator.gt,
+    }
+
     def __init__(self, column, operator, threshold, exclude_nas=False, skip_value=None):
+        if operator not in FilterCriterion.comparators:
+            raise Exception("Unknown filter operator {}".format(operator))
         self.column = column
         self.operator = operator
         self.threshold = threshold
         self.exclude_nas = exclude_nas
         self.skip_value = skip_value
+        self.comparator = FilterCriterion.comparators[operator]
+        try:
+            self.numeric_threshold = numeric_value(threshold)
+        except (TypeError, ValueError):
+            raise Exception("Threshold for filtering on {} needs to be a number: {}".format(column, threshold))
+
+    def passes(self, value):
+        if value == 'NA':
+            return not self.exclude_nas
+        if self.skip_value is not None and value == self.skip_value:
+            return True
+        return self.comparator(numeric_value(value), self.numeric_threshold)
+
+    def passing_rows(self, values):
+        na = values == 'NA'
+        compared = ~na
+        if self.skip_value is not None:
+            compared &= values != self.skip_value
+        mask = pd.Series(True, index=values.index)
+        mask[na] = not self.exclude_nas
+        numeric_values = pd.to_numeric(values[compared].replace('inf', str(sys.maxsize)))
+        mask[compared] = self.comparator(numeric_values, self.numeric_threshold)
+        return mask
@@ -0,0 +1,112 @@
+import os
+import time
+import fcntl
+import random
+import uuid
+import requests
+from requests.adapters import HTTPAdapter
+
+from pvactools.lib.shared_state import SharedState
+
+class TokenBucket:
+    def __init__(self, shared_state, requests_per_second, capacity=None):
+        self.shared_state = shared_state
+        self.requests_per_second = requests_per_second
+        if capacity is None and requests_per_second is not None:
+            capacity = max(1, requests_per_second)
+        self.capacity = capacity
+
+    def take(self, state):
+        now = time.time()
+        #A pause set by a failed request applies to all workers
+        paused_until = state.get('paused_until', 0)
+        if paused_until > now:
+            return (state, paused_until - now)
+        if self.requests_per_second is None:
+            return (state, 0)
+        tokens = state.get('tokens', self.capacity)
+        last_refill = state.get('last_refill', now)
+        tokens = min(self.capacity, tokens + (now - last_refill) * self.requests_per_second)
+        state['last_refill'] = now
+        if tokens >= 1:
+            state['tokens'] = tokens - 1
+            return (state, 0)
+        state['tokens'] = tokens
+        return (state, (1 - tokens) / self.requests_per_second)
+
+    def acquire(self):
+        while True:
+            wait = self.shared_state.update(self.take)
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        def set_pause(state):
+            state['paused_until'] = max(state.get('paused_until', 0), time.time() + seconds)
+            return (state, None)
+        self.shared_state.update(set_pause)
+
+class ConcurrencyLimiter:
+    #Counting semaphore made of lock files. Locks are released by the OS if a worker dies.
+    poll_interval = 0.1
+
+    def __init__(self, slot_file_prefix, max_concurrent_requests):
+        self.slot_file_prefix = slot_file_prefix
+        self.max_concurrent_requests = max_concurrent_requests
+        self.slot_fh = None
+
+    def __enter__(self):
+        if self.max_concurrent_requests is None:
+            return self
+        while True:
+            for slot in range(self.max_concurrent_requests):
+                slot_fh = open("{}.{}".format(self.slot_file_prefix, slot), 'a')
+                try:
+                    fcntl.flock(slot_fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    slot_fh.close()
+                    continue
+                self.slot_fh = slot_fh
+                return self
+            time.sleep(self.poll_interval)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.slot_fh is not None:
+            fcntl.flock(self.slot_fh, fcntl.LOCK_UN)
+            self.slot_fh.close()
+            self.slot_fh = None
+
+class IEDBClient:
+    #Sessions are kept per process because connections can't be shared with forked workers
+    sessions = {}
+
+    def __init__(self, url, state_dir, requests_per_second=None, max_concurrent_requests=None, backoff_range=(30, 90)):
+        #All clients that share a state directory share the request rate, concurrency limit, and backoffs
+        self.url = url
+        state_file_prefix = os.path.join(state_dir, "iedb_client")
+        self.token_bucket = TokenBucket(SharedState("{}.state".format(state_file_prefix)), requests_per_second)
+        self.concurrency_limiter = ConcurrencyLimiter("{}.slot".format(state_file_prefix), max_concurrent_requests)
+        self.max_concurrent_requests = max_concurrent_requests
+        self.backoff_range = backoff_range
+
+    def session(self):
+        key = (os.getpid(), self.url)
+        if key not in IEDBClient.sessions:
+            pool_size = self.max_concurrent_requests if self.max_concurrent_requests is not None else 10
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            IEDBClient.sessions[key] = session
+        return IEDBClient.sessions[key]
+
+    def post(self, data):
+        self.token_bucket.acquire()
+        with self.concurrency_limiter:
+            return self.session().post(self.url, data=data)
+
+    def backoff(self, retries):
+        #Pause all workers instead of only the one that received the error
+        random.seed(uuid.uuid4().int)
+        self.token_bucket.pause(random.randint(*self.backoff_range) * retries)
@@ -6,9 +6,12 @@ import operator
 import os
 from math import ceil, inf
 from statistics import median
+from array import array
+from contextlib import ExitStack
 import yaml
 
 from pvactools.lib.prediction_class import PredictionClass
+import pvactools.lib.epitope_table
 
 csv.field_size_limit(sys.maxsize)
 
@@ -21,6 +24,7 @@ class OutputParser(metaclass=ABCMeta):
         self.sample_name             = kwargs['sample_name']
         self.add_sample_name         = kwargs.get('add_sample_name_column')
         self.flurry_state            = kwargs.get('flurry_state')
+        self.output_format           = kwargs.get('output_format', 'tsv')
 
     def parse_input_tsv_file(self):
         with open(self.input_tsv_file, 'r') as reader:
@@ -394,23 +398,22 @@ class OutputParser(metaclass=ABCMeta):
             result['wt_epitope_position'] = best_match_position
 
     def match_wildtype_and_mutant_entries(self, iedb_results, wt_iedb_results):
+        #Group the MT results by TSV index once so that the epitopes of each variant are matched in a single pass in position order
+        iedb_results_by_wt_iedb_result_key = {}
         for key in sorted(iedb_results.keys(), key = lambda x: int(x.split('|')[-1])):
-            result = iedb_results[key]
             (wt_iedb_result_key, mt_position) = key.split('|', 1)
-            previous_mt_position = str(int(mt_position)-1)
-            previous_key = '|'.join([wt_iedb_result_key, previous_mt_position])
-            if previous_key in iedb_results:
-                previous_result = iedb_results[previous_key]
-            else:
-                previous_result = None
+            iedb_results_by_wt_iedb_result_key.setdefault(wt_iedb_result_key, {})[mt_position] = iedb_results[key]
+
+        for (wt_iedb_result_key, iedb_results_for_wt_iedb_result_key) in iedb_results_by_wt_iedb_result_key.items():
             wt_results = wt_iedb_results[wt_iedb_result_key]
-            if result['variant_type'] == 'missense':
-                self.match_wildtype_and_mutant_entry_for_missense(result, mt_position, wt_results, previous_result)
-            elif result['variant_type'] == 'FS':
-                self.match_wildtype_and_mutant_entry_for_frameshift(result, mt_position, wt_results, previous_result)
-            elif result['variant_type'] == 'inframe_ins' or result['variant_type'] == 'inframe_del':
-                iedb_results_for_wt_iedb_result_key = dict([(key,value) for key, value in iedb_results.items() if key.startswith(wt_iedb_result_key)])
-                self.match_wildtype_and_mutant_entry_for_inframe_indel(result, mt_position, wt_results, previous_result, iedb_results_for_wt_iedb_result_key)
+            for (mt_position, result) in iedb_results_for_wt_iedb_result_key.items():
+                previous_result = iedb_results_for_wt_iedb_result_key.get(str(int(mt_position)-1))
+                if result['variant_type'] == 'missense':
+                    self.match_wildtype_and_mutant_entry_for_missense(result, mt_position, wt_results, previous_result)
+                elif result['variant_type'] == 'FS':
+                    self.match_wildtype_and_mutant_entry_for_frameshift(result, mt_position, wt_results, previous_result)
+                elif result['variant_type'] == 'inframe_ins' or result['variant_type'] == 'inframe_del':
+                    self.match_wildtype_and_mutant_entry_for_inframe_indel(result, mt_position, wt_results, previous_result, iedb_results_for_wt_iedb_result_key)
 
         return iedb_results
 
@@ -644,182 +647,242 @@ class OutputParser(metaclass=ABCMeta):
             # This covers cases where the allele/length of the result row is not supported by the prediction algorithm
             row['%s %s' % (pretty_method, suffix)] = 'NA'
 
-    def execute(self):
+    def variant_iedb_results(self):
         tsv_entries = self.parse_input_tsv_file()
-        iedb_results = self.process_input_iedb_file(tsv_entries)
+        yield (tsv_entries, self.process_input_iedb_file(tsv_entries))
 
+    def execute(self):
         tmp_output_file = self.output_file + '.tmp'
-        tmp_output_filehandle = open(tmp_output_file, 'w')
-        tsv_writer = csv.DictWriter(tmp_output_filehandle, delimiter='\t', fieldnames=self.output_headers())
+        tsv_writer = pvactools.lib.epitope_table.DictWriter(tmp_output_file, self.output_headers(), self.output_format)
         tsv_writer.writeheader()
 
-        for (
-            gene_name,
-            variant_aa,
-            position,
-            mutation_position,
-            mt_scores,
-            wt_scores,
-            mt_percentiles,
-            wt_percentiles,
-            wt_epitope_seq,
-            mt_epitope_seq,
-            tsv_index,
-            allele,
-            peptide_length,
-            best_mt_score,
-            corresponding_wt_score,
-            best_mt_score_method,
-            median_mt_score,
-            median_wt_score,
-            best_mt_percentile,
-            corresponding_wt_percentile,
-            best_mt_percentile_method,
-            median_mt_percentile,
-            median_wt_percentile,
-        ) in iedb_results:
-            tsv_entry = tsv_entries[tsv_index]
-            if mt_epitope_seq != wt_epitope_seq:
-                if corresponding_wt_score == 'NA':
-                    corresponding_fold_change = 'NA'
-                elif best_mt_score == 0:
-                    corresponding_fold_change = inf
-                    corresponding_wt_score = round(corresponding_wt_score, 3)
-                else:
-                    corresponding_fold_change = round((corresponding_wt_score/best_mt_score), 3)
-                    corresponding_wt_score = round(corresponding_wt_score, 3)
-
-                if median_wt_score == 'NA':
-                    median_fold_change = 'NA'
-                elif median_mt_score == 0:
-                    median_fold_change = inf
-                    median_wt_score = round(median_wt_score, 3)
-                else:
-                    median_fold_change = round((median_wt_score/median_mt_score), 3)
-                    median_wt_score = round(median_wt_score, 3)
-                row = {
-                    'Chromosome'          : tsv_entry['chromosome_name'],
-                    'Start'               : tsv_entry['start'],
-                    'Stop'                : tsv_entry['stop'],
-                    'Reference'           : tsv_entry['reference'],
-                    'Variant'             : tsv_entry['variant'],
-                    'Transcript'          : tsv_entry['transcript_name'],
-                    'Transcript Support Level': tsv_entry['transcript_support_level'],
-                    'Transcript Length'   : tsv_entry['transcript_length'],
-                    'Biotype'             : tsv_entry['biotype'],
-                    'Ensembl Gene ID'     : tsv_entry['ensembl_gene_id'],
-                    'HGVSc'               : tsv_entry['hgvsc'],
-                    'HGVSp'               : tsv_entry['hgvsp'],
-                    'Variant Type'        : tsv_entry['variant_type'],
-                    'Mutation'            : variant_aa,
-                    'Protein Position'    : tsv_entry['protein_position'],
-                    'Gene Name'           : gene_name,
-                    'HLA Allele'          : allele,
-                    'Peptide Length'      : peptide_length,
-                    'Sub-peptide Position': position,
-                    'Mutation Position'   : mutation_position,
-                    'MT Epitope Seq'      : mt_epitope_seq,
-                    'WT Epitope Seq'      : wt_epitope_seq,
-                    'Corresponding WT IC50 Score': corresponding_wt_score,
-                    'Corresponding Fold Change' : corresponding_fold_change,
-                    'Median WT IC50 Score'     : median_wt_score,
-                    'Median Fold Change'  : median_fold_change,
-                    'Index'               : tsv_index,
-                }
-                row['Best MT IC50 Score Method'] = 'NA' if best_mt_score_method == 'NA' else PredictionClass.prediction_class_name_for_iedb_prediction_method(best_mt_score_method)
-                row['Best MT Percentile Method'] = 'NA' if best_mt_percentile_method == 'NA' else PredictionClass.prediction_class_name_for_iedb_prediction_method(best_mt_percentile_method)
-                row['Best MT IC50 Score'] = 'NA' if best_mt_score == 'NA' else round(best_mt_score, 3)
-                row['Best MT Percentile'] = 'NA' if best_mt_percentile == 'NA' else round(best_mt_percentile, 3)
-                row['Corresponding WT Percentile'] = 'NA' if corresponding_wt_percentile == 'NA' else round(corresponding_wt_percentile, 3)
-                row['Median MT IC50 Score'] = 'NA' if median_mt_score == 'NA' else round(median_mt_score, 3)
-                row['Median MT Percentile'] = 'NA' if median_mt_percentile == 'NA' else round(median_mt_percentile, 3)
-                row['Median WT Percentile'] = 'NA' if median_wt_percentile == 'NA' else round(median_wt_percentile, 3)
-                for method in self.prediction_methods():
-                    pretty_method = PredictionClass.prediction_class_name_for_iedb_prediction_method(method)
-                    self.add_pretty_row(row, wt_scores, method, pretty_method, 'WT IC50 Score')
-                    self.add_pretty_row(row, mt_scores, method, pretty_method, 'MT IC50 Score')
-                    if pretty_method not in ['BigMHC_EL', 'BigMHC_IM', 'DeepImmuno']:
-                        self.add_pretty_row(row, wt_percentiles, method, pretty_method, 'WT Percentile')
-                        self.add_pretty_row(row, mt_percentiles, method, pretty_method, 'MT Percentile')
-
-                for (tsv_key, row_key) in zip(['gene_expression', 'transcript_expression', 'normal_vaf', 'tdna_vaf', 'trna_vaf'], ['Gene Expression', 'Transcript Expression', 'Normal VAF', 'Tumor DNA VAF', 'Tumor RNA VAF']):
-                    if tsv_key in tsv_entry:
-                        if tsv_entry[tsv_key] == 'NA':
-                            row[row_key] = 'NA'
-                        else:
-                            row[row_key] = round(float(tsv_entry[tsv_key]), 3)
-                for (tsv_key, row_key) in zip(['normal_depth', 'tdna_depth', 'trna_depth'], ['Normal Depth', 'Tumor DNA Depth', 'Tumor RNA Depth']):
-                    if tsv_key in tsv_entry:
-                        row[row_key] = tsv_entry[tsv_key]
-                if self.add_sample_name:
-                    row['Sample Name'] = self.sample_name
-                tsv_writer.writerow(row)
-
-        tmp_output_filehandle.close()
+        #The rows of each variant are written before the next variant is parsed
+        for (tsv_entries, iedb_results) in self.variant_iedb_results():
+            for (
+                gene_name,
+                variant_aa,
+                position,
+                mutation_position,
+                mt_scores,
+                wt_scores,
+                mt_percentiles,
+                wt_percentiles,
+                wt_epitope_seq,
+                mt_epitope_seq,
+                tsv_index,
+                allele,
+                peptide_length,
+                best_mt_score,
+                corresponding_wt_score,
+                best_mt_score_method,
+                median_mt_score,
+                median_wt_score,
+                best_mt_percentile,
+                corresponding_wt_percentile,
+                best_mt_percentile_method,
+                median_mt_percentile,
+                median_wt_percentile,
+            ) in iedb_results:
+                tsv_entry = tsv_entries[tsv_index]
+                if mt_epitope_seq != wt_epitope_seq:
+                    if corresponding_wt_score == 'NA':
+                        corresponding_fold_change = 'NA'
+                    elif best_mt_score == 0:
+                        corresponding_fold_change = inf
+                        corresponding_wt_score = round(corresponding_wt_score, 3)
+                    else:
+                        corresponding_fold_change = round((corresponding_wt_score/best_mt_score), 3)
+                        corresponding_wt_score = round(corresponding_wt_score, 3)
+
+                    if median_wt_score == 'NA':
+                        median_fold_change = 'NA'
+                    elif median_mt_score == 0:
+                        median_fold_change = inf
+                        median_wt_score = round(median_wt_score, 3)
+                    else:
+                        median_fold_change = round((median_wt_score/median_mt_score), 3)
+                        median_wt_score = round(median_wt_score, 3)
+                    row = {
+                        'Chromosome'          : tsv_entry['chromosome_name'],
+                        'Start'               : tsv_entry['start'],
+                        'Stop'                : tsv_entry['stop'],
+                        'Reference'           : tsv_entry['reference'],
+                        'Variant'             : tsv_entry['variant'],
+                        'Transcript'          : tsv_entry['transcript_name'],
+                        'Transcript Support Level': tsv_entry['transcript_support_level'],
+                        'Transcript Length'   : tsv_entry['transcript_length'],
+                        'Biotype'             : tsv_entry['biotype'],
+                        'Ensembl Gene ID'     : tsv_entry['ensembl_gene_id'],
+                        'HGVSc'               : tsv_entry['hgvsc'],
+                        'HGVSp'               : tsv_entry['hgvsp'],
+                        'Variant Type'        : tsv_entry['variant_type'],
+                        'Mutation'            : variant_aa,
+                        'Protein Position'    : tsv_entry['protein_position'],
+                        'Gene Name'           : gene_name,
+                        'HLA Allele'          : allele,
+                        'Peptide Length'      : peptide_length,
+                        'Sub-peptide Position': position,
+                        'Mutation Position'   : mutation_position,
+                        'MT Epitope Seq'      : mt_epitope_seq,
+                        'WT Epitope Seq'      : wt_epitope_seq,
+                        'Corresponding WT IC50 Score': corresponding_wt_score,
+                        'Corresponding Fold Change' : corresponding_fold_change,
+                        'Median WT IC50 Score'     : median_wt_score,
+                        'Median Fold Change'  : median_fold_change,
+                        'Index'               : tsv_index,
+                    }
+                    row['Best MT IC50 Score Method'] = 'NA' if best_mt_score_method == 'NA' else PredictionClass.prediction_class_name_for_iedb_prediction_method(best_mt_score_method)
+                    row['Best MT Percentile Method'] = 'NA' if best_mt_percentile_method == 'NA' else PredictionClass.prediction_class_name_for_iedb_prediction_method(best_mt_percentile_method)
+                    row['Best MT IC50 Score'] = 'NA' if best_mt_score == 'NA' else round(best_mt_score, 3)
+                    row['Best MT Percentile'] = 'NA' if best_mt_percentile == 'NA' else round(best_mt_percentile, 3)
+                    row['Corresponding WT Percentile'] = 'NA' if corresponding_wt_percentile == 'NA' else round(corresponding_wt_percentile, 3)
+                    row['Median MT IC50 Score'] = 'NA' if median_mt_score == 'NA' else round(median_mt_score, 3)
+                    row['Median MT Percentile'] = 'NA' if median_mt_percentile == 'NA' else round(median_mt_percentile, 3)
+                    row['Median WT Percentile'] = 'NA' if median_wt_percentile == 'NA' else round(median_wt_percentile, 3)
+                    for method in self.prediction_methods():
+                        pretty_method = PredictionClass.prediction_class_name_for_iedb_prediction_method(method)
+                        self.add_pretty_row(row, wt_scores, method, pretty_method, 'WT IC50 Score')
+                        self.add_pretty_row(row, mt_scores, method, pretty_method, 'MT IC50 Score')
+                        if pretty_method not in ['BigMHC_EL', 'BigMHC_IM', 'DeepImmuno']:
+                            self.add_pretty_row(row, wt_percentiles, method, pretty_method, 'WT Percentile')
+                            self.add_pretty_row(row, mt_percentiles, method, pretty_method, 'MT Percentile')
+
+                    for (tsv_key, row_key) in zip(['gene_expression', 'transcript_expression', 'normal_vaf', 'tdna_vaf', 'trna_vaf'], ['Gene Expression', 'Transcript Expression', 'Normal VAF', 'Tumor DNA VAF', 'Tumor RNA VAF']):
+                        if tsv_key in tsv_entry:
+                            if tsv_entry[tsv_key] == 'NA':
+                                row[row_key] = 'NA'
+                            else:
+                                row[row_key] = round(float(tsv_entry[tsv_key]), 3)
+                    for (tsv_key, row_key) in zip(['normal_depth', 'tdna_depth', 'trna_depth'], ['Normal Depth', 'Tumor DNA Depth', 'Tumor RNA Depth']):
+                        if tsv_key in tsv_entry:
+                            row[row_key] = tsv_entry[tsv_key]
+                    if self.add_sample_name:
+                        row['Sample Name'] = self.sample_name
+                    tsv_writer.writerow(row)
+
+        tsv_writer.close()
         os.replace(tmp_output_file, self.output_file)
 
 class DefaultOutputParser(OutputParser):
-    def parse_iedb_file(self, tsv_entries):
+    def protein_labels_by_tsv_index(self):
+        #The key file lists the proteins of every label. Invert it to get the labels and protein types of each TSV index.
         with open(self.key_file, 'r') as key_file_reader:
             protein_identifiers_from_label = yaml.load(key_file_reader, Loader=yaml.FullLoader)
+        protein_labels = {}
+        for (protein_label, protein_identifiers) in protein_identifiers_from_label.items():
+            for protein_identifier in protein_identifiers or []:
+                (protein_type, tsv_index) = protein_identifier.split('.', 1)
+                protein_labels.setdefault(tsv_index, {}).setdefault(protein_label, []).append(protein_type)
+        return protein_labels
+
+    def open_prediction_file(self, input_iedb_file, stack):
+        #Index the byte offset of every line by label so that the lines of one variant can be read back on their own
+        reader = stack.enter_context(open(input_iedb_file, 'rb'))
+        # we remove "sample_name." prefix from filename and then first part before a dot is the method name 
+        method = (os.path.basename(input_iedb_file)[len(self.sample_name)+1:]).split('.', 1)[0]
+        fieldnames = next(csv.reader([reader.readline().decode()], delimiter='\t'), [])
+        line_offsets = {}
+        if 'seq_num' in fieldnames:
+            seq_num_column = fieldnames.index('seq_num')
+            offset = reader.tell()
+            for line in reader:
+                if b"Warning: Potential DNA sequence(s)" not in line:
+                    protein_label = int(line.split(b'\t')[seq_num_column])
+                    line_offsets.setdefault(protein_label, array('q')).append(offset)
+                offset += len(line)
+        return (method, fieldnames, line_offsets, reader)
+
+    def iedb_record(self, line, method):
+        if 'core_peptide' in line and int(line['end']) - int(line['start']) == 8:
+            #Start and end refer to the position of the core peptide
+            #Infer the (start) position of the peptide from the positions of the core peptide
+            position   = str(int(line['start']) - line['peptide'].find(line['core_peptide']))
+        else:
+            position   = line['start']
+        percentiles    = self.get_percentiles(line, method)
+        epitope        = line['peptide']
+        scores         = self.get_scores(line, method)
+        allele         = line['allele']
+        peptide_length = len(epitope)
+        return (position, epitope, allele, peptide_length, scores, percentiles)
+
+    def variant_iedb_records(self, tsv_index, protein_types_by_label, prediction_files):
+        #Yields the predictions of one variant. The lines of each prediction file are read in their original order.
+        for (method, fieldnames, line_offsets, reader) in prediction_files:
+            offsets = sorted(offset for protein_label in protein_types_by_label for offset in line_offsets.get(protein_label, []))
+            for offset in offsets:
+                reader.seek(offset)
+                line = next(csv.DictReader([reader.readline().decode()], fieldnames=fieldnames, delimiter='\t'))
+                (position, epitope, allele, peptide_length, scores, percentiles) = self.iedb_record(line, method)
+                for protein_type in protein_types_by_label[int(line['seq_num'])]:
+                    yield (protein_type, tsv_index, position, method, epitope, allele, peptide_length, scores, percentiles)
+
+    def iedb_records(self, tsv_entries):
+        #Yields the prediction of every line of the prediction files once for each protein the epitope belongs to
+        protein_labels = self.protein_labels_by_tsv_index()
+        with ExitStack() as stack:
+            prediction_files = [self.open_prediction_file(input_iedb_file, stack) for input_iedb_file in self.input_iedb_files]
+            for (tsv_index, protein_types_by_label) in protein_labels.items():
+                yield from self.variant_iedb_records(tsv_index, protein_types_by_label, prediction_files)
+
+    def collect_iedb_results(self, iedb_records, tsv_entries):
         iedb_results = {}
         wt_iedb_results = {}
-        for input_iedb_file in self.input_iedb_files:
-            with open(input_iedb_file, 'r') as reader:
-                iedb_tsv_reader = csv.DictReader(reader, delimiter='\t')
-                # we remove "sample_name." prefix from filename and then first part before a dot is the method name 
-                method = (os.path.basename(input_iedb_file)[len(self.sample_name)+1:]).split('.', 1)[0]
-                for line in iedb_tsv_reader:
-                    if "Warning: Potential DNA sequence(s)" in line['allele']:
-                        continue
-                    protein_label  = int(line['seq_num'])
-                    if 'core_peptide' in line and int(line['end']) - int(line['start']) == 8:
-                        #Start and end refer to the position of the core peptide
-                        #Infer the (start) position of the peptide from the positions of the core peptide
-                        position   = str(int(line['start']) - line['peptide'].find(line['core_peptide']))
-                    else:
-                        position   = line['start']
-                    percentiles    = self.get_percentiles(line, method)
-                    epitope        = line['peptide']
-                    scores         = self.get_scores(line, method)
-                    allele         = line['allele']
-                    peptide_length = len(epitope)
-
-                    if protein_identifiers_from_label[protein_label] is not None:
-                        protein_identifiers = protein_identifiers_from_label[protein_label]
-
-                    for protein_identifier in protein_identifiers:
-                        (protein_type, tsv_index) = protein_identifier.split('.', 1)
-                        if protein_type == 'MT':
-                            tsv_entry = tsv_entries[tsv_index]
-                            key = "%s|%s" % (tsv_index, position)
-                            if key not in iedb_results:
-                                iedb_results[key]                      = {}
-                                iedb_results[key]['mt_scores']         = {}
-                                iedb_results[key]['mt_percentiles']    = {}
-                                iedb_results[key]['mt_epitope_seq']    = epitope
-                                iedb_results[key]['gene_name']         = tsv_entry['gene_name']
-                                iedb_results[key]['amino_acid_change'] = tsv_entry['amino_acid_change']
-                                iedb_results[key]['variant_type']      = tsv_entry['variant_type']
-                                iedb_results[key]['position']          = position
-                                iedb_results[key]['tsv_index']         = tsv_index
-                                iedb_results[key]['allele']            = allele
-                                iedb_results[key]['peptide_length']    = peptide_length
-                            iedb_results[key]['mt_scores'][method] = scores
-                            iedb_results[key]['mt_percentiles'][method] = percentiles
-                        else:
-                            if tsv_index not in wt_iedb_results:
-                                wt_iedb_results[tsv_index] = {}
-                            if position not in wt_iedb_results[tsv_index]:
-                                wt_iedb_results[tsv_index][position] = {}
-                                wt_iedb_results[tsv_index][position][protein_type.lower() + '_scores'] = {}
-                                wt_iedb_results[tsv_index][position][protein_type.lower() + '_percentiles'] = {}
-                            wt_iedb_results[tsv_index][position][protein_type.lower() + '_epitope_seq'] = epitope
-                            wt_iedb_results[tsv_index][position][protein_type.lower() + '_scores'][method] = scores
-                            wt_iedb_results[tsv_index][position][protein_type.lower() + '_percentiles'][method] = percentiles
+        for (protein_type, tsv_index, position, method, epitope, allele, peptide_length, scores, percentiles) in iedb_records:
+            if protein_type == 'MT':
+                tsv_entry = tsv_entries[tsv_index]
+                key = "%s|%s" % (tsv_index, position)
+                if key not in iedb_results:
+                    iedb_results[key]                      = {}
+                    iedb_results[key]['mt_scores']         = {}
+                    iedb_results[key]['mt_percentiles']    = {}
+                    iedb_results[key]['mt_epitope_seq']    = epitope
+                    iedb_results[key]['gene_name']         = tsv_entry['gene_name']
+                    iedb_results[key]['amino_acid_change'] = tsv_entry['amino_acid_change']
+                    iedb_results[key]['variant_type']      = tsv_entry['variant_type']
+                    iedb_results[key]['position']          = position
+                    iedb_results[key]['tsv_index']         = tsv_index
+                    iedb_results[key]['allele']            = allele
+                    iedb_results[key]['peptide_length']    = peptide_length
+                iedb_results[key]['mt_scores'][method] = scores
+                iedb_results[key]['mt_percentiles'][method] = percentiles
+            else:
+                if tsv_index not in wt_iedb_results:
+                    wt_iedb_results[tsv_index] = {}
+                if position not in wt_iedb_results[tsv_index]:
+                    wt_iedb_results[tsv_index][position] = {}
+                    wt_iedb_results[tsv_index][position][protein_type.lower() + '_scores'] = {}
+                    wt_iedb_results[tsv_index][position][protein_type.lower() + '_percentiles'] = {}
+                wt_iedb_results[tsv_index][position][protein_type.lower() + '_epitope_seq'] = epitope
+                wt_iedb_results[tsv_index][position][protein_type.lower() + '_scores'][method] = scores
+                wt_iedb_results[tsv_index][position][protein_type.lower() + '_percentiles'][method] = percentiles
+        return (iedb_results, wt_iedb_results)
 
+    def parse_iedb_file(self, tsv_entries):
+        (iedb_results, wt_iedb_results) = self.collect_iedb_results(self.iedb_records(tsv_entries), tsv_entries)
         return self.match_wildtype_and_mutant_entries(iedb_results, wt_iedb_results)
 
+    def variant_iedb_results(self):
+        #The TSV entries and the prediction file lines of one variant are read, matched, summarized and flattened
+        #before the next variant, so that only one variant's results are held in memory at a time
+        protein_labels = self.protein_labels_by_tsv_index()
+        tsv_indexes = set()
+        with ExitStack() as stack:
+            prediction_files = [self.open_prediction_file(input_iedb_file, stack) for input_iedb_file in self.input_iedb_files]
+            with open(self.input_tsv_file, 'r') as reader:
+                for tsv_entry in csv.DictReader(reader, delimiter='\t'):
+                    tsv_index = tsv_entry['index']
+                    if tsv_index in tsv_indexes:
+                        sys.exit('Duplicate TSV indexes')
+                    tsv_indexes.add(tsv_index)
+                    if tsv_index not in protein_labels:
+                        continue
+                    tsv_entries = {tsv_index: tsv_entry}
+                    iedb_records = self.variant_iedb_records(tsv_index, protein_labels.pop(tsv_index), prediction_files)
+                    (iedb_results, wt_iedb_results) = self.collect_iedb_results(iedb_records, tsv_entries)
+                    iedb_results = self.match_wildtype_and_mutant_entries(iedb_results, wt_iedb_results)
+                    yield (tsv_entries, self.flatten_iedb_results(self.add_summary_metrics(iedb_results)))
+
 
 class UnmatchedSequencesOutputParser(OutputParser):
     def parse_iedb_file(self):
@@ -960,8 +1023,7 @@ class UnmatchedSequencesOutputParser(OutputParser):
 
     def execute(self):
         tmp_output_file = self.output_file + '.tmp'
-        tmp_output_filehandle = open(tmp_output_file, 'w')
-        tsv_writer = csv.DictWriter(tmp_output_filehandle, delimiter='\t', fieldnames=self.output_headers())
+        tsv_writer = pvactools.lib.epitope_table.DictWriter(tmp_output_file, self.output_headers(), self.output_format)
         tsv_writer.writeheader()
 
         iedb_results = self.process_input_iedb_file()
@@ -1000,6 +1062,6 @@ class UnmatchedSequencesOutputParser(OutputParser):
                 row['Sample Name'] = self.sample_name
             tsv_writer.writerow(row)
 
-        tmp_output_filehandle.close()
+        tsv_writer.close()
         os.replace(tmp_output_file, self.output_file)
 
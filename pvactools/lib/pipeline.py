@@ -6,6 +6,7 @@ import datetime
 import time
 import shutil
 import copy
+import tempfile
 import yaml
 import pkg_resources
 import pymp
@@ -25,21 +26,111 @@ from pvactools.lib.post_processor import PostProcessor
 from pvactools.lib.run_utils import *
 import pvactools.lib.call_iedb
 import pvactools.lib.combine_parsed_outputs
+from pvactools.lib.task_graph import TaskGraph
+from pvactools.lib.tsv_splitter import TsvSplitter
+from pvactools.lib.prediction_cost_model import PredictionCostModel
+from pvactools.lib.run_manifest import RunManifest
+
+#Inputs that can be changed when restarting a run with --incremental. Only the predictions for the
+#added alleles, algorithms, and lengths are run, all outputs downstream of them are recreated.
+incremental_inputs = ['alleles', 'prediction_algorithms', 'epitope_lengths']
+#Inputs that are derived from one of the incremental inputs and can change along with it
+derived_incremental_inputs = {
+    'flurry_state': 'prediction_algorithms',
+}
+#Inputs that were added after the inputs of a past run might have been logged. Restarting such a run
+#is only aborted if one of them is set to something other than its default.
+input_defaults = {
+    'prediction_cache'            : None,
+    'batch_alleles'               : False,
+    'in_process_predictions'      : False,
+    'iedb_requests_per_second'    : None,
+    'iedb_max_concurrent_requests': None,
+    'split_tsv_by'                : 'rows',
+    'tsv_chunk_size'              : None,
+    'prediction_cost_model'       : None,
+    'intermediate_format'         : 'tsv',
+}
+#Inputs that aren't compared when restarting a run. The converted VCF and IEDB state directories are derived from the output directory.
+ignored_restart_inputs = ['pvactools_version', 'pvacseq_version', 'incremental', 'converted_vcf_dir', 'iedb_state_dir']
 
 def status_message(msg):
     print(msg)
     sys.stdout.flush()
 
+def prediction_input_hash(arguments, allele):
+    return RunManifest.input_hash([arguments[0]], {
+        'method': arguments[2],
+        'allele': allele,
+        'epitope_length': arguments[9],
+        'iedb_executable': arguments[arguments.index('-e') + 1],
+    })
+
+def parse_output_input_hash(params):
+    return RunManifest.input_hash([*params['input_iedb_files'], params['input_tsv_file'], params['key_file']], params)
+
+def run_call_iedb(arguments, cost_model=None, run_manifest=None):
+    a = arguments[3]
+    method = arguments[2]
+    filename = arguments[1]
+    epl = arguments[9]
+    status_message("Making binding predictions on Allele %s and Epitope Length %s with Method %s - File %s" % (a, epl, method, filename))
+    start = time.time()
+    predicted_peptides = pvactools.lib.call_iedb.main(arguments)
+    if cost_model is not None:
+        cost_model.record(arguments, time.time() - start, predicted_peptides)
+    if run_manifest is not None:
+        for (output_file, allele) in zip(arguments[1].split(','), arguments[3].split(',')):
+            if os.path.exists(output_file):
+                run_manifest.mark_complete(output_file, prediction_input_hash(arguments, allele))
+    status_message("Making binding predictions on Allele %s and Epitope Length %s with Method %s - File %s - Completed" % (a, epl, method, filename))
+
+def generate_fasta_files(fasta_generator_class, generate_fasta_jobs, run_manifest):
+    status_message("Generating Variant Peptide FASTA and Key Files")
+    for (params, output_files, input_hash, description) in generate_fasta_jobs:
+        if input_hash is not None and run_manifest.is_complete(output_files, input_hash):
+            status_message("Split FASTA file for {} already exists. Skipping.".format(description))
+            continue
+        status_message("Generating Variant Peptide FASTA and Key Files - {}".format(description))
+        fasta_generator = fasta_generator_class(**params)
+        fasta_generator.execute()
+        if input_hash is not None:
+            run_manifest.mark_complete(output_files, input_hash)
+    status_message("Completed")
+
+def parse_output(output_parser_class, params, description, run_manifest):
+    status_message("Parsing prediction file for %s" % description)
+    parser = output_parser_class(**params)
+    parser.execute()
+    run_manifest.mark_complete(params['output_file'], parse_output_input_hash(params))
+    status_message("Parsing prediction file for %s - Completed" % description)
+
 class Pipeline(metaclass=ABCMeta):
     def __init__(self, **kwargs):
         for (k,v) in kwargs.items():
            setattr(self, k, v)
         self.flurry_state                = self.get_flurry_state()
         self.starfusion_file             = kwargs.pop('starfusion_file', None)
+        self.prediction_cache            = kwargs.pop('prediction_cache', None)
+        self.batch_alleles               = kwargs.pop('batch_alleles', False)
+        self.in_process_predictions      = kwargs.pop('in_process_predictions', False)
+        self.iedb_requests_per_second    = kwargs.pop('iedb_requests_per_second', None)
+        self.iedb_max_concurrent_requests = kwargs.pop('iedb_max_concurrent_requests', None)
+        self.iedb_state_dir              = kwargs.pop('iedb_state_dir', None)
+        self.converted_vcf_dir           = kwargs.pop('converted_vcf_dir', None)
+        self.split_tsv_by                = kwargs.pop('split_tsv_by', 'rows')
+        self.tsv_chunk_size              = kwargs.pop('tsv_chunk_size', None)
+        self.prediction_cost_model       = kwargs.pop('prediction_cost_model', None)
+        self.incremental                 = kwargs.pop('incremental', False)
+        self.intermediate_format         = kwargs.pop('intermediate_format', 'tsv')
         self.proximal_variants_file      = None
         tmp_dir = os.path.join(self.output_dir, 'tmp')
         os.makedirs(tmp_dir, exist_ok=True)
         self.tmp_dir = tmp_dir
+        #Shared by the MHC class I and II pipelines of a run so that they're subject to the same IEDB request limits
+        if self.iedb_state_dir is None:
+            self.iedb_state_dir = tmp_dir
+        os.makedirs(self.iedb_state_dir, exist_ok=True)
 
     def log_dir(self):
         dir = os.path.join(self.output_dir, 'log')
@@ -59,8 +150,22 @@ class Pipeline(metaclass=ABCMeta):
                         "Past version: %s\n" % past_inputs['pvactools_version'] +
                         "Current version: %s" % current_inputs['pvactools_version']
                     )
+                incremental_changes = []
                 for key in current_inputs.keys():
-                    if key == 'pvactools_version' or key == 'pvacseq_version':
+                    if key in ignored_restart_inputs:
+                        continue
+                    if (key in incremental_inputs or key in derived_incremental_inputs) and current_inputs[key] != past_inputs.get(key):
+                        if self.incremental:
+                            incremental_changes.append(key)
+                            continue
+                        sys.exit(
+                            "Restart inputs are different from past inputs: \n" +
+                            "Past input: %s - %s\n" % (key, past_inputs.get(key)) +
+                            "Current input: %s - %s\n" % (key, current_inputs[key]) +
+                            "Use --incremental to only run the predictions that don't exist yet.\n" +
+                            "Aborting."
+                        )
+                    if key not in past_inputs.keys() and key in input_defaults and current_inputs[key] == input_defaults[key]:
                         continue
                     if key not in past_inputs.keys() and current_inputs[key] is not None:
                         sys.exit(
@@ -75,11 +180,31 @@ class Pipeline(metaclass=ABCMeta):
                             "Current input: %s - %s\n" % (key, current_inputs[key]) +
                             "Aborting."
                         )
+            if len(incremental_changes) > 0:
+                if 'epitope_lengths' in incremental_changes and getattr(self, 'phased_proximal_variants_vcf', None) is not None \
+                   and max(current_inputs['epitope_lengths']) > max(past_inputs['epitope_lengths']):
+                    sys.exit(
+                        "Proximal variants of the past run were only collected for epitope lengths up to %s. " % max(past_inputs['epitope_lengths']) +
+                        "Longer epitope lengths can't be added incrementally.\nAborting."
+                    )
+                status_message("Incremental restart. Changes compared to the past inputs:")
+                for key in incremental_changes:
+                    if key in derived_incremental_inputs:
+                        status_message("%s - past: %s - current: %s" % (key, past_inputs.get(key), current_inputs[key]))
+                        continue
+                    past_values = past_inputs.get(key) or []
+                    added = [value for value in current_inputs[key] if value not in past_values]
+                    removed = [value for value in past_values if value not in current_inputs[key]]
+                    status_message("%s - added: %s - removed: %s" % (key, added or 'None', removed or 'None'))
+                self.write_log(log_file)
         else:
-            with open(log_file, 'w') as log_fh:
-                inputs = self.__dict__
-                inputs['pvactools_version'] = pkg_resources.get_distribution("pvactools").version
-                yaml.dump(inputs, log_fh, default_flow_style=False)
+            self.write_log(log_file)
+
+    def write_log(self, log_file):
+        with open(log_file, 'w') as log_fh:
+            inputs = self.__dict__
+            inputs['pvactools_version'] = pkg_resources.get_distribution("pvactools").version
+            yaml.dump(inputs, log_fh, default_flow_style=False)
 
     def get_flurry_state(self):
         if 'MHCflurry' in self.prediction_algorithms and 'MHCflurryEL' in self.prediction_algorithms:
@@ -117,26 +242,35 @@ class Pipeline(metaclass=ABCMeta):
         converter = getattr(sys.modules[__name__], converter_type)
         return converter(**params)
 
-    def fasta_generator(self, params):
+    def fasta_generator_class(self):
         generator_types = {
             'vcf'                   : 'FastaGenerator',
             'pvacvector_input_fasta': 'VectorFastaGenerator',
         }
         generator_type = generator_types[self.input_file_type]
-        generator = getattr(sys.modules[__name__], generator_type)
-        return generator(**params)
+        return getattr(sys.modules[__name__], generator_type)
 
-    def output_parser(self, params):
+    def output_parser_class(self):
         parser_types = {
             'vcf'  : 'DefaultOutputParser',
             'pvacvector_input_fasta': 'UnmatchedSequencesOutputParser',
             'fasta': 'UnmatchedSequencesOutputParser',
         }
         parser_type = parser_types[self.input_file_type]
-        parser = getattr(sys.modules[__name__], parser_type)
-        return parser(**params)
+        return getattr(sys.modules[__name__], parser_type)
+
+    def converted_vcf_file_paths(self):
+        tsv_file = os.path.join(self.converted_vcf_dir, self.sample_name + '.tsv')
+        if self.phased_proximal_variants_vcf is not None:
+            proximal_variants_tsv = os.path.join(self.converted_vcf_dir, self.sample_name + '.proximal_variants.tsv')
+        else:
+            proximal_variants_tsv = None
+        return (tsv_file, proximal_variants_tsv)
 
     def generate_combined_fasta(self, fasta_path, epitope_flank_length=0):
+        if self.converted_vcf_dir is not None:
+            self.generate_combined_fasta_from_converted_vcf(fasta_path, epitope_flank_length)
+            return
         params = [
             self.input_file,
             str(epitope_flank_length + max(self.epitope_lengths) - 1),
@@ -155,10 +289,48 @@ class Pipeline(metaclass=ABCMeta):
         generate_combined_fasta.main(params)
         os.unlink("{}.manufacturability.tsv".format(fasta_path))
 
+    def needs_converted_vcf(self):
+        #A restarted run only needs the converted VCF to create the files that don't exist yet
+        output_files = [self.tsv_file_path(), self.fasta_file_path()]
+        if self.net_chop_method:
+            output_files.append(self.net_chop_fasta_file_path())
+        return not all(os.path.exists(output_file) for output_file in output_files)
+
+    def generate_combined_fasta_from_converted_vcf(self, fasta_path, epitope_flank_length=0):
+        if os.path.exists(fasta_path):
+            status_message("Combined FASTA file already exists. Skipping.")
+            return
+        import pvactools.tools.pvacseq.generate_protein_fasta as generate_combined_fasta
+        (tsv_file, proximal_variants_tsv) = self.converted_vcf_file_paths()
+        temp_dir = tempfile.mkdtemp(dir=self.tmp_dir)
+        shutil.copyfile(tsv_file, os.path.join(temp_dir, 'tmp.tsv'))
+        generate_combined_fasta.generate_fasta(
+            epitope_flank_length + max(self.epitope_lengths) - 1,
+            self.downstream_sequence_length,
+            temp_dir,
+            proximal_variants_tsv
+        )
+        generate_combined_fasta.parse_files("{}.tmp".format(fasta_path), temp_dir, False, None, None)
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        os.replace("{}.tmp".format(fasta_path), fasta_path)
+
     def convert_vcf(self):
         status_message("Converting .%s to TSV" % self.input_file_type)
         if os.path.exists(self.tsv_file_path()):
             status_message("TSV file already exists. Skipping.")
+            proximal_variants_file = os.path.join(self.output_dir, self.sample_name + '.proximal_variants.tsv')
+            if self.phased_proximal_variants_vcf is not None and os.path.exists(proximal_variants_file):
+                self.proximal_variants_file = proximal_variants_file
+            return
+
+        if self.converted_vcf_dir is not None:
+            #The VCF was already converted once for all MHC classes
+            (tsv_file, proximal_variants_tsv) = self.converted_vcf_file_paths()
+            shutil.copyfile(tsv_file, self.tsv_file_path())
+            if proximal_variants_tsv is not None:
+                self.proximal_variants_file = os.path.join(self.output_dir, self.sample_name + '.proximal_variants.tsv')
+                shutil.copyfile(proximal_variants_tsv, self.proximal_variants_file)
+            print("Completed")
             return
 
         convert_params = {
@@ -180,67 +352,35 @@ class Pipeline(metaclass=ABCMeta):
         converter.execute()
         print("Completed")
 
-    def tsv_entry_count(self):
-        with open(self.tsv_file_path()) as tsv_file:
-            reader  = csv.DictReader(tsv_file, delimiter='\t')
-            row_count = 0
-            for row in reader:
-                row_count += 1
-        return row_count
+    def tsv_chunk_budget(self):
+        if self.tsv_chunk_size is not None:
+            return self.tsv_chunk_size
+        rows = int(self.fasta_size / 2)
+        if self.split_tsv_by == 'peptides':
+            #As many peptides as a chunk of missense variants would produce
+            return rows * sum(2 * epitope_length for epitope_length in self.epitope_lengths)
+        return rows
 
-    def split_tsv_file(self, total_row_count):
+    def split_tsv_file(self):
         status_message("Splitting TSV into smaller chunks")
-        tsv_size = self.fasta_size / 2
-        chunks = []
-        with open(self.tsv_file_path(), 'r') as tsv_file:
-            reader      = csv.DictReader(tsv_file, delimiter='\t')
-            row_count   = 1
-            split_start = row_count
-            split_end   = split_start + tsv_size - 1
-            if split_end > total_row_count:
-                split_end = total_row_count
-            status_message("Splitting TSV into smaller chunks - Entries %d-%d" % (split_start, split_end))
-            split_tsv_file_path = "%s_%d-%d" % (self.tsv_file_path(), split_start, split_end)
-            chunks.append([split_start, split_end])
-            if os.path.exists(split_tsv_file_path):
-                status_message("Split TSV file for Entries %d-%d already exists. Skipping." % (split_start, split_end))
-                skip = 1
-            else:
-                split_tsv_file      = open(split_tsv_file_path, 'w')
-                split_tsv_writer    = csv.DictWriter(split_tsv_file, delimiter='\t', fieldnames = reader.fieldnames)
-                split_tsv_writer.writeheader()
-                skip = 0
-            for row in reader:
-                if skip == 0:
-                    split_tsv_writer.writerow(row)
-                if row_count == total_row_count:
-                    break
-                if row_count % tsv_size == 0:
-                    if skip == 0:
-                        split_tsv_file.close()
-                    split_start = row_count + 1
-                    split_end   = split_start + tsv_size - 1
-                    if split_end > total_row_count:
-                        split_end = total_row_count
-                    status_message("Splitting TSV into smaller chunks - Entries %d-%d" % (split_start, split_end))
-                    split_tsv_file_path = "%s_%d-%d" % (self.tsv_file_path(), split_start, split_end)
-                    chunks.append([split_start, split_end])
-                    if os.path.exists(split_tsv_file_path):
-                        status_message("Split TSV file for Entries %d-%d already exists. Skipping." % (split_start, split_end))
-                        skip = 1
-                    else:
-                        split_tsv_file      = open(split_tsv_file_path, 'w')
-                        split_tsv_writer    = csv.DictWriter(split_tsv_file, delimiter='\t', fieldnames = reader.fieldnames)
-                        split_tsv_writer.writeheader()
-                        skip = 0
-                row_count += 1
-            if skip == 0:
-                split_tsv_file.close()
+        splitter = TsvSplitter(
+            self.tsv_file_path(),
+            self.split_tsv_by,
+            self.tsv_chunk_budget(),
+            self.epitope_lengths,
+            self.downstream_sequence_length,
+        )
+        chunks = [[chunk['start'], chunk['end']] for chunk in splitter.execute()]
         status_message("Completed")
         return chunks
 
     def generate_fasta(self, chunks):
-        status_message("Generating Variant Peptide FASTA and Key Files")
+        generate_fasta_files(self.fasta_generator_class(), self.generate_fasta_jobs(chunks), self.run_manifest())
+
+    def generate_fasta_jobs(self, chunks):
+        #Returns the params of every FASTA generator call together with its output files, the hash of its
+        #inputs if it is recorded in the run manifest, and a description for the status messages
+        generate_fasta_jobs = []
         for (split_start, split_end) in chunks:
             tsv_chunk = "%d-%d" % (split_start, split_end)
             fasta_chunk = "%d-%d" % (split_start*2-1, split_end*2)
@@ -254,25 +394,24 @@ class Pipeline(metaclass=ABCMeta):
                 generate_fasta_params['output_file_prefix'] = split_fasta_file_path
                 generate_fasta_params['epitope_lengths'] = self.epitope_lengths
                 generate_fasta_params['spacers'] = self.spacers
-                status_message("Generating Variant Peptide FASTA and Key Files - Entries %s" % (fasta_chunk))
-                fasta_generator = self.fasta_generator(generate_fasta_params)
-                fasta_generator.execute()
+                generate_fasta_jobs.append((generate_fasta_params, None, None, "Entries %s" % fasta_chunk))
             else:
                 for epitope_length in self.epitope_lengths:
                     split_fasta_file_path = "{}_{}".format(self.split_fasta_basename(epitope_length), fasta_chunk)
-                    if os.path.exists(split_fasta_file_path):
-                        status_message("Split FASTA file for Epitope Length {} - Entries {} already exists. Skipping.".format(epitope_length, fasta_chunk))
-                        continue
                     split_fasta_key_file_path = split_fasta_file_path + '.key'
-                    generate_fasta_params['input_file'] = "%s_%s" % (self.tsv_file_path(), tsv_chunk)
-                    generate_fasta_params['epitope_length'] = epitope_length
-                    generate_fasta_params['flanking_sequence_length'] = epitope_length - 1
-                    generate_fasta_params['output_file'] = split_fasta_file_path
-                    generate_fasta_params['output_key_file'] = split_fasta_key_file_path
-                    status_message("Generating Variant Peptide FASTA and Key Files - Epitope Length {} - Entries {}".format(epitope_length, fasta_chunk))
-                    fasta_generator = self.fasta_generator(generate_fasta_params)
-                    fasta_generator.execute()
-        status_message("Completed")
+                    params = dict(generate_fasta_params)
+                    params['input_file'] = "%s_%s" % (self.tsv_file_path(), tsv_chunk)
+                    params['epitope_length'] = epitope_length
+                    params['flanking_sequence_length'] = epitope_length - 1
+                    params['output_file'] = split_fasta_file_path
+                    params['output_key_file'] = split_fasta_key_file_path
+                    input_hash = RunManifest.input_hash(
+                        [params['input_file'], self.proximal_variants_file],
+                        {k: v for (k, v) in params.items() if k not in ['input_file', 'proximal_variants_file']}
+                    )
+                    description = "Epitope Length {} - Entries {}".format(epitope_length, fasta_chunk)
+                    generate_fasta_jobs.append((params, [split_fasta_file_path, split_fasta_key_file_path], input_hash, description))
+        return generate_fasta_jobs
 
     def split_fasta_basename(self, epitope_length):
         if epitope_length is None:
@@ -280,12 +419,34 @@ class Pipeline(metaclass=ABCMeta):
         else:
             return os.path.join(self.tmp_dir, "{}.{}.fa.split".format(self.sample_name, epitope_length))
 
+    def run_manifest(self):
+        return RunManifest(os.path.join(self.log_dir(), 'run_manifest.db'))
+
+    def cost_model(self):
+        if self.prediction_cost_model is not None:
+            return PredictionCostModel(self.prediction_cost_model)
+        return PredictionCostModel(os.path.join(self.log_dir(), 'prediction_costs.json'))
+
     def call_iedb(self, chunks):
+        self.run_call_iedb_argument_sets(self.call_iedb_argument_sets(chunks))
+
+    def run_call_iedb_argument_sets(self, argument_sets):
+        #The most expensive predictions are started first and workers pick up the next
+        #prediction as soon as they are done instead of working through a fixed share
+        cost_model = self.cost_model()
+        run_manifest = self.run_manifest()
+        (argument_sets, costs) = cost_model.order_by_cost(argument_sets)
+        with pymp.Parallel(self.n_threads) as p:
+            for index in p.xrange(len(argument_sets)):
+                run_call_iedb(argument_sets[index], cost_model, run_manifest)
+
+    def call_iedb_argument_sets(self, chunks):
         alleles = self.alleles
         epitope_lengths = self.epitope_lengths
         prediction_algorithms = self.prediction_algorithms
         argument_sets = []
         warning_messages = []
+        run_manifest = self.run_manifest()
         for (split_start, split_end) in chunks:
             tsv_chunk = "%d-%d" % (split_start, split_end)
             if self.input_file_type == 'fasta':
@@ -325,11 +486,6 @@ class Pipeline(metaclass=ABCMeta):
                             continue
 
                         split_iedb_out = os.path.join(self.tmp_dir, ".".join([self.sample_name, iedb_method, a, str(epl), "tsv_%s" % fasta_chunk]))
-                        if os.path.exists(split_iedb_out):
-                            msg = "Prediction file for Allele %s and Epitope Length %s with Method %s (Entries %s) already exists. Skipping." % (a, epl, method, fasta_chunk)
-                            if msg not in warning_messages:
-                                warning_messages.append(msg)
-                            continue
                         arguments = [
                             split_fasta_file_path,
                             split_iedb_out,
@@ -341,24 +497,55 @@ class Pipeline(metaclass=ABCMeta):
                             '--tmp-dir', self.tmp_dir,
                             '--log-dir', self.log_dir(),
                         ]
+                        if self.prediction_cache is not None:
+                            arguments.extend(['--prediction-cache', self.prediction_cache])
+                        if self.in_process_predictions:
+                            arguments.append('--in-process')
+                        if self.iedb_requests_per_second is not None:
+                            arguments.extend(['--iedb-requests-per-second', str(self.iedb_requests_per_second)])
+                        if self.iedb_max_concurrent_requests is not None:
+                            arguments.extend(['--iedb-max-concurrent-requests', str(self.iedb_max_concurrent_requests)])
+                        arguments.extend(['--iedb-state-dir', self.iedb_state_dir])
+                        if run_manifest.is_complete(split_iedb_out, prediction_input_hash(arguments, a)):
+                            msg = "Prediction file for Allele %s and Epitope Length %s with Method %s (Entries %s) already exists. Skipping." % (a, epl, method, fasta_chunk)
+                            if msg not in warning_messages:
+                                warning_messages.append(msg)
+                            continue
                         argument_sets.append(arguments)
 
         for msg in warning_messages:
             status_message(msg)
 
-        with pymp.Parallel(self.n_threads) as p:
-            for index in p.range(len(argument_sets)):
-                arguments = argument_sets[index]
-                a = arguments[3]
-                method = arguments[2]
-                filename = arguments[1]
-                epl = arguments[9]
-                p.print("Making binding predictions on Allele %s and Epitope Length %s with Method %s - File %s" % (a, epl, method, filename))
-                pvactools.lib.call_iedb.main(arguments)
-                p.print("Making binding predictions on Allele %s and Epitope Length %s with Method %s - File %s - Completed" % (a, epl, method, filename))
+        if self.batch_alleles:
+            argument_sets = self.batch_argument_sets_by_allele(argument_sets)
+        return argument_sets
+
+    def batch_argument_sets_by_allele(self, argument_sets):
+        #Merge the argument sets of all alleles for the same input file, method, and epitope length
+        #into a single call_iedb invocation if the prediction algorithm accepts multiple alleles
+        batched_argument_sets = OrderedDict()
+        for arguments in argument_sets:
+            (split_fasta_file_path, split_iedb_out, method, a) = arguments[0:4]
+            if not globals()[method]().supports_multiple_alleles:
+                batched_argument_sets[tuple(arguments)] = arguments
+                continue
+            key = (split_fasta_file_path, method, tuple(arguments[4:]))
+            if key in batched_argument_sets:
+                batched_arguments = batched_argument_sets[key]
+                batched_arguments[1] = "{},{}".format(batched_arguments[1], split_iedb_out)
+                batched_arguments[3] = "{},{}".format(batched_arguments[3], a)
+            else:
+                batched_argument_sets[key] = list(arguments)
+        return list(batched_argument_sets.values())
 
     def parse_outputs(self, chunks):
-        split_parsed_output_files = []
+        return self.run_parse_output_jobs(self.parse_output_jobs(chunks))
+
+    def parse_output_jobs(self, chunks):
+        #Returns the parsed output file of every chunk, allele, and epitope length in a fixed order
+        #together with the parser params, or None if the file doesn't need to be (re)created
+        parse_output_jobs = []
+        run_manifest = self.run_manifest()
         for (split_start, split_end) in chunks:
             tsv_chunk = "%d-%d" % (split_start, split_end)
             if self.input_file_type == 'fasta':
@@ -385,11 +572,7 @@ class Pipeline(metaclass=ABCMeta):
                         if os.path.exists(split_iedb_out):
                             split_iedb_output_files.append(split_iedb_out)
 
-                    split_parsed_file_path = os.path.join(self.tmp_dir, ".".join([self.sample_name, a, str(epl), "parsed", "tsv_%s" % fasta_chunk]))
-                    if os.path.exists(split_parsed_file_path):
-                        status_message("Parsed Output File for Allele %s and Epitope Length %s (Entries %s) already exists. Skipping" % (a, epl, fasta_chunk))
-                        split_parsed_output_files.append(split_parsed_file_path)
-                        continue
+                    split_parsed_file_path = os.path.join(self.tmp_dir, ".".join([self.sample_name, a, str(epl), "parsed", "%s_%s" % (self.intermediate_format, fasta_chunk)]))
                     if self.input_file_type == 'pvacvector_input_fasta':
                         split_fasta_file_path = "{}_1-2.{}.tsv".format(self.split_fasta_basename(None), epl)
                     else:
@@ -397,7 +580,6 @@ class Pipeline(metaclass=ABCMeta):
                     split_fasta_key_file_path = split_fasta_file_path + '.key'
 
                     if len(split_iedb_output_files) > 0:
-                        status_message("Parsing prediction file for Allele %s and Epitope Length %s - Entries %s" % (a, epl, fasta_chunk))
                         split_tsv_file_path = "%s_%s" % (self.tsv_file_path(), tsv_chunk)
                         params = {
                             'input_iedb_files'       : split_iedb_output_files,
@@ -407,14 +589,66 @@ class Pipeline(metaclass=ABCMeta):
                         }
                         params['sample_name'] = self.sample_name
                         params['flurry_state'] = self.flurry_state
+                        if self.intermediate_format != 'tsv':
+                            params['output_format'] = self.intermediate_format
                         if self.additional_report_columns and 'sample_name' in self.additional_report_columns:
                             params['add_sample_name_column'] = True 
-                        parser = self.output_parser(params)
-                        parser.execute()
-                        status_message("Parsing prediction file for Allele %s and Epitope Length %s - Entries %s - Completed" % (a, epl, fasta_chunk))
+                        description = "Allele %s and Epitope Length %s - Entries %s" % (a, epl, fasta_chunk)
+                        if run_manifest.is_complete(split_parsed_file_path, parse_output_input_hash(params)):
+                            status_message("Parsed Output File for %s already exists. Skipping" % description)
+                            parse_output_jobs.append((split_parsed_file_path, None, None))
+                        else:
+                            parse_output_jobs.append((split_parsed_file_path, params, description))
+        return parse_output_jobs
+
+    def add_parse_output_tasks(self, task_graph, parse_output_jobs, dependencies=[], priority=0):
+        #The tasks run module level functions so that the pipeline itself isn't sent to the worker processes
+        output_parser_class = self.output_parser_class()
+        run_manifest = self.run_manifest()
+        return [
+            task_graph.add_task(parse_output, [output_parser_class, params, description, run_manifest], dependencies=dependencies, priority=priority)
+            for (split_parsed_file_path, params, description) in parse_output_jobs if params is not None
+        ]
 
-                        split_parsed_output_files.append(split_parsed_file_path)
-        return split_parsed_output_files
+    def run_parse_output_jobs(self, parse_output_jobs):
+        #The parsed files are independent of each other so they are created in parallel.
+        #The returned list keeps the job order so that the combined output is deterministic.
+        task_graph = TaskGraph()
+        self.add_parse_output_tasks(task_graph, parse_output_jobs)
+        task_graph.run(self.n_threads)
+        return [split_parsed_file_path for (split_parsed_file_path, params, description) in parse_output_jobs]
+
+    def generate_fasta_call_iedb_and_parse_outputs(self, chunks):
+        #Predictions for a chunk start as soon as its FASTA files are written and the chunk is parsed
+        #as soon as its predictions are done, so that the stages of different chunks overlap.
+        #Parsed files are only returned once all tasks are done.
+        task_graph = TaskGraph()
+        cost_model = self.cost_model()
+        run_manifest = self.run_manifest()
+        split_parsed_output_files = {}
+
+        def add_parse_output_tasks(chunk, priority):
+            parse_output_jobs = self.parse_output_jobs([chunk])
+            self.add_parse_output_tasks(task_graph, parse_output_jobs, priority=priority)
+            split_parsed_output_files[tuple(chunk)] = [split_parsed_file_path for (split_parsed_file_path, params, description) in parse_output_jobs]
+
+        def add_prediction_tasks(chunk):
+            (argument_sets, costs) = cost_model.order_by_cost(self.call_iedb_argument_sets([chunk]))
+            prediction_tasks = [
+                task_graph.add_task(run_call_iedb, [arguments, cost_model, run_manifest], priority=cost)
+                for (arguments, cost) in zip(argument_sets, costs)
+            ]
+            #The parse jobs depend on which prediction files exist so they are only determined once the predictions are done.
+            #They get the priority of the chunk's most expensive prediction so that they aren't held back until all other predictions are done.
+            priority = max(costs, default=0)
+            task_graph.add_task(None, dependencies=prediction_tasks, callback=lambda result: add_parse_output_tasks(chunk, priority), priority=priority)
+
+        fasta_generator_class = self.fasta_generator_class()
+        for chunk in chunks:
+            #FASTA files are generated ahead of any predictions since they are quick and unlock further tasks
+            task_graph.add_task(generate_fasta_files, [fasta_generator_class, self.generate_fasta_jobs([chunk]), run_manifest], callback=lambda result, chunk=chunk: add_prediction_tasks(chunk), priority=float('inf'))
+        task_graph.run(self.n_threads)
+        return [f for chunk in chunks for f in split_parsed_output_files[tuple(chunk)]]
 
     def combined_parsed_path(self):
         combined_parsed = "%s.all_epitopes.tsv" % self.sample_name
@@ -441,15 +675,12 @@ class Pipeline(metaclass=ABCMeta):
         if self.input_file_type != 'pvacvector_input_fasta':
             self.generate_combined_fasta(self.fasta_file_path())
 
-        total_row_count = self.tsv_entry_count()
-        if total_row_count == 0:
+        chunks = self.split_tsv_file()
+        if len(chunks) == 0:
             print("The TSV file is empty. Please check that the input VCF contains missense, inframe indel, or frameshift mutations.")
             return
-        chunks = self.split_tsv_file(total_row_count)
 
-        self.generate_fasta(chunks)
-        self.call_iedb(chunks)
-        split_parsed_output_files = self.parse_outputs(chunks)
+        split_parsed_output_files = self.generate_fasta_call_iedb_and_parse_outputs(chunks)
 
         if len(split_parsed_output_files) == 0:
             status_message("No output files were created. Aborting.")
@@ -536,8 +767,26 @@ class PvacbindPipeline(Pipeline):
                 records.append(record)
         SeqIO.write(records, self.fasta_basename(length), "fasta")
 
+    def split_fasta_chunk_is_complete(self, run_manifest, length, split_start, split_end):
+        split_fasta_file_path = "%s_%d-%d" % (self.split_fasta_basename(length), split_start, split_end)
+        return run_manifest.is_complete([split_fasta_file_path, "{}.key".format(split_fasta_file_path)], self.split_fasta_chunk_input_hash(length, split_start, split_end))
+
+    def split_fasta_chunk_input_hash(self, length, split_start, split_end):
+        return RunManifest.input_hash([self.fasta_basename(length)], {'split_start': split_start, 'split_end': split_end})
+
+    def write_split_fasta_chunk(self, run_manifest, length, split_start, split_end, split_fasta_records):
+        split_fasta_file_path = "%s_%d-%d" % (self.split_fasta_basename(length), split_start, split_end)
+        split_fasta_key_file_path = "{}.key".format(split_fasta_file_path)
+        (uniq_records, keys) = self.uniquify_records(split_fasta_records)
+        with open(split_fasta_file_path, 'w') as split_fasta_file:
+            SeqIO.write(uniq_records, split_fasta_file, "fasta")
+        with open(split_fasta_key_file_path, 'w') as split_fasta_key_file:
+            yaml.dump(keys, split_fasta_key_file, default_flow_style=False)
+        run_manifest.mark_complete([split_fasta_file_path, split_fasta_key_file_path], self.split_fasta_chunk_input_hash(length, split_start, split_end))
+
     def split_fasta_file(self, length):
         fasta_entry_count = self.fasta_entry_count()
+        run_manifest = self.run_manifest()
         status_message("Splitting FASTA into smaller chunks")
         chunks = []
         peptides = []
@@ -547,10 +796,8 @@ class PvacbindPipeline(Pipeline):
         if split_end > fasta_entry_count:
             split_end = fasta_entry_count
         status_message("Splitting FASTA into smaller chunks - Entries %d-%d" % (split_start, split_end))
-        split_fasta_file_path = "%s_%d-%d" % (self.split_fasta_basename(length), split_start, split_end)
-        split_fasta_key_file_path = "{}.key".format(split_fasta_file_path)
         chunks.append([split_start, split_end])
-        if os.path.exists(split_fasta_file_path):
+        if self.split_fasta_chunk_is_complete(run_manifest, length, split_start, split_end):
             status_message("Split FASTA file for Entries %d-%d already exists. Skipping." % (split_start, split_end))
             skip = 1
         else:
@@ -563,21 +810,14 @@ class PvacbindPipeline(Pipeline):
                 break
             if row_count % self.fasta_size == 0:
                 if skip == 0:
-                    (uniq_records, keys) = self.uniquify_records(split_fasta_records)
-                    with open(split_fasta_file_path, 'w') as split_fasta_file:
-                        SeqIO.write(uniq_records, split_fasta_file, "fasta")
-                    with open(split_fasta_key_file_path, 'w') as split_fasta_key_file:
-                        yaml.dump(keys, split_fasta_key_file, default_flow_style=False)
-                    split_fasta_file.close()
+                    self.write_split_fasta_chunk(run_manifest, length, split_start, split_end, split_fasta_records)
                 split_start = row_count + 1
                 split_end   = split_start + self.fasta_size - 1
                 if split_end > fasta_entry_count:
                     split_end = fasta_entry_count
                 status_message("Splitting FASTA into smaller chunks - Entries %d-%d" % (split_start, split_end))
-                split_fasta_file_path = "%s_%d-%d" % (self.split_fasta_basename(length), split_start, split_end)
-                split_fasta_key_file_path = "{}.key".format(split_fasta_file_path)
                 chunks.append([split_start, split_end])
-                if os.path.exists(split_fasta_file_path):
+                if self.split_fasta_chunk_is_complete(run_manifest, length, split_start, split_end):
                     status_message("Split FASTA file for Entries %d-%d already exists. Skipping." % (split_start, split_end))
                     skip = 1
                 else:
@@ -585,11 +825,7 @@ class PvacbindPipeline(Pipeline):
                     skip = 0
             row_count += 1
         if skip == 0:
-            (uniq_records, keys) = self.uniquify_records(split_fasta_records)
-            with open(split_fasta_file_path, 'w') as split_fasta_file:
-                SeqIO.write(uniq_records, split_fasta_file, "fasta")
-            with open(split_fasta_key_file_path, 'w') as split_fasta_key_file:
-                yaml.dump(keys, split_fasta_key_file, default_flow_style=False)
+            self.write_split_fasta_chunk(run_manifest, length, split_start, split_end, split_fasta_records)
         status_message("Completed")
         return chunks
 
@@ -598,6 +834,7 @@ class PvacbindPipeline(Pipeline):
         prediction_algorithms = self.prediction_algorithms
         argument_sets = []
         warning_messages = []
+        run_manifest = self.run_manifest()
         for (split_start, split_end) in chunks:
             tsv_chunk = "%d-%d" % (split_start, split_end)
             if self.input_file_type == 'fasta':
@@ -633,11 +870,6 @@ class PvacbindPipeline(Pipeline):
                         continue
 
                     split_iedb_out = os.path.join(self.tmp_dir, ".".join([self.sample_name, iedb_method, a, str(length), "tsv_%s" % fasta_chunk]))
-                    if os.path.exists(split_iedb_out):
-                        msg = "Prediction file for Allele %s and Epitope Length %s with Method %s (Entries %s) already exists. Skipping." % (a, length, method, fasta_chunk)
-                        if msg not in warning_messages:
-                            warning_messages.append(msg)
-                        continue
                     arguments = [
                         split_fasta_file_path,
                         split_iedb_out,
@@ -649,24 +881,36 @@ class PvacbindPipeline(Pipeline):
                         '--tmp-dir', self.tmp_dir,
                         '--log-dir', self.log_dir(),
                     ]
+                    if self.prediction_cache is not None:
+                        arguments.extend(['--prediction-cache', self.prediction_cache])
+                    if self.in_process_predictions:
+                        arguments.append('--in-process')
+                    if self.iedb_requests_per_second is not None:
+                        arguments.extend(['--iedb-requests-per-second', str(self.iedb_requests_per_second)])
+                    if self.iedb_max_concurrent_requests is not None:
+                        arguments.extend(['--iedb-max-concurrent-requests', str(self.iedb_max_concurrent_requests)])
+                    arguments.extend(['--iedb-state-dir', self.iedb_state_dir])
+                    if run_manifest.is_complete(split_iedb_out, prediction_input_hash(arguments, a)):
+                        msg = "Prediction file for Allele %s and Epitope Length %s with Method %s (Entries %s) already exists. Skipping." % (a, length, method, fasta_chunk)
+                        if msg not in warning_messages:
+                            warning_messages.append(msg)
+                        continue
                     argument_sets.append(arguments)
 
         for msg in warning_messages:
             status_message(msg)
 
-        with pymp.Parallel(self.n_threads) as p:
-            for index in p.range(len(argument_sets)):
-                arguments = argument_sets[index]
-                a = arguments[3]
-                method = arguments[2]
-                filename = arguments[1]
-                epl = arguments[9]
-                p.print("Making binding predictions on Allele %s and Epitope Length %s with Method %s - File %s" % (a, epl, method, filename))
-                pvactools.lib.call_iedb.main(arguments)
-                p.print("Making binding predictions on Allele %s and Epitope Length %s with Method %s - File %s - Completed" % (a, epl, method, filename))
+        if self.batch_alleles:
+            argument_sets = self.batch_argument_sets_by_allele(argument_sets)
+
+        self.run_call_iedb_argument_sets(argument_sets)
 
     def parse_outputs(self, chunks, length):
-        split_parsed_output_files = []
+        return self.run_parse_output_jobs(self.parse_output_jobs(chunks, length))
+
+    def parse_output_jobs(self, chunks, length):
+        parse_output_jobs = []
+        run_manifest = self.run_manifest()
         for (split_start, split_end) in chunks:
             tsv_chunk = "%d-%d" % (split_start, split_end)
             if self.input_file_type == 'fasta':
@@ -692,16 +936,11 @@ class PvacbindPipeline(Pipeline):
                     if os.path.exists(split_iedb_out):
                         split_iedb_output_files.append(split_iedb_out)
 
-                split_parsed_file_path = os.path.join(self.tmp_dir, ".".join([self.sample_name, a, str(length), "parsed", "tsv_%s" % fasta_chunk]))
-                if os.path.exists(split_parsed_file_path):
-                    status_message("Parsed Output File for Allele %s and Epitope Length %s (Entries %s) already exists. Skipping" % (a, length, fasta_chunk))
-                    split_parsed_output_files.append(split_parsed_file_path)
-                    continue
+                split_parsed_file_path = os.path.join(self.tmp_dir, ".".join([self.sample_name, a, str(length), "parsed", "%s_%s" % (self.intermediate_format, fasta_chunk)]))
                 split_fasta_file_path = "%s_%s"%(self.split_fasta_basename(length), fasta_chunk)
                 split_fasta_key_file_path = split_fasta_file_path + '.key'
 
                 if len(split_iedb_output_files) > 0:
-                    status_message("Parsing prediction file for Allele %s and Epitope Length %s - Entries %s" % (a, length, fasta_chunk))
                     split_tsv_file_path = "%s_%s" % (self.tsv_file_path(), tsv_chunk)
                     params = {
                         'input_iedb_files'       : split_iedb_output_files,
@@ -711,14 +950,17 @@ class PvacbindPipeline(Pipeline):
                     }
                     params['sample_name'] = self.sample_name
                     params['flurry_state'] = self.flurry_state
+                    if self.intermediate_format != 'tsv':
+                        params['output_format'] = self.intermediate_format
                     if self.additional_report_columns and 'sample_name' in self.additional_report_columns:
                         params['add_sample_name_column'] = True 
-                    parser = self.output_parser(params)
-                    parser.execute() 
-                    status_message("Parsing prediction file for Allele %s and Epitope Length %s - Entries %s - Completed" % (a, length, fasta_chunk))
-
-                    split_parsed_output_files.append(split_parsed_file_path)
-        return split_parsed_output_files
+                    description = "Allele %s and Epitope Length %s - Entries %s" % (a, length, fasta_chunk)
+                    if run_manifest.is_complete(split_parsed_file_path, parse_output_input_hash(params)):
+                        status_message("Parsed Output File for %s already exists. Skipping" % description)
+                        parse_output_jobs.append((split_parsed_file_path, None, None))
+                    else:
+                        parse_output_jobs.append((split_parsed_file_path, params, description))
+        return parse_output_jobs
 
     def execute(self):
         self.print_log()
@@ -1,3 +1,5 @@
+import os
+import csv
 import tempfile
 import shutil
 
@@ -16,18 +18,17 @@ class PostProcessor:
         for (k,v) in kwargs.items():
            setattr(self, k, v)
         self.aggregate_report = self.input_file.replace('.tsv', '.aggregated.tsv')
-        self.identify_problematic_amino_acids_fh = tempfile.NamedTemporaryFile()
-        self.binding_filter_fh = tempfile.NamedTemporaryFile()
-        self.coverage_filter_fh = tempfile.NamedTemporaryFile()
-        self.transcript_support_level_filter_fh = tempfile.NamedTemporaryFile()
+        self.filter_fh = tempfile.NamedTemporaryFile()
         self.top_score_filter_fh = tempfile.NamedTemporaryFile()
         self.net_chop_fh = tempfile.NamedTemporaryFile()
         self.netmhc_stab_fh = tempfile.NamedTemporaryFile()
-        self.manufacturability_fh = tempfile.NamedTemporaryFile()
         self.reference_similarity_fh = tempfile.NamedTemporaryFile(suffix='.tsv')
+        #The report that the next filtering step reads. Steps that are turned off don't change it.
+        self.filtered_file = None
         self.file_type = kwargs.pop('file_type', None)
         self.fasta = kwargs.pop('fasta', None)
         self.net_chop_fasta = kwargs.pop('net_chop_fasta', None)
+        self.n_threads = kwargs.pop('n_threads', 1)
         if not hasattr(self, 'flurry_state'):
             self.flurry_state = self.get_flurry_state()
         self.el_only = all([self.is_el(a) for a in self.prediction_algorithms])
@@ -55,25 +56,21 @@ class PostProcessor:
     def execute(self):
         self.identify_problematic_amino_acids()
         self.aggregate_all_epitopes()
-        self.calculate_manufacturability()
-        self.execute_binding_filter()
-        self.execute_coverage_filter()
-        self.execute_transcript_support_level_filter()
+        self.calculate_manufacturability_and_filter()
         self.execute_top_score_filter()
         self.call_net_chop()
         self.call_netmhc_stab()
         self.calculate_reference_proteome_similarity()
-        if not self.el_only:
-            shutil.copy(self.reference_similarity_fh.name, self.aggregate_report)
-        shutil.copy(self.netmhc_stab_fh.name, self.filtered_report_file)
+        shutil.copy(self.filtered_file, self.filtered_report_file)
         self.close_filehandles()
         print("\nDone: Pipeline finished successfully. File {} contains list of filtered putative neoantigens.\n".format(self.filtered_report_file))
 
     def identify_problematic_amino_acids(self):
         if self.problematic_amino_acids:
             print("Identifying peptides with problematic amino acids")
-            IdentifyProblematicAminoAcids(self.input_file, self.identify_problematic_amino_acids_fh.name, self.problematic_amino_acids, file_type=self.file_type).execute()
-            shutil.copy(self.identify_problematic_amino_acids_fh.name, self.input_file)
+            tmp_file = "{}.tmp".format(self.input_file)
+            IdentifyProblematicAminoAcids(self.input_file, tmp_file, self.problematic_amino_acids, file_type=self.file_type).execute()
+            os.replace(tmp_file, self.input_file)
             print("Completed")
 
     def aggregate_all_epitopes(self):
@@ -96,6 +93,7 @@ class PostProcessor:
                 allele_specific_anchors=self.allele_specific_anchors,
                 anchor_contribution_threshold=self.anchor_contribution_threshold,
                 aggregate_inclusion_binding_threshold=self.aggregate_inclusion_binding_threshold,
+                n_threads=self.n_threads,
             ).execute()
         elif self.file_type == 'pVACfuse':
             PvacfuseAggregateAllEpitopes(
@@ -108,6 +106,7 @@ class PostProcessor:
                 read_support=self.read_support,
                 expn_val=self.expn_val,
                 aggregate_inclusion_binding_threshold=self.aggregate_inclusion_binding_threshold,
+                n_threads=self.n_threads,
             ).execute()
         elif self.file_type == 'pVACbind':
             PvacbindAggregateAllEpitopes(
@@ -118,24 +117,57 @@ class PostProcessor:
                 percentile_threshold=self.percentile_threshold,
                 top_score_metric=self.top_score_metric,
                 aggregate_inclusion_binding_threshold=self.aggregate_inclusion_binding_threshold,
+                n_threads=self.n_threads,
             ).execute()
         print("Completed")
 
-    def calculate_manufacturability(self):
+    def calculate_manufacturability_and_filter(self):
+        #Adds the manufacturability metrics to the all_epitopes report and applies the binding, coverage, and
+        #transcript support level filters to it in a single pass instead of reading and writing the report in each step
+        row_filters = [f for f in [self.binding_filter(), self.coverage_filter(), self.transcript_support_level_filter()] if f is not None]
         if self.run_manufacturability_metrics:
             print("Calculating Manufacturability Metrics")
-            CalculateManufacturability(self.input_file, self.manufacturability_fh.name, self.file_type).execute()
-            shutil.copy(self.manufacturability_fh.name, self.input_file)
-            print("Completed")
+            manufacturability = CalculateManufacturability(self.input_file, None, self.file_type)
+        elif len(row_filters) == 0:
+            self.filtered_file = self.input_file
+            return
+
+        tmp_file = "{}.tmp".format(self.input_file)
+        with open(self.input_file) as input_fh:
+            reader = csv.DictReader(input_fh, delimiter="\t")
+            fieldnames = reader.fieldnames
+            if self.run_manufacturability_metrics:
+                fieldnames = fieldnames + manufacturability.manufacturability_headers()
+                output_fh = open(tmp_file, 'w')
+                writer = csv.DictWriter(output_fh, delimiter="\t", fieldnames=fieldnames, extrasaction='ignore', restval='NA')
+                writer.writeheader()
+            if len(row_filters) > 0:
+                filter_fh = open(self.filter_fh.name, 'w')
+                filter_writer = csv.DictWriter(filter_fh, delimiter="\t", fieldnames=fieldnames, lineterminator="\n", extrasaction='ignore', restval='NA')
+                filter_writer.writeheader()
+            for line in reader:
+                if self.run_manufacturability_metrics:
+                    line = manufacturability.annotate(line)
+                    writer.writerow(line)
+                if len(row_filters) > 0 and all(f.passes(line) for f in row_filters):
+                    filter_writer.writerow(line)
+        if self.run_manufacturability_metrics:
+            output_fh.close()
+            os.replace(tmp_file, self.input_file)
+        if len(row_filters) > 0:
+            filter_fh.close()
+            self.filtered_file = self.filter_fh.name
+        else:
+            self.filtered_file = self.input_file
+        print("Completed")
 
-    def execute_binding_filter(self):
+    def binding_filter(self):
         if self.el_only:
-            shutil.copy(self.input_file, self.binding_filter_fh.name)
-            return
+            return None
         print("Running Binding Filters")
-        BindingFilter(
+        return BindingFilter(
             self.input_file,
-            self.binding_filter_fh.name,
+            None,
             self.binding_threshold,
             self.minimum_fold_change,
             self.top_score_metric,
@@ -143,52 +175,41 @@ class PostProcessor:
             self.allele_specific_binding_thresholds,
             self.percentile_threshold,
             self.file_type,
-        ).execute()
-        print("Completed")
+        ).row_filter()
 
-    def execute_coverage_filter(self):
-        if self.run_coverage_filter:
-            print("Running Coverage Filters")
-            filter_criteria = []
-            if self.file_type == 'pVACseq':
-                filter_criteria.append(FilterCriterion("Normal Depth", '>=', self.normal_cov, exclude_nas=self.exclude_NAs))
-                filter_criteria.append(FilterCriterion("Normal VAF", '<=', self.normal_vaf, exclude_nas=self.exclude_NAs))
-                filter_criteria.append(FilterCriterion("Tumor DNA Depth", '>=', self.tdna_cov, exclude_nas=self.exclude_NAs))
-                filter_criteria.append(FilterCriterion("Tumor DNA VAF", '>=', self.tdna_vaf, exclude_nas=self.exclude_NAs))
-                filter_criteria.append(FilterCriterion("Tumor RNA Depth", '>=', self.trna_cov, exclude_nas=self.exclude_NAs))
-                filter_criteria.append(FilterCriterion("Tumor RNA VAF", '>=', self.trna_vaf, exclude_nas=self.exclude_NAs))
-                filter_criteria.append(FilterCriterion("Gene Expression", '>=', self.expn_val, exclude_nas=self.exclude_NAs))
-                filter_criteria.append(FilterCriterion("Transcript Expression", '>=', self.expn_val, exclude_nas=self.exclude_NAs))
-            elif self.file_type == 'pVACfuse':
-                filter_criteria.append(FilterCriterion("Read Support", '>=', self.read_support, exclude_nas=self.exclude_NAs))
-                filter_criteria.append(FilterCriterion("Expression", '>=', self.expn_val, exclude_nas=self.exclude_NAs))
-            Filter(self.binding_filter_fh.name, self.coverage_filter_fh.name, filter_criteria).execute()
-            print("Completed")
-        else:
-            shutil.copy(self.binding_filter_fh.name, self.coverage_filter_fh.name)
+    def coverage_filter(self):
+        if not self.run_coverage_filter:
+            return None
+        print("Running Coverage Filters")
+        filter_criteria = []
+        if self.file_type == 'pVACseq':
+            filter_criteria.append(FilterCriterion("Normal Depth", '>=', self.normal_cov, exclude_nas=self.exclude_NAs))
+            filter_criteria.append(FilterCriterion("Normal VAF", '<=', self.normal_vaf, exclude_nas=self.exclude_NAs))
+            filter_criteria.append(FilterCriterion("Tumor DNA Depth", '>=', self.tdna_cov, exclude_nas=self.exclude_NAs))
+            filter_criteria.append(FilterCriterion("Tumor DNA VAF", '>=', self.tdna_vaf, exclude_nas=self.exclude_NAs))
+            filter_criteria.append(FilterCriterion("Tumor RNA Depth", '>=', self.trna_cov, exclude_nas=self.exclude_NAs))
+            filter_criteria.append(FilterCriterion("Tumor RNA VAF", '>=', self.trna_vaf, exclude_nas=self.exclude_NAs))
+            filter_criteria.append(FilterCriterion("Gene Expression", '>=', self.expn_val, exclude_nas=self.exclude_NAs))
+            filter_criteria.append(FilterCriterion("Transcript Expression", '>=', self.expn_val, exclude_nas=self.exclude_NAs))
+        elif self.file_type == 'pVACfuse':
+            filter_criteria.append(FilterCriterion("Read Support", '>=', self.read_support, exclude_nas=self.exclude_NAs))
+            filter_criteria.append(FilterCriterion("Expression", '>=', self.expn_val, exclude_nas=self.exclude_NAs))
+        return Filter(self.input_file, None, filter_criteria)
 
-    def execute_transcript_support_level_filter(self):
-        if self.run_transcript_support_level_filter:
-            print("Running Transcript Support Level Filter")
-            filter_criteria = [FilterCriterion('Transcript Support Level', '<=', self.maximum_transcript_support_level, exclude_nas=True, skip_value='Not Supported')]
-            Filter(
-                self.coverage_filter_fh.name,
-                self.transcript_support_level_filter_fh.name,
-                filter_criteria,
-                ['Transcript Support Level'],
-            ).execute()
-            print("Complete")
-        else:
-            shutil.copy(self.coverage_filter_fh.name, self.transcript_support_level_filter_fh.name)
+    def transcript_support_level_filter(self):
+        if not self.run_transcript_support_level_filter:
+            return None
+        print("Running Transcript Support Level Filter")
+        filter_criteria = [FilterCriterion('Transcript Support Level', '<=', self.maximum_transcript_support_level, exclude_nas=True, skip_value='Not Supported')]
+        return Filter(self.input_file, None, filter_criteria, ['Transcript Support Level'])
 
     def execute_top_score_filter(self):
         if self.el_only:
-            shutil.copy(self.transcript_support_level_filter_fh.name, self.top_score_filter_fh.name)
             return
         print("Running Top Score Filter")
         if self.file_type == 'pVACseq':
             PvacseqTopScoreFilter(
-                self.transcript_support_level_filter_fh.name,
+                self.filtered_file,
                 self.top_score_filter_fh.name,
                 top_score_metric=self.top_score_metric,
                 binding_threshold=self.binding_threshold,
@@ -199,33 +220,32 @@ class PostProcessor:
             ).execute()
         elif self.file_type == 'pVACfuse':
             PvacfuseTopScoreFilter(
-                self.transcript_support_level_filter_fh.name,
+                self.filtered_file,
                 self.top_score_filter_fh.name,
                 top_score_metric = self.top_score_metric,
             ).execute()
         elif self.file_type == 'pVACbind':
             PvacbindTopScoreFilter(
-                self.transcript_support_level_filter_fh.name,
+                self.filtered_file,
                 self.top_score_filter_fh.name,
                 top_score_metric = self.top_score_metric,
             ).execute()
+        self.filtered_file = self.top_score_filter_fh.name
         print("Completed")
 
     def call_net_chop(self):
         if self.run_net_chop:
             print("Submitting remaining epitopes to NetChop")
-            NetChop(self.top_score_filter_fh.name, self.net_chop_fasta, self.net_chop_fh.name, self.net_chop_method, str(self.net_chop_threshold), self.file_type).execute()
+            NetChop(self.filtered_file, self.net_chop_fasta, self.net_chop_fh.name, self.net_chop_method, str(self.net_chop_threshold), self.file_type).execute()
+            self.filtered_file = self.net_chop_fh.name
             print("Completed")
-        else:
-            shutil.copy(self.top_score_filter_fh.name, self.net_chop_fh.name)
 
     def call_netmhc_stab(self):
         if self.run_netmhc_stab:
             print("Running NetMHCStabPan")
-            NetMHCStab(self.net_chop_fh.name, self.netmhc_stab_fh.name, self.file_type, self.top_score_metric).execute()
+            NetMHCStab(self.filtered_file, self.netmhc_stab_fh.name, self.file_type, self.top_score_metric).execute()
+            self.filtered_file = self.netmhc_stab_fh.name
             print("Completed")
-        else:
-            shutil.copy(self.net_chop_fh.name, self.netmhc_stab_fh.name)
 
     def calculate_reference_proteome_similarity(self):
         if self.el_only:
@@ -261,16 +281,12 @@ class PostProcessor:
                     peptide_fasta=self.peptide_fasta,
                 ).execute()
             shutil.move("{}.reference_matches".format(self.reference_similarity_fh.name), "{}.reference_matches".format(self.aggregate_report))
+            shutil.copy(self.reference_similarity_fh.name, self.aggregate_report)
             print("Completed")
-        else:
-            shutil.copy(self.aggregate_report, self.reference_similarity_fh.name)
 
     def close_filehandles(self):
-        self.binding_filter_fh.close()
-        self.coverage_filter_fh.close()
-        self.transcript_support_level_filter_fh.close()
+        self.filter_fh.close()
         self.top_score_filter_fh.close()
         self.net_chop_fh.close()
         self.netmhc_stab_fh.close()
-        self.manufacturability_fh.close()
         self.reference_similarity_fh.close()
@@ -0,0 +1,148 @@
+import os
+import io
+import json
+import sqlite3
+import pandas as pd
+from Bio import SeqIO
+try:
+    from importlib import metadata
+except ImportError:
+    import importlib_metadata as metadata
+
+from pvactools.lib.prediction_class import IEDB
+
+class PredictionCache:
+    #Maximum number of peptides per lookup query to stay below SQLite's variable limit
+    lookup_batch_size = 500
+
+    predictor_distributions = {
+        'MHCflurry'  : 'mhcflurry',
+        'MHCflurryEL': 'mhcflurry',
+        'MHCnuggetsI': 'mhcnuggets',
+        'MHCnuggetsII': 'mhcnuggets',
+        'BigMHC_EL'  : 'bigmhc',
+        'BigMHC_IM'  : 'bigmhc',
+        'DeepImmuno' : 'deepimmuno',
+    }
+
+    def __init__(self, cache_file):
+        self.cache_file = cache_file
+        cache_dir = os.path.dirname(os.path.abspath(cache_file))
+        os.makedirs(cache_dir, exist_ok=True)
+        self.connection = sqlite3.connect(cache_file, timeout=600)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS predictions ("
+            "method TEXT NOT NULL, "
+            "version TEXT NOT NULL, "
+            "allele TEXT NOT NULL, "
+            "peptide TEXT NOT NULL, "
+            "rows TEXT NOT NULL, "
+            "PRIMARY KEY (method, version, allele, peptide))"
+        )
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    @classmethod
+    def distribution_version(cls, distribution):
+        try:
+            return metadata.version(distribution)
+        except metadata.PackageNotFoundError:
+            return 'unknown'
+
+    @classmethod
+    def predictor_version(cls, method, prediction_class_object, iedb_executable_path):
+        pvactools_version = cls.distribution_version("pvactools")
+        if isinstance(prediction_class_object, IEDB):
+            if iedb_executable_path is not None:
+                predictor_version = os.path.abspath(iedb_executable_path)
+            else:
+                predictor_version = prediction_class_object.url
+        else:
+            predictor_version = cls.distribution_version(cls.predictor_distributions.get(method, method))
+        return "{}|{}".format(pvactools_version, predictor_version)
+
+    def lookup(self, method, version, allele, peptides):
+        cached_rows = {}
+        peptides = list(peptides)
+        for i in range(0, len(peptides), self.lookup_batch_size):
+            batch = peptides[i:i+self.lookup_batch_size]
+            query = "SELECT peptide, rows FROM predictions WHERE method = ? AND version = ? AND allele = ? AND peptide IN ({})".format(
+                ",".join("?" * len(batch))
+            )
+            for (peptide, rows) in self.connection.execute(query, [method, version, allele, *batch]):
+                cached_rows[peptide] = json.loads(rows)
+        return cached_rows
+
+    def store(self, method, version, allele, rows_by_peptide):
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO predictions (method, version, allele, peptide, rows) VALUES (?, ?, ?, ?, ?)",
+            [(method, version, allele, peptide, json.dumps(rows)) for (peptide, rows) in rows_by_peptide.items()]
+        )
+        self.connection.commit()
+
+def kmer_positions(input_file, epitope_length):
+    positions = []
+    for record in SeqIO.parse(input_file, "fasta"):
+        sequence = str(record.seq)
+        for i in range(0, len(sequence)-epitope_length+1):
+            positions.append((record.id, i+1, sequence[i:i+epitope_length]))
+    return positions
+
+def response_to_dataframe(response, output_mode):
+    #Normalize the response to the exact strings that would be written to the output file
+    if output_mode == 'pandas':
+        response_text = response.to_csv(index=False, sep="\t")
+    elif output_mode == 'wb':
+        response_text = response.decode()
+    else:
+        response_text = response
+    if response_text is None or response_text.strip() == '':
+        return pd.DataFrame()
+    return pd.read_csv(io.StringIO(response_text), sep="\t", dtype=str, keep_default_na=False)
+
+def rows_by_peptide(response_df, peptides):
+    #Positions are stored relative to the start of the peptide so that
+    #cached rows can be relocated to any occurrence of the peptide.
+    #Peptides without any rows are stored as well so that they aren't predicted again.
+    peptide_rows = {peptide: [] for peptide in peptides}
+    for row in response_df.to_dict(orient='records'):
+        if 'Warning' in row.get('allele', ''):
+            continue
+        offset = int(row['start']) - 1
+        cached_row = dict(row)
+        cached_row['seq_num'] = None
+        cached_row['start'] = offset
+        if 'end' in cached_row:
+            cached_row['end'] = int(row['end']) - int(row['start']) + offset
+        peptide_rows.setdefault(row['peptide'], []).append(cached_row)
+    return peptide_rows
+
+def relocate_cached_rows(positions, cached_rows, group_by_peptide=False):
+    #Rows are returned in the order of the epitope positions in the input file, like the predictors' own output.
+    #Predictors that report all occurrences of a peptide together get them in the order the peptides first occur.
+    if group_by_peptide:
+        positions_by_peptide = {}
+        for position in positions:
+            positions_by_peptide.setdefault(position[2], []).append(position)
+        positions = [position for peptide_positions in positions_by_peptide.values() for position in peptide_positions]
+    rows = []
+    columns = None
+    for (seq_num, start, peptide) in positions:
+        for cached_row in cached_rows.get(peptide, []):
+            row = dict(cached_row)
+            if columns is None:
+                columns = list(row.keys())
+            row['seq_num'] = seq_num
+            row['start'] = str(start + cached_row['start'])
+            if 'end' in row:
+                row['end'] = str(start + cached_row['end'])
+            rows.append(row)
+    return pd.DataFrame(rows, columns=columns)
+
+def write_missing_peptides_fasta(peptides, output_file):
+    with open(output_file, 'w') as fh:
+        for (i, peptide) in enumerate(peptides):
+            fh.write(">{}\n{}\n".format(i+1, peptide))
@@ -6,17 +6,23 @@ import inspect
 import requests
 import re
 import pandas as pd
-import time
 from subprocess import run, DEVNULL, STDOUT
 import tempfile
 from collections import defaultdict
 from Bio import SeqIO
-import random
-import uuid
 import io
+import itertools
+import contextlib
 from datetime import datetime
 
+from pvactools.lib.iedb_client import IEDBClient
+
 class IEDB(metaclass=ABCMeta):
+    #Set by call_iedb to limit the request rate and number of concurrent requests across all prediction workers
+    iedb_requests_per_second = None
+    iedb_max_concurrent_requests = None
+    iedb_state_dir = None
+
     @classmethod
     def iedb_prediction_methods(cls):
         return [prediction_class().iedb_prediction_method for prediction_class in cls.prediction_classes()]
@@ -92,8 +98,9 @@ class IEDB(metaclass=ABCMeta):
                     'user_tool':     'pVac-seq',
                 }
 
+            client = IEDBClient(self.url, self.iedb_state_dir, self.iedb_requests_per_second, self.iedb_max_concurrent_requests)
             response_timestamp = datetime.now()
-            response = requests.post(self.url, data=data)
+            response = client.post(data)
             (peptides_match, input_peptides, output_peptides) = self.check_iedb_api_response_matches(input_file, response.text, epitope_length)
             retries = 0
             while (response.status_code == 500 or response.status_code == 403 or not peptides_match) and retries < iedb_retries:
@@ -110,12 +117,11 @@ class IEDB(metaclass=ABCMeta):
                     else:
                         print(log_text)
 
-                random.seed(uuid.uuid4().int)
-                time.sleep(random.randint(30,90) * retries)
+                client.backoff(retries)
                 retries += 1
                 print("IEDB: Retry %s of %s" % (retries, iedb_retries))
                 response_timestamp = datetime.now()
-                response = requests.post(self.url, data=data)
+                response = client.post(data)
                 (peptides_match, input_peptides, output_peptides) = self.check_iedb_api_response_matches(input_file, response.text, epitope_length)
 
             if response.status_code != 200:
@@ -151,9 +157,19 @@ class MHCnuggets(metaclass=ABCMeta):
     def predict(self, input_file, allele, epitope_length, iedb_executable_path, iedb_retries, class_type, tmp_dir=None, log_dir=None):
         tmp_output_file = tempfile.NamedTemporaryFile('r', dir=tmp_dir, delete=False)
         script = os.path.join(os.path.dirname(os.path.realpath(__file__)), "call_mhcnuggets.py")
-        arguments = ["python", script, input_file, allele, str(epitope_length), class_type, tmp_output_file.name]
+        arguments = [input_file, allele, str(epitope_length), class_type, tmp_output_file.name]
         if tmp_dir:
             arguments.extend(['--tmp-dir', tmp_dir])
+        if self.in_process:
+            #Importing call_mhcnuggets loads TensorFlow once per process instead of once per prediction call
+            import pvactools.lib.call_mhcnuggets
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                pvactools.lib.call_mhcnuggets.main(arguments)
+            tmp_output_file.close()
+            df = pd.read_csv(tmp_output_file.name)
+            os.unlink(tmp_output_file.name)
+            return (df, 'pandas')
+        arguments = ["python", script] + arguments
         stderr_fh = tempfile.NamedTemporaryFile('w', dir=tmp_dir, delete=False)
         try:
             response = run(arguments, check=True, stdout=DEVNULL, stderr=stderr_fh)
@@ -329,6 +345,23 @@ class PredictionClass(metaclass=ABCMeta):
     def needs_epitope_length(self):
         pass
 
+    #Set by call_iedb to load supported predictors into the calling process
+    #instead of launching a new process for every prediction call
+    in_process = False
+
+    @property
+    def supports_multiple_alleles(self):
+        return False
+
+    @property
+    def supports_in_process(self):
+        return False
+
+    #Whether all occurrences of a peptide are reported together instead of in the order of their positions
+    @property
+    def groups_rows_by_peptide(self):
+        return False
+
     def check_allele_valid(self, allele):
         valid_alleles = self.valid_allele_names()
         if allele not in valid_alleles:
@@ -340,6 +373,17 @@ class PredictionClass(metaclass=ABCMeta):
             epitopes[i+1] = sequence[i:i+length]
         return epitopes
 
+    def merge_epitope_positions(self, input_file, epitope_length, df):
+        #Attach the seq_num and start of every occurrence of each predicted epitope with a single merge
+        positions = []
+        for record in SeqIO.parse(input_file, "fasta"):
+            for start, epitope in self.determine_neoepitopes(str(record.seq), epitope_length).items():
+                positions.append((record.id, start, epitope))
+        positions_df = pd.DataFrame(positions, columns=['seq_num', 'start', 'peptide'])
+        positions_df['position'] = range(len(positions_df))
+        results = positions_df.merge(df, on='peptide', how='inner').sort_values('position', kind='stable')
+        return results[list(df.columns) + ['seq_num', 'start']]
+
 
 class MHCI(PredictionClass, metaclass=ABCMeta):
     @property
@@ -399,15 +443,7 @@ class DeepImmuno(MHCI):
                 'HLA': 'allele',
             }, inplace=True)
             output_dir.cleanup()
-            for record in SeqIO.parse(input_file, "fasta"):
-                seq_num = record.id
-                peptide = str(record.seq)
-                epitopes = self.determine_neoepitopes(peptide, epitope_length)
-                for start, epitope in epitopes.items():
-                    epitope_df = df[df['peptide'] == epitope]
-                    epitope_df['seq_num'] = seq_num
-                    epitope_df['start'] = start
-                    results = pd.concat((results, epitope_df), axis=0)
+            results = self.merge_epitope_positions(input_file, epitope_length, df)
         return (results, 'pandas')
 
 
@@ -461,15 +497,7 @@ class BigMHC(metaclass=ABCMeta):
                 'mhc': 'allele',
             }, inplace=True)
             os.unlink(tmp_output_file.name)
-            for record in SeqIO.parse(input_file, "fasta"):
-                seq_num = record.id
-                peptide = str(record.seq)
-                epitopes = self.determine_neoepitopes(peptide, epitope_length)
-                for start, epitope in epitopes.items():
-                    epitope_df = df[df['peptide'] == epitope]
-                    epitope_df['seq_num'] = seq_num
-                    epitope_df['start'] = start
-                    results = pd.concat((results, epitope_df), axis=0)
+            results = self.merge_epitope_positions(input_file, epitope_length, df)
         return (results, 'pandas')
 
 class BigMHC_EL(BigMHC, MHCI):
@@ -481,6 +509,8 @@ class BigMHC_IM(BigMHC, MHCI):
         return self.predict_bigmhc('im', input_file, allele, epitope_length, iedb_executable_path, iedb_retries, tmp_dir=None, log_dir=None)
 
 class MHCflurry(MHCI):
+    #Models loaded for in-process predictions, kept for the lifetime of the process
+    presentation_predictor = None
     def valid_allele_names(self):
         base_dir          = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
         alleles_dir       = os.path.join(base_dir, 'tools', 'pvacseq', 'iedb_alleles', 'class_i')
@@ -494,7 +524,41 @@ class MHCflurry(MHCI):
     def valid_lengths_for_allele(self, allele):
         return [8,9,10,11,12,13,14,15]
 
+    #mhcflurry-predict predicts all combinations of the --alleles and --peptides
+    #and reports each allele as it was passed in
+    @property
+    def supports_multiple_alleles(self):
+        return True
+
+    @property
+    def supports_in_process(self):
+        return True
+
+    def predict_in_process(self, alleles, peptides):
+        #Mirrors the output of mhcflurry-predict without reloading the models on every call
+        from mhcflurry import Class1PresentationPredictor
+        from mhcflurry.downloads import get_default_class1_presentation_models_dir
+        if MHCflurry.presentation_predictor is None:
+            MHCflurry.presentation_predictor = Class1PresentationPredictor.load(get_default_class1_presentation_models_dir(test_exists=True))
+        pairs = list(itertools.product(alleles, peptides))
+        df = pd.DataFrame({
+            'allele': [pair[0] for pair in pairs],
+            'peptide': [pair[1] for pair in pairs],
+        })
+        predictions = MHCflurry.presentation_predictor.predict(
+            peptides=df['peptide'].values,
+            alleles={a: [a] for a in alleles},
+            sample_names=df['allele'],
+            include_affinity_percentile=True,
+            verbose=0,
+        )
+        for column in predictions.columns:
+            if column not in ('allele', 'peptide', 'sample_name', 'peptide_num', 'best_allele'):
+                df['mhcflurry_' + column] = predictions[column]
+        return df
+
     def predict(self, input_file, allele, epitope_length, iedb_executable_path, iedb_retries, tmp_dir=None, log_dir=None):
+        alleles = allele if isinstance(allele, list) else [allele]
         results = pd.DataFrame()
         all_epitopes = []
         for record in SeqIO.parse(input_file, "fasta"):
@@ -504,9 +568,11 @@ class MHCflurry(MHCI):
             all_epitopes.extend(epitopes.values())
 
         all_epitopes = list(set(all_epitopes))
-        if len(all_epitopes) > 0:
+        if len(all_epitopes) > 0 and self.in_process:
+            df = self.predict_in_process(alleles, all_epitopes)
+        elif len(all_epitopes) > 0:
             tmp_output_file = tempfile.NamedTemporaryFile('r', dir=tmp_dir, delete=False)
-            arguments = ["mhcflurry-predict", "--alleles", allele, "--out", tmp_output_file.name, "--peptides"]
+            arguments = ["mhcflurry-predict", "--alleles", *alleles, "--out", tmp_output_file.name, "--peptides"]
             arguments.extend(all_epitopes)
             stderr_fh = tempfile.NamedTemporaryFile('w', dir=tmp_dir, delete=False)
             try:
@@ -522,21 +588,14 @@ class MHCflurry(MHCI):
             tmp_output_file.close()
             df = pd.read_csv(tmp_output_file.name)
             os.unlink(tmp_output_file.name)
+        if len(all_epitopes) > 0:
             df.rename(columns={
                 'mhcflurry_prediction': 'ic50',
                 'mhcflurry_affinity': 'ic50',
                 'mhcflurry_prediction_percentile': 'percentile',
                 'mhcflurry_affinity_percentile': 'percentile'
             }, inplace=True)
-            for record in SeqIO.parse(input_file, "fasta"):
-                seq_num = record.id
-                peptide = str(record.seq)
-                epitopes = self.determine_neoepitopes(peptide, epitope_length)
-                for start, epitope in epitopes.items():
-                    epitope_df = df[df['peptide'] == epitope]
-                    epitope_df['seq_num'] = seq_num
-                    epitope_df['start'] = start
-                    results = pd.concat((results, epitope_df), axis=0)
+            results = self.merge_epitope_positions(input_file, epitope_length, df)
         return (results, 'pandas')
 
 class MHCflurryEL(MHCflurry):
@@ -552,6 +611,14 @@ class MHCnuggetsI(MHCI, MHCnuggets):
     def mhcnuggets_allele(self, allele):
         return allele.replace('*', '')
 
+    @property
+    def supports_in_process(self):
+        return True
+
+    @property
+    def groups_rows_by_peptide(self):
+        return True
+
     def predict(self, input_file, allele, epitope_length, iedb_executable_path, iedb_retries, tmp_dir=None, log_dir=None):
         return MHCnuggets.predict(self, input_file, allele, epitope_length, iedb_executable_path, iedb_retries, 'I', tmp_dir=tmp_dir)
 
@@ -646,6 +713,14 @@ class MHCnuggetsII(MHCII, MHCnuggets):
     def mhcnuggets_allele(self,allele):
         return "HLA-{}".format(allele).replace('*', '')
 
+    @property
+    def supports_in_process(self):
+        return True
+
+    @property
+    def groups_rows_by_peptide(self):
+        return True
+
     def predict(self, input_file, allele, epitope_length, iedb_executable_path, iedb_retries, tmp_dir=None, log_dir=None):
         return MHCnuggets.predict(self, input_file, allele, epitope_length, iedb_executable_path, iedb_retries, 'II', tmp_dir=tmp_dir)
 
@@ -0,0 +1,60 @@
+from Bio import SeqIO
+
+from pvactools.lib.shared_state import SharedState
+
+def count_peptides(fasta_file, epitope_length):
+    peptides = 0
+    for record in SeqIO.parse(fasta_file, "fasta"):
+        peptides += max(len(record.seq) - epitope_length + 1, 0)
+    return peptides
+
+class PredictionCostModel:
+    #Seconds per peptide and allele for each prediction method, learned from the run times of previous
+    #call_iedb calls. Methods without timings are assumed to cost the average of the known methods.
+    default_seconds_per_peptide = 0.01
+    smoothing = 0.5
+
+    def __init__(self, model_file):
+        self.model_file = model_file
+        self.shared_state = SharedState(model_file)
+
+    def seconds_per_peptide(self):
+        return self.shared_state.update(lambda state: (state, dict(state)))
+
+    def estimate(self, arguments, seconds_per_peptide=None):
+        if seconds_per_peptide is None:
+            seconds_per_peptide = self.seconds_per_peptide()
+        (input_file, output_file, method, alleles) = arguments[0:4]
+        epitope_length = int(arguments[arguments.index('-l') + 1])
+        if method in seconds_per_peptide:
+            rate = seconds_per_peptide[method]
+        elif len(seconds_per_peptide) > 0:
+            rate = sum(seconds_per_peptide.values()) / len(seconds_per_peptide)
+        else:
+            rate = self.default_seconds_per_peptide
+        return rate * count_peptides(input_file, epitope_length) * len(alleles.split(','))
+
+    def order_by_cost(self, argument_sets):
+        #Longest first so that the slowest predictions don't end up running alone at the end
+        seconds_per_peptide = self.seconds_per_peptide()
+        costs = [self.estimate(arguments, seconds_per_peptide) for arguments in argument_sets]
+        order = sorted(range(len(argument_sets)), key=lambda i: -costs[i])
+        return ([argument_sets[i] for i in order], [costs[i] for i in order])
+
+    def record(self, arguments, seconds, peptides=None):
+        #peptides is the number of peptides that were actually predicted, e.g. if some of them were
+        #taken from the prediction cache. By default all peptides of the input file are counted.
+        (input_file, output_file, method, alleles) = arguments[0:4]
+        if peptides is None:
+            epitope_length = int(arguments[arguments.index('-l') + 1])
+            peptides = count_peptides(input_file, epitope_length) * len(alleles.split(','))
+        if peptides == 0:
+            return
+        rate = seconds / peptides
+        def update(state):
+            if method in state:
+                state[method] = self.smoothing * rate + (1 - self.smoothing) * state[method]
+            else:
+                state[method] = rate
+            return (state, None)
+        self.shared_state.update(update)
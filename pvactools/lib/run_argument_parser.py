@@ -97,6 +97,16 @@ class RunArgumentParser(metaclass=ABCMeta):
             default=5,
             help="Number of retries when making requests to the IEDB RESTful web interface. Must be less than or equal to 100.",
         )
+        parser.add_argument(
+            "--iedb-requests-per-second", type=float,
+            help="Maximum number of requests per second made to the IEDB RESTful web interface, shared by all prediction workers. "
+                 + "When a request fails, all workers back off before retrying. Default: no limit.",
+        )
+        parser.add_argument(
+            "--iedb-max-concurrent-requests", type=int,
+            help="Maximum number of simultaneous requests to the IEDB RESTful web interface, shared by all prediction workers. "
+                 + "Default: one request per prediction worker.",
+        )
         parser.add_argument(
             "-k", "--keep-tmp-files",
             action='store_true',
@@ -107,6 +117,43 @@ class RunArgumentParser(metaclass=ABCMeta):
             default=1,
             help="Number of threads to use for parallelizing peptide-MHC binding prediction calls.",
         )
+        parser.add_argument(
+            "--prediction-cache",
+            help="Path to a SQLite database used to cache peptide-MHC binding predictions across runs. "
+                 + "Predictions for a peptide, allele, and prediction algorithm that are already in the cache are reused "
+                 + "and only the remaining peptides are sent to the prediction algorithm. "
+                 + "The database will be created if it doesn't exist and can be shared between samples.",
+        )
+        parser.add_argument(
+            "--batch-alleles",
+            help="Predict all alleles for a peptide chunk, epitope length, and prediction algorithm in a single call "
+                 + "for prediction algorithms that support multi-allele input (MHCflurry, MHCflurryEL). "
+                 + "This avoids repeated process launches and model loads for each allele.",
+            default=False,
+            action='store_true',
+        )
+        parser.add_argument(
+            "--prediction-cost-model",
+            help="JSON file with the run time per peptide of each prediction algorithm. It is updated with "
+                 + "the run times of this run and used to start the slowest predictions first. "
+                 + "Share the file between runs to base the estimates on previous runs. "
+                 + "By default, the run times are only kept in the log directory of this run.",
+        )
+        parser.add_argument(
+            "--run-class-i-and-ii-concurrently",
+            help="Run the MHC Class I and MHC Class II pipelines at the same time instead of one after the other. "
+                 + "The --n-threads budget is split between the two pipelines.",
+            default=False,
+            action='store_true',
+        )
+        parser.add_argument(
+            "--in-process-predictions",
+            help="Load the prediction algorithm models once in each prediction worker and reuse them for all of the worker's prediction calls "
+                 + "instead of launching a new process (and reloading the models) for every chunk, allele, and epitope length. "
+                 + "Supported by MHCflurry, MHCflurryEL, MHCnuggetsI, and MHCnuggetsII. Other algorithms are unaffected.",
+            default=False,
+            action='store_true',
+        )
         self.parser = parser
 
 class PredictionRunArgumentParser(RunArgumentParser):
@@ -181,6 +228,14 @@ class PredictionRunArgumentParser(RunArgumentParser):
             default=False,
             action='store_true'
         )
+        self.parser.add_argument(
+            '--incremental',
+            help="When restarting a run in an existing output directory with added or removed alleles, prediction algorithms, or epitope lengths, "
+                 + "only run the predictions that don't exist yet and recreate the reports instead of aborting. "
+                 + "Requires that the previous run was executed with --keep-tmp-files.",
+            default=False,
+            action='store_true'
+        )
 
 class PvacbindRunArgumentParser(PredictionRunArgumentParser):
     def __init__(self):
@@ -291,6 +346,29 @@ class PvacseqRunArgumentParser(PredictionRunWithFastaGenerationArgumentParser):
             default=False,
             action='store_true'
         )
+        self.parser.add_argument(
+            "--split-tsv-by",
+            choices=['rows', 'bytes', 'peptides'],
+            default='rows',
+            help="How to split the converted TSV into chunks for parallel processing. "
+                 + "rows: a fixed number of variants per chunk. bytes: a fixed TSV size per chunk. "
+                 + "peptides: a fixed number of estimated peptides per chunk, which keeps chunks "
+                 + "with many frameshifts from taking much longer than others.",
+        )
+        self.parser.add_argument(
+            "--tsv-chunk-size", type=int,
+            help="The number of rows, bytes, or estimated peptides per TSV chunk, depending on --split-tsv-by. "
+                 + "By default, chunks of rows and peptides are sized based on --fasta-size. Required when splitting by bytes.",
+        )
+        self.parser.add_argument(
+            '--intermediate-format',
+            choices=['tsv', 'parquet'],
+            default='tsv',
+            help="File format of the parsed prediction files in the tmp directory. "
+                 + "With parquet, the aggregated report reads the columns it uses for ranking the epitopes from the Parquet files "
+                 + "instead of parsing the whole all_epitopes report. This has no effect when --problematic-amino-acids is set "
+                 + "because marking the problematic positions rewrites the all_epitopes report. The reports are always written as TSV files.",
+        )
         self.parser.add_argument(
             "--tumor-purity",
             help="Value between 0 and 1 indicating the fraction of tumor cells in the tumor sample. Information is used during aggregate report creation for a simple estimation of whether variants are subclonal or clonal based on VAF. If not provided, purity is estimated directly from the VAFs.",
@@ -0,0 +1,95 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+
+#Content hashes by path, size, and modification time so that files read by many tasks are only hashed once per process
+file_hashes = {}
+
+def file_hash(path):
+    if path is None or not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if key not in file_hashes:
+        sha256 = hashlib.sha256()
+        with open(path, 'rb') as fh:
+            for block in iter(lambda: fh.read(1024 * 1024), b''):
+                sha256.update(block)
+        file_hashes[key] = sha256.hexdigest()
+    return file_hashes[key]
+
+class RunManifest:
+    #Records the output files of completed tasks together with the hash of the inputs they were created from.
+    #A restarted run only redoes a task if its inputs changed or if its output is missing, has a different size
+    #than when the task completed, or was never completed, e.g. because the run was interrupted while writing it.
+    #Outputs without a record that are older than the manifest itself were written by a version without a
+    #manifest and are reused as before.
+    #Connections are opened per call so that the manifest can be used from forked worker processes.
+    def __init__(self, manifest_file):
+        self.manifest_file = manifest_file
+        self.base_dir = os.path.dirname(os.path.abspath(manifest_file))
+        connection = self.connect()
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS tasks ("
+            "output_file TEXT PRIMARY KEY, "
+            "input_hash TEXT NOT NULL, "
+            "size INTEGER NOT NULL, "
+            "completed REAL NOT NULL)"
+        )
+        connection.execute("CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value)")
+        connection.execute("INSERT OR IGNORE INTO settings (name, value) VALUES ('created', ?)", [time.time()])
+        connection.commit()
+        self.created = connection.execute("SELECT value FROM settings WHERE name = 'created'").fetchone()[0]
+        connection.close()
+
+    @staticmethod
+    def input_hash(input_files=[], params={}):
+        #Hash of the task parameters and the contents of the task's input files
+        sha256 = hashlib.sha256()
+        sha256.update(json.dumps(params, sort_keys=True, default=str).encode())
+        for input_file in input_files:
+            sha256.update(str(file_hash(input_file)).encode())
+        return sha256.hexdigest()
+
+    def connect(self):
+        connection = sqlite3.connect(self.manifest_file, timeout=600)
+        connection.execute("PRAGMA journal_mode=WAL")
+        return connection
+
+    def key(self, output_file):
+        return os.path.relpath(os.path.abspath(output_file), self.base_dir)
+
+    def is_complete(self, output_files, input_hash):
+        if isinstance(output_files, str):
+            output_files = [output_files]
+        connection = self.connect()
+        try:
+            for output_file in output_files:
+                row = connection.execute(
+                    "SELECT input_hash, size FROM tasks WHERE output_file = ?", [self.key(output_file)]
+                ).fetchone()
+                if row is None and self.predates_manifest(output_file):
+                    continue
+                if row is None or row[0] != input_hash:
+                    return False
+                if not os.path.exists(output_file) or os.path.getsize(output_file) != row[1]:
+                    return False
+        finally:
+            connection.close()
+        return True
+
+    def predates_manifest(self, output_file):
+        return os.path.exists(output_file) and os.path.getmtime(output_file) < self.created
+
+    def mark_complete(self, output_files, input_hash):
+        if isinstance(output_files, str):
+            output_files = [output_files]
+        connection = self.connect()
+        connection.executemany(
+            "INSERT OR REPLACE INTO tasks (output_file, input_hash, size, completed) VALUES (?, ?, ?, ?)",
+            [(self.key(output_file), input_hash, os.path.getsize(output_file), time.time()) for output_file in output_files]
+        )
+        connection.commit()
+        connection.close()
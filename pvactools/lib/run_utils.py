@@ -3,6 +3,7 @@ import os
 import csv
 import binascii
 import re
+import multiprocessing
 from itertools import islice, product
 
 from pvactools.lib.prediction_class import *
@@ -89,6 +90,48 @@ def combine_reports(input_files, output_file):
                 for row in reader:
                     writer.writerow(row)
 
+def split_threads(n_threads, n_parts):
+    #Divide the thread budget between n_parts concurrently running parts. Each part gets at least one thread.
+    return [max(1, n_threads // n_parts + (1 if i < n_threads % n_parts else 0)) for i in range(n_parts)]
+
+def send_result(connection, function, args):
+    try:
+        connection.send((True, function(*args)))
+    except BaseException as err:
+        connection.send((False, err))
+    finally:
+        connection.close()
+
+def run_concurrently(function_calls):
+    #Each (function, args) call runs in its own non-daemonic process so that it can start its own workers.
+    #Returns the results in the order of the calls and re-raises the first error, including sys.exit calls.
+    context = multiprocessing.get_context('fork')
+    processes = []
+    for (function, args) in function_calls:
+        (receiver, sender) = context.Pipe(duplex=False)
+        process = context.Process(target=send_result, args=(sender, function, args))
+        process.start()
+        sender.close()
+        processes.append((process, receiver))
+    outcomes = []
+    for (process, receiver) in processes:
+        try:
+            outcomes.append(receiver.recv())
+        except EOFError:
+            outcomes.append((False, Exception("Process exited unexpectedly with exit code {}".format(process.exitcode))))
+        process.join()
+    for (succeeded, result) in outcomes:
+        if not succeeded:
+            raise result
+    return [result for (succeeded, result) in outcomes]
+
+def execute_pipelines(pipelines, n_threads, concurrently=False):
+    if concurrently and len(pipelines) > 1:
+        for (pipeline, pipeline_n_threads) in zip(pipelines, split_threads(n_threads, len(pipelines))):
+            pipeline.n_threads = pipeline_n_threads
+        return run_concurrently([(pipeline.execute, []) for pipeline in pipelines])
+    return [pipeline.execute() for pipeline in pipelines]
+
 def change_permissions_recursive(path, dir_mode, file_mode):
     for root, dirs, files in os.walk(path, topdown=False):
         for dir in [os.path.join(root,d) for d in dirs]:
@@ -0,0 +1,24 @@
+import json
+import fcntl
+
+class SharedState:
+    #JSON state file guarded by an exclusive lock so that all prediction workers,
+    #including the forked pymp workers, see the same state
+    def __init__(self, state_file):
+        self.state_file = state_file
+
+    def update(self, function):
+        with open(self.state_file, 'a+') as state_fh:
+            fcntl.flock(state_fh, fcntl.LOCK_EX)
+            try:
+                state_fh.seek(0)
+                contents = state_fh.read()
+                state = json.loads(contents) if contents else {}
+                (state, result) = function(state)
+                state_fh.seek(0)
+                state_fh.truncate()
+                json.dump(state, state_fh)
+                state_fh.flush()
+            finally:
+                fcntl.flock(state_fh, fcntl.LOCK_UN)
+        return result
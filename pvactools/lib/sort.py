@@ -1,28 +1,75 @@
+import os
+import sys
+import csv
+import heapq
+import tempfile
+import itertools
+
+csv.field_size_limit(sys.maxsize)
+
 def default_sort(rows, top_score_metric):
-    if top_score_metric == 'median':
-        sorted_rows = sorted(rows, key=lambda row: (float(row['Best MT IC50 Score'])))
-        sorted_rows = sorted(sorted_rows, key=lambda row: (float(row['Corresponding Fold Change']) if str(row['Corresponding Fold Change']).isdigit() else float('inf')), reverse=True)
-        sorted_rows = sorted(sorted_rows, key=lambda row: (float(row['Median MT IC50 Score'])))
-    elif top_score_metric == 'lowest':
-        sorted_rows = sorted(rows, key=lambda row: (float(row['Median MT IC50 Score'])))
-        sorted_rows = sorted(sorted_rows, key=lambda row: (float(row['Corresponding Fold Change']) if row['Corresponding Fold Change'].isdigit() else float('inf')), reverse=True)
-        sorted_rows = sorted(sorted_rows, key=lambda row: (float(row['Best MT IC50 Score'])))
-    return sorted_rows
+    return sorted(rows, key=default_sort_key(top_score_metric))
 
 def default_sort_from_pd_dict(rows, top_score_metric):
+    #Fold changes can be NaN here, which doesn't have a consistent order in a single tuple key, so the
+    #keys are computed once and the rows are sorted by each of them in turn
     if top_score_metric == 'median':
-        sorted_rows = sorted(rows, key=lambda row: row['Best MT IC50 Score'])
-        sorted_rows = sorted(sorted_rows, key=lambda row: (row['Corresponding Fold Change'] if isinstance(row['Corresponding Fold Change'], float) else float('inf')), reverse=True)
-        sorted_rows = sorted(sorted_rows, key=lambda row: row['Median MT IC50 Score'])
+        columns = ['Best MT IC50 Score', 'Median MT IC50 Score']
     elif top_score_metric == 'lowest':
-        sorted_rows = sorted(rows, key=lambda row: row['Median MT IC50 Score'])
-        sorted_rows = sorted(sorted_rows, key=lambda row: (row['Corresponding Fold Change'] if isinstance(row['Corresponding Fold Change'], float) else float('inf')), reverse=True)
-        sorted_rows = sorted(sorted_rows, key=lambda row: row['Best MT IC50 Score'])
-    return sorted_rows
+        columns = ['Median MT IC50 Score', 'Best MT IC50 Score']
+    keyed_rows = [(
+        row[columns[0]],
+        row['Corresponding Fold Change'] if isinstance(row['Corresponding Fold Change'], float) else float('inf'),
+        row[columns[1]],
+        row,
+    ) for row in rows]
+    keyed_rows = sorted(keyed_rows, key=lambda keyed_row: keyed_row[0])
+    keyed_rows = sorted(keyed_rows, key=lambda keyed_row: keyed_row[1], reverse=True)
+    keyed_rows = sorted(keyed_rows, key=lambda keyed_row: keyed_row[2])
+    return [keyed_row[3] for keyed_row in keyed_rows]
 
 def pvacbind_sort(rows, top_score_metric):
+    return sorted(rows, key=pvacbind_sort_key(top_score_metric))
+
+def default_sort_key(top_score_metric):
+    #A single key that orders rows by the top score metric, then by descending fold change, then by the other score
+    def fold_change(row):
+        return float(row['Corresponding Fold Change']) if str(row['Corresponding Fold Change']).isdigit() else float('inf')
     if top_score_metric == 'median':
-        sorted_rows = sorted(rows, key=lambda row: ( float(row['Median IC50 Score']), int(row['Sub-peptide Position']), float(row['Best IC50 Score']), row['Mutation'] ) )
+        return lambda row: (float(row['Median MT IC50 Score']), -fold_change(row), float(row['Best MT IC50 Score']))
     elif top_score_metric == 'lowest':
-        sorted_rows = sorted(rows, key=lambda row: ( float(row['Best IC50 Score']), int(row['Sub-peptide Position']), float(row['Median IC50 Score']), row['Mutation'] ) )
-    return sorted_rows
+        return lambda row: (float(row['Best MT IC50 Score']), -fold_change(row), float(row['Median MT IC50 Score']))
+
+def pvacbind_sort_key(top_score_metric):
+    if top_score_metric == 'median':
+        return lambda row: ( float(row['Median IC50 Score']), int(row['Sub-peptide Position']), float(row['Best IC50 Score']), row['Mutation'] )
+    elif top_score_metric == 'lowest':
+        return lambda row: ( float(row['Best IC50 Score']), int(row['Sub-peptide Position']), float(row['Median IC50 Score']), row['Mutation'] )
+
+def external_sort(rows, key, fieldnames, run_size=500000):
+    #Sorts rows that don't fit into memory. If there are no more than run_size rows they are sorted in memory.
+    #Otherwise runs of run_size rows are sorted and written to temporary TSVs which are then merged.
+    #Rows with equal keys stay in input order, the same as with sorted().
+    rows = iter(rows)
+    run = sorted(itertools.islice(rows, run_size), key=key)
+    next_row = list(itertools.islice(rows, 1))
+    if len(next_row) == 0:
+        yield from run
+        return
+    rows = itertools.chain(next_row, rows)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        run_files = []
+        while len(run) > 0:
+            run_file = os.path.join(tmp_dir, "{}.tsv".format(len(run_files)))
+            with open(run_file, 'w') as run_fh:
+                writer = csv.DictWriter(run_fh, fieldnames, delimiter='\t', lineterminator='\n', restval='NA')
+                writer.writeheader()
+                writer.writerows(run)
+            run_files.append(run_file)
+            run = sorted(itertools.islice(rows, run_size), key=key)
+        run_fhs = [open(run_file, 'r') for run_file in run_files]
+        try:
+            yield from heapq.merge(*[csv.DictReader(run_fh, delimiter='\t') for run_fh in run_fhs], key=key)
+        finally:
+            for run_fh in run_fhs:
+                run_fh.close()
@@ -0,0 +1,77 @@
+import heapq
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+class Task:
+    def __init__(self, task_id, function, args, dependencies, callback, priority):
+        self.task_id = task_id
+        self.priority = priority
+        self.function = function
+        self.args = args
+        self.dependencies = set(dependencies)
+        self.callback = callback
+
+class TaskGraph:
+    #Runs tasks as soon as all of their dependencies are done, using a bounded pool of worker processes.
+    #When several tasks are ready the one with the highest priority runs first, or the one added first
+    #if their priorities are equal. Callbacks run in the calling process with the task's result and may
+    #add new tasks, e.g. tasks that depend on files written by the finished task.
+    #Tasks without a function only wait for their dependencies and run their callback.
+    def __init__(self):
+        self.tasks = {}
+        self.dependents = {}
+        self.completed = set()
+        self.ready = []
+        self.next_task_id = 0
+
+    def add_task(self, function, args=[], dependencies=[], callback=None, priority=0):
+        task_id = self.next_task_id
+        self.next_task_id += 1
+        task = Task(task_id, function, args, [d for d in dependencies if d not in self.completed], callback, priority)
+        self.tasks[task_id] = task
+        for dependency in task.dependencies:
+            self.dependents.setdefault(dependency, []).append(task_id)
+        if len(task.dependencies) == 0:
+            heapq.heappush(self.ready, (-task.priority, task_id))
+        return task_id
+
+    def complete(self, task_id, result):
+        task = self.tasks.pop(task_id)
+        self.completed.add(task_id)
+        for dependent_id in self.dependents.pop(task_id, []):
+            dependent = self.tasks[dependent_id]
+            dependent.dependencies.discard(task_id)
+            if len(dependent.dependencies) == 0:
+                heapq.heappush(self.ready, (-dependent.priority, dependent_id))
+        if task.callback is not None:
+            task.callback(result)
+
+    def run(self, n_workers=1):
+        if n_workers <= 1:
+            while len(self.ready) > 0:
+                task = self.tasks[heapq.heappop(self.ready)[1]]
+                self.complete(task.task_id, task.function(*task.args) if task.function is not None else None)
+        else:
+            with ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context('fork')) as executor:
+                running = {}
+                while len(self.ready) > 0 or len(running) > 0:
+                    while len(self.ready) > 0 and len(running) < n_workers:
+                        task = self.tasks[heapq.heappop(self.ready)[1]]
+                        if task.function is None:
+                            self.complete(task.task_id, None)
+                            continue
+                        running[executor.submit(task.function, *task.args)] = task.task_id
+                    if len(running) == 0:
+                        continue
+                    (done, not_done) = wait(running.keys(), return_when=FIRST_COMPLETED)
+                    for future in done:
+                        task_id = running.pop(future)
+                        try:
+                            result = future.result()
+                        except BaseException:
+                            for remaining in running.keys():
+                                remaining.cancel()
+                            raise
+                        self.complete(task_id, result)
+        if len(self.tasks) > 0:
+            raise Exception("Unable to run {} tasks because their dependencies never completed".format(len(self.tasks)))
@@ -12,6 +12,7 @@ from abc import ABCMeta, abstractmethod
 from pvactools.lib.run_utils import *
 import pvactools.lib.sort
 from pvactools.lib.prediction_class import PredictionClass
+from pvactools.lib.anchor_positions import AnchorPositions
 
 class TopScoreFilter(metaclass=ABCMeta):
     @classmethod
@@ -125,31 +126,9 @@ class PvacseqTopScoreFilter(TopScoreFilter, metaclass=ABCMeta):
         self.maximum_transcript_support_level = maximum_transcript_support_level
         self.allele_specific_anchors = allele_specific_anchors
         self.anchor_contribution_threshold = anchor_contribution_threshold
-        anchor_probabilities = {}
-        for length in [8, 9, 10, 11]:
-            base_dir = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
-            file_name = os.path.join(base_dir, 'tools', 'pvacview', 'data', "Normalized_anchor_predictions_{}_mer.tsv".format(length))
-            probs = {}
-            with open(file_name, 'r') as fh:
-                reader = csv.DictReader(fh, delimiter="\t")
-                for line in reader:
-                    hla = line.pop('HLA')
-                    probs[hla] = line
-            anchor_probabilities[length] = probs
-        self.anchor_probabilities = anchor_probabilities
-
-        mouse_anchor_positions = {}
-        for length in [8, 9, 10, 11]:
-            base_dir = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
-            file_name = os.path.join(base_dir, 'tools', 'pvacview', 'data', "mouse_anchor_predictions_{}_mer.tsv".format(length))
-            values = {}
-            with open(file_name, 'r') as fh:
-                reader = csv.DictReader(fh, delimiter="\t")
-                for line in reader:
-                    allele = line.pop('Allele')
-                    values[allele] = {int(k): ast.literal_eval(v) for k, v in line.items()}
-            mouse_anchor_positions[length] = values
-        self.mouse_anchor_positions = mouse_anchor_positions
+        self.anchor_positions = AnchorPositions(allele_specific_anchors, anchor_contribution_threshold)
+        self.anchor_probabilities = self.anchor_positions.anchor_probabilities
+        self.mouse_anchor_positions = self.anchor_positions.mouse_anchor_positions
 
     def execute(self):
         with open(self.input_file) as input_fh, open(self.output_file, 'w') as output_fh:
@@ -168,6 +147,10 @@ class PvacseqTopScoreFilter(TopScoreFilter, metaclass=ABCMeta):
                 index = '%s.%s.%s.%s.%s' % (chromosome, start, stop, ref, var)
                 lines_per_variant[index].append(line)
 
+            all_lines = [line for lines in lines_per_variant.values() for line in lines]
+            for (line, anchor_residue_pass) in zip(all_lines, self.anchor_residue_passes(all_lines)):
+                line['anchor_residue_pass'] = anchor_residue_pass
+
             filtered_lines = []
             for index, lines in lines_per_variant.items():
                 lines = sorted(lines, key = itemgetter('Transcript'))
@@ -218,7 +201,7 @@ class PvacseqTopScoreFilter(TopScoreFilter, metaclass=ABCMeta):
             prob_pos_lines = tsl_lines
 
         #subset prob_pos dataset to only include entries that pass the anchor position check
-        anchor_residue_pass_lines = [x for x in prob_pos_lines if self.is_anchor_residue_pass(x)]
+        anchor_residue_pass_lines = [x for x in prob_pos_lines if x['anchor_residue_pass']]
         if len(anchor_residue_pass_lines) == 0:
             anchor_residue_pass_lines = prob_pos_lines
 
@@ -229,30 +212,31 @@ class PvacseqTopScoreFilter(TopScoreFilter, metaclass=ABCMeta):
         sorted_anchor_residue_pass_lines = sorted(anchor_residue_pass_lines, key=lambda d: (float(d["{} MT IC50 Score".format(self.mt_top_score_metric)]), d['TSL Sort'], -int(d['Transcript Length'])))
         return sorted_anchor_residue_pass_lines[0]
 
-    def is_anchor_residue_pass(self, line):
+    def get_binding_threshold(self, hla_allele):
         if self.use_allele_specific_binding_thresholds:
-            binding_threshold = self.allele_specific_binding_thresholds[line['HLA Allele']]
+            return self.allele_specific_binding_thresholds[hla_allele]
         else:
-            binding_threshold = self.binding_threshold
-
-        anchor_residue_pass = True
-        anchors = get_anchor_positions(line['HLA Allele'], len(line['MT Epitope Seq']), self.allele_specific_anchors, self.anchor_probabilities, self.anchor_contribution_threshold, self.mouse_anchor_positions)
-        # parse out mutation position from str
-        position = line["Mutation Position"]
-        if '-' in position:
-            d_ind = position.index('-')
-            if all(pos in anchors for pos in range(int(position[0:d_ind]), int(position[d_ind+1:])+1)):
-                if line["{} WT IC50 Score".format(self.wt_top_score_metric)] == "NA":
-                    anchor_residue_pass = False
-                elif float(line["{} WT IC50 Score".format(self.wt_top_score_metric)]) < binding_threshold:
-                    anchor_residue_pass = False
-        elif position != "NA":
-            if int(float(position)) in anchors:
-                if line["{} WT IC50 Score".format(self.wt_top_score_metric)] == "NA":
-                    anchor_residue_pass = False
-                elif float(line["{} WT IC50 Score".format(self.wt_top_score_metric)]) < binding_threshold:
-                    anchor_residue_pass = False
-        return anchor_residue_pass
+            return self.binding_threshold
+
+    def anchor_residue_passes(self, lines):
+        wt_ic50_column = "{} WT IC50 Score".format(self.wt_top_score_metric)
+        return self.anchor_positions.anchor_residue_passes(
+            [line['HLA Allele'] for line in lines],
+            [len(line['MT Epitope Seq']) for line in lines],
+            [line['Mutation Position'] for line in lines],
+            [float('nan') if line[wt_ic50_column] == 'NA' else float(line[wt_ic50_column]) for line in lines],
+            [self.get_binding_threshold(line['HLA Allele']) for line in lines],
+        )
+
+    def is_anchor_residue_pass(self, line):
+        wt_ic50 = line["{} WT IC50 Score".format(self.wt_top_score_metric)]
+        return self.anchor_positions.anchor_residue_pass(
+            line['HLA Allele'],
+            len(line['MT Epitope Seq']),
+            line['Mutation Position'],
+            float('nan') if wt_ic50 == 'NA' else float(wt_ic50),
+            self.get_binding_threshold(line['HLA Allele']),
+        )
 
 
 
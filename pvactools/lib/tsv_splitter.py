@@ -0,0 +1,119 @@
+import os
+import re
+import sys
+import csv
+import yaml
+
+from pvactools.lib.run_manifest import file_hash
+
+csv.field_size_limit(sys.maxsize)
+
+class TsvSplitter:
+    #Splits the converted TSV into chunk files in a single pass. A chunk is closed once it reaches
+    #chunk_size rows, bytes, or estimated peptides, so that chunks with long frameshift sequences
+    #don't end up much larger than others. The chunks are recorded in a manifest next to the TSV.
+    def __init__(self, input_file, split_by, chunk_size, epitope_lengths, downstream_sequence_length=None):
+        if split_by not in ['rows', 'bytes', 'peptides']:
+            raise Exception("Unknown split type {}".format(split_by))
+        self.input_file = input_file
+        self.split_by = split_by
+        self.chunk_size = chunk_size
+        self.epitope_lengths = epitope_lengths
+        self.downstream_sequence_length = downstream_sequence_length
+
+    def manifest_path(self):
+        return "{}.chunks.yml".format(self.input_file)
+
+    def chunk_path(self, split_start, split_end):
+        return "%s_%d-%d" % (self.input_file, split_start, split_end)
+
+    def estimated_peptides(self, row):
+        #Number of WT and MT k-mers the FASTA generator will create for this row over all epitope lengths
+        match = re.match(r'\d+', row['protein_position'])
+        position = int(match.group(0)) - 1 if match else 0
+        peptides = 0
+        for epitope_length in self.epitope_lengths:
+            flanking_length = epitope_length - 1
+            wildtype_length = min(2 * flanking_length + 1, len(row['wildtype_amino_acid_sequence']))
+            if row['variant_type'] == 'FS':
+                downstream_length = max(len(row['frameshift_amino_acid_sequence']) - position, 0)
+                if self.downstream_sequence_length is not None:
+                    downstream_length = min(downstream_length, self.downstream_sequence_length)
+                mutant_length = min(position, flanking_length) + downstream_length
+            else:
+                mutant_length = wildtype_length
+            peptides += max(wildtype_length - epitope_length + 1, 0) + max(mutant_length - epitope_length + 1, 0)
+        return peptides
+
+    def existing_chunks(self):
+        if not os.path.exists(self.manifest_path()):
+            return None
+        with open(self.manifest_path(), 'r') as fh:
+            manifest = yaml.load(fh, Loader=yaml.FullLoader)
+        if manifest['split_by'] != self.split_by or manifest['chunk_size'] != self.chunk_size:
+            return None
+        if manifest.get('input_hash') != file_hash(self.input_file):
+            return None
+        for chunk in manifest['chunks']:
+            if not os.path.exists(self.chunk_path(chunk['start'], chunk['end'])):
+                return None
+        return manifest['chunks']
+
+    def write_manifest(self, chunks):
+        manifest = {
+            'input_file': os.path.basename(self.input_file),
+            'input_hash': file_hash(self.input_file),
+            'split_by': self.split_by,
+            'chunk_size': self.chunk_size,
+            'chunks': chunks,
+        }
+        tmp_manifest_path = "{}.tmp".format(self.manifest_path())
+        with open(tmp_manifest_path, 'w') as fh:
+            yaml.dump(manifest, fh, default_flow_style=False, sort_keys=False)
+        os.replace(tmp_manifest_path, self.manifest_path())
+
+    def execute(self):
+        chunks = self.existing_chunks()
+        if chunks is not None:
+            print("Split TSV files already exist. Skipping.")
+            return chunks
+
+        chunks = []
+        tmp_chunk_path = "{}.split.tmp".format(self.input_file)
+        with open(self.input_file, 'r') as input_fh:
+            reader = csv.reader(input_fh, delimiter='\t')
+            header = next(reader, None)
+            chunk_fh = None
+            row_count = 0
+            for fields in reader:
+                row_count += 1
+                if chunk_fh is None:
+                    chunk_fh = open(tmp_chunk_path, 'w')
+                    writer = csv.writer(chunk_fh, delimiter='\t', lineterminator='\r\n')
+                    writer.writerow(header)
+                    chunk = {'start': row_count, 'end': row_count, 'rows': 0, 'bytes': 0, 'estimated_peptides': 0}
+                row = dict(zip(header, fields))
+                writer.writerow(fields)
+                chunk['end'] = row_count
+                chunk['rows'] += 1
+                chunk['bytes'] += sum(len(field) for field in fields) + len(fields)
+                chunk['estimated_peptides'] += self.estimated_peptides(row)
+                if chunk[self.cost_key()] >= self.chunk_size:
+                    chunk_fh.close()
+                    chunk_fh = None
+                    chunks.append(self.finish_chunk(tmp_chunk_path, chunk))
+            if chunk_fh is not None:
+                chunk_fh.close()
+                chunks.append(self.finish_chunk(tmp_chunk_path, chunk))
+        self.write_manifest(chunks)
+        return chunks
+
+    def cost_key(self):
+        return {'rows': 'rows', 'bytes': 'bytes', 'peptides': 'estimated_peptides'}[self.split_by]
+
+    def finish_chunk(self, tmp_chunk_path, chunk):
+        print("Splitting TSV into smaller chunks - Entries %d-%d" % (chunk['start'], chunk['end']))
+        chunk_path = self.chunk_path(chunk['start'], chunk['end'])
+        os.replace(tmp_chunk_path, chunk_path)
+        chunk['file'] = os.path.basename(chunk_path)
+        return chunk
@@ -51,6 +51,11 @@ def define_parser():
              + "lowest: Use the best MT Score and Corresponding Fold Change (i.e. the lowest MT ic50 binding score and corresponding fold change of all chosen prediction methods). "
              + "median: Use the median MT Score and Median Fold Change (i.e. the  median MT ic50 binding score and fold change of all chosen prediction methods)."
     )
+    parser.add_argument(
+        "-t", "--n-threads", type=int,
+        help="Number of worker processes to use for aggregating variants.",
+        default=1
+    )
 
     return parser
 
@@ -69,6 +74,7 @@ def main(args_input = sys.argv[1:]):
         percentile_threshold=args.percentile_threshold,
         top_score_metric=args.top_score_metric,
         aggregate_inclusion_binding_threshold=args.aggregate_inclusion_binding_threshold,
+        n_threads=args.n_threads,
     ).execute()
     print("Completed")
 
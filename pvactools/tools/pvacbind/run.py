@@ -56,6 +56,7 @@ def main(args_input = sys.argv[1:]):
 
     input_file_type = 'fasta'
     base_output_dir = os.path.abspath(args.output_dir)
+    iedb_state_dir = os.path.join(base_output_dir, 'tmp')
 
     (class_i_prediction_algorithms, class_ii_prediction_algorithms) = pvactools.lib.run_utils.split_algorithms(args.prediction_algorithms)
     alleles = pvactools.lib.run_utils.combine_class_ii_alleles(args.allele)
@@ -75,8 +76,16 @@ def main(args_input = sys.argv[1:]):
         'additional_report_columns' : args.additional_report_columns,
         'fasta_size'                : args.fasta_size,
         'iedb_retries'              : args.iedb_retries,
+        'iedb_requests_per_second'  : args.iedb_requests_per_second,
+        'iedb_max_concurrent_requests': args.iedb_max_concurrent_requests,
+        'iedb_state_dir'            : iedb_state_dir,
         'keep_tmp_files'            : args.keep_tmp_files,
+        'incremental'               : args.incremental,
         'n_threads'                 : args.n_threads,
+        'prediction_cache'          : args.prediction_cache,
+        'batch_alleles'             : args.batch_alleles,
+        'in_process_predictions'    : args.in_process_predictions,
+        'prediction_cost_model'     : args.prediction_cost_model,
         'species'                   : species,
         'run_reference_proteome_similarity': args.run_reference_proteome_similarity,
         'blastp_path'               : args.blastp_path,
@@ -88,6 +97,7 @@ def main(args_input = sys.argv[1:]):
         'aggregate_inclusion_binding_threshold': args.aggregate_inclusion_binding_threshold,
     }
 
+    pipelines = []
     if len(class_i_prediction_algorithms) > 0 and len(class_i_alleles) > 0:
         if args.iedb_install_directory:
             iedb_mhc_i_executable = os.path.join(args.iedb_install_directory, 'mhc_i', 'src', 'predict_binding.py')
@@ -108,8 +118,7 @@ def main(args_input = sys.argv[1:]):
         class_i_arguments['prediction_algorithms']   = class_i_prediction_algorithms
         class_i_arguments['output_dir']              = output_dir
         class_i_arguments['netmhc_stab']             = args.netmhc_stab
-        pipeline = PvacbindPipeline(**class_i_arguments)
-        pipeline.execute()
+        pipelines.append(PvacbindPipeline(**class_i_arguments))
     elif len(class_i_prediction_algorithms) == 0:
         print("No MHC class I prediction algorithms chosen. Skipping MHC class I predictions.")
     elif len(class_i_alleles) == 0:
@@ -135,17 +144,21 @@ def main(args_input = sys.argv[1:]):
         class_ii_arguments['epitope_lengths']         = args.class_ii_epitope_length
         class_ii_arguments['output_dir']              = output_dir
         class_ii_arguments['netmhc_stab']             = False
-        pipeline = PvacbindPipeline(**class_ii_arguments)
-        pipeline.execute()
+        pipelines.append(PvacbindPipeline(**class_ii_arguments))
     elif len(class_ii_prediction_algorithms) == 0:
         print("No MHC class II prediction algorithms chosen. Skipping MHC class II predictions.")
     elif len(class_ii_alleles) == 0:
         print("No MHC class II alleles chosen. Skipping MHC class II predictions.")
 
+    pvactools.lib.run_utils.execute_pipelines(pipelines, args.n_threads, args.run_class_i_and_ii_concurrently)
+
     if len(class_i_prediction_algorithms) > 0 and len(class_i_alleles) > 0 and len(class_ii_prediction_algorithms) > 0 and len(class_ii_alleles) > 0:
         print("Creating combined reports")
         create_combined_reports(base_output_dir, args)
 
+    if not args.keep_tmp_files:
+        shutil.rmtree(iedb_state_dir, ignore_errors=True)
+
     pvactools.lib.run_utils.change_permissions_recursive(base_output_dir, 0o755, 0o644)
 
 if __name__ == '__main__':
@@ -61,6 +61,11 @@ def define_parser():
         help="Expression Cutoff. Expression is meassured as FFPM (fusion fragments per million total reads). When failing this cutoff sites will be binned in the \"LowExpr\" tier.",
         default=0.1
     )
+    parser.add_argument(
+        "-t", "--n-threads", type=int,
+        help="Number of worker processes to use for aggregating variants.",
+        default=1
+    )
 
     return parser
 
@@ -81,6 +86,7 @@ def main(args_input = sys.argv[1:]):
         read_support=args.read_support,
         expn_val=args.expn_val,
         aggregate_inclusion_binding_threshold=args.aggregate_inclusion_binding_threshold,
+        n_threads=args.n_threads,
     ).execute()
     print("Completed")
 
@@ -37,6 +37,7 @@ def create_net_class_report(files, all_epitopes_output_file, filtered_report_fil
     post_processing_params['run_netmhc_stab'] = True if run_params['netmhc_stab'] else False
     post_processing_params['fasta'] = run_params['fasta']
     post_processing_params['species'] = run_params['species']
+    post_processing_params['n_threads'] = run_params['n_threads']
     post_processing_params['file_type'] = 'pVACfuse'
 
     PostProcessor(**post_processing_params).execute()
@@ -108,6 +109,66 @@ def append_columns(intermediate_output_file, tsv_file, output_file):
             line['Expression'] = matching_line['fusion_expression']
             writer.writerow(line)
 
+def run_mhc_class(mhc_class, params, shared_arguments, base_output_dir, args):
+    prediction_algorithms = params['prediction_algorithms']
+    alleles = params['alleles']
+    epitope_lengths = params['epitope_lengths']
+    iedb_executable = params['iedb_executable']
+    netmhc_stab = params['netmhc_stab']
+
+    if len(prediction_algorithms) > 0 and len(alleles) > 0:
+        print("Executing MHC Class {} predictions".format(mhc_class))
+
+        output_dir = os.path.join(base_output_dir, 'MHC_Class_{}'.format(mhc_class))
+        os.makedirs(output_dir, exist_ok=True)
+
+        output_files = []
+        run_arguments = shared_arguments.copy()
+        run_arguments['alleles']               = alleles
+        run_arguments['iedb_executable']       = iedb_executable
+        run_arguments['prediction_algorithms'] = prediction_algorithms
+        run_arguments['netmhc_stab']           = netmhc_stab
+        run_arguments['n_threads']             = params['n_threads']
+
+        for epitope_length in epitope_lengths:
+            (input_file, per_epitope_output_dir) = generate_fasta(args, output_dir, epitope_length)
+            if os.path.getsize(input_file) == 0:
+                print("The intermediate FASTA file for epitope length {} is empty. No processable fusions found.")
+                continue
+
+            run_arguments['input_file']              = input_file
+            run_arguments['epitope_lengths']         = [epitope_length]
+            run_arguments['output_dir']              = per_epitope_output_dir
+            pipeline = PvacbindPipeline(**run_arguments)
+            pipeline.execute()
+            intermediate_output_file = os.path.join(per_epitope_output_dir, "{}.all_epitopes.tsv".format(args.sample_name))
+            if os.path.exists(intermediate_output_file):
+                output_file = os.path.join(per_epitope_output_dir, "{}.all_epitopes.final.tsv".format(args.sample_name))
+                append_columns(intermediate_output_file, "{}.tsv".format(input_file), output_file)
+                output_files.append(output_file)
+        if len(output_files) > 0:
+            # copy fasta to output dir
+            (input_file, per_epitope_output_dir) = generate_fasta(args, output_dir, max(epitope_lengths))
+            fasta_file = os.path.join(output_dir, "{}.fasta".format(args.sample_name))
+            shutil.copy(input_file, fasta_file)
+            run_arguments['fasta'] = fasta_file
+            # generate and copy net_chop fasta to output dir if specified
+            if args.net_chop_method:
+                epitope_flank_length = 9
+                (net_chop_fasta, _) = generate_fasta(args, output_dir, max(epitope_lengths), epitope_flank_length, net_chop_fasta=True)
+                run_arguments['net_chop_fasta'] = net_chop_fasta
+            all_epitopes_file = os.path.join(output_dir, "{}.all_epitopes.tsv".format(args.sample_name))
+            filtered_file = os.path.join(output_dir, "{}.filtered.tsv".format(args.sample_name))
+            #!!! make below call to create_net_class_report
+            #create_combined_reports(output_files, all_epitopes_file, filtered_file, True, args)
+            create_net_class_report(output_files, all_epitopes_file, filtered_file, args, run_arguments)
+        else:
+            print("\nNo processable fusions found. Aborting.\n")
+    elif len(prediction_algorithms) == 0:
+        print("No MHC class {} prediction algorithms chosen. Skipping MHC class {} predictions.".format(mhc_class, mhc_class))
+    elif len(alleles) == 0:
+        print("No MHC class {} alleles chosen. Skipping MHC class {} predictions.".format(mhc_class, mhc_class))
+
 def main(args_input = sys.argv[1:]):
     parser = define_parser()
     args = parser.parse_args(args_input)
@@ -129,6 +190,7 @@ def main(args_input = sys.argv[1:]):
         raise Exception("Multithreading is not supported on MacOS")
 
     base_output_dir = os.path.abspath(args.output_dir)
+    iedb_state_dir = os.path.join(base_output_dir, 'tmp')
 
     (class_i_prediction_algorithms, class_ii_prediction_algorithms) = pvactools.lib.run_utils.split_algorithms(args.prediction_algorithms)
     alleles = pvactools.lib.run_utils.combine_class_ii_alleles(args.allele)
@@ -146,9 +208,17 @@ def main(args_input = sys.argv[1:]):
         'additional_report_columns' : args.additional_report_columns,
         'fasta_size'                : args.fasta_size,
         'iedb_retries'              : args.iedb_retries,
+        'iedb_requests_per_second'  : args.iedb_requests_per_second,
+        'iedb_max_concurrent_requests': args.iedb_max_concurrent_requests,
+        'iedb_state_dir'            : iedb_state_dir,
         'downstream_sequence_length': downstream_sequence_length,
         'keep_tmp_files'            : args.keep_tmp_files,
+        'incremental'               : args.incremental,
         'n_threads'                 : args.n_threads,
+        'prediction_cache'          : args.prediction_cache,
+        'batch_alleles'             : args.batch_alleles,
+        'in_process_predictions'    : args.in_process_predictions,
+        'prediction_cost_model'     : args.prediction_cost_model,
         'species'                   : species,
         'run_reference_proteome_similarity': args.run_reference_proteome_similarity,
         'blastp_path'               : args.blastp_path,
@@ -180,75 +250,29 @@ def main(args_input = sys.argv[1:]):
             'prediction_algorithms': class_i_prediction_algorithms,
             'alleles': class_i_alleles,
             'epitope_lengths': args.class_i_epitope_length,
-            'netmhc_stab': args.netmhc_stab
+            'netmhc_stab': args.netmhc_stab,
+            'n_threads': args.n_threads,
         },
         'II': {
             'iedb_executable': iedb_mhc_ii_executable,
             'prediction_algorithms': class_ii_prediction_algorithms,
             'alleles': class_ii_alleles,
             'epitope_lengths': args.class_ii_epitope_length,
-            'netmhc_stab': False
+            'netmhc_stab': False,
+            'n_threads': args.n_threads,
         }
     }
 
-    for (mhc_class, params) in all_params.items():
-        prediction_algorithms = params['prediction_algorithms']
-        alleles = params['alleles']
-        epitope_lengths = params['epitope_lengths']
-        iedb_executable = params['iedb_executable']
-        netmhc_stab = params['netmhc_stab']
-
-        if len(prediction_algorithms) > 0 and len(alleles) > 0:
-            print("Executing MHC Class {} predictions".format(mhc_class))
-
-            output_dir = os.path.join(base_output_dir, 'MHC_Class_{}'.format(mhc_class))
-            os.makedirs(output_dir, exist_ok=True)
-
-            output_files = []
-            run_arguments = shared_arguments.copy()
-            run_arguments['alleles']               = alleles
-            run_arguments['iedb_executable']       = iedb_executable
-            run_arguments['prediction_algorithms'] = prediction_algorithms
-            run_arguments['netmhc_stab']           = netmhc_stab
-
-            for epitope_length in epitope_lengths:
-                (input_file, per_epitope_output_dir) = generate_fasta(args, output_dir, epitope_length)
-                if os.path.getsize(input_file) == 0:
-                    print("The intermediate FASTA file for epitope length {} is empty. No processable fusions found.")
-                    continue
-
-                run_arguments['input_file']              = input_file
-                run_arguments['epitope_lengths']         = [epitope_length]
-                run_arguments['output_dir']              = per_epitope_output_dir
-                pipeline = PvacbindPipeline(**run_arguments)
-                pipeline.execute()
-                intermediate_output_file = os.path.join(per_epitope_output_dir, "{}.all_epitopes.tsv".format(args.sample_name))
-                if os.path.exists(intermediate_output_file):
-                    output_file = os.path.join(per_epitope_output_dir, "{}.all_epitopes.final.tsv".format(args.sample_name))
-                    append_columns(intermediate_output_file, "{}.tsv".format(input_file), output_file)
-                    output_files.append(output_file)
-            if len(output_files) > 0:
-                # copy fasta to output dir
-                (input_file, per_epitope_output_dir) = generate_fasta(args, output_dir, max(epitope_lengths))
-                fasta_file = os.path.join(output_dir, "{}.fasta".format(args.sample_name))
-                shutil.copy(input_file, fasta_file)
-                run_arguments['fasta'] = fasta_file
-                # generate and copy net_chop fasta to output dir if specified
-                if args.net_chop_method:
-                    epitope_flank_length = 9
-                    (net_chop_fasta, _) = generate_fasta(args, output_dir, max(epitope_lengths), epitope_flank_length, net_chop_fasta=True)
-                    run_arguments['net_chop_fasta'] = net_chop_fasta
-                all_epitopes_file = os.path.join(output_dir, "{}.all_epitopes.tsv".format(args.sample_name))
-                filtered_file = os.path.join(output_dir, "{}.filtered.tsv".format(args.sample_name))
-                #!!! make below call to create_net_class_report
-                #create_combined_reports(output_files, all_epitopes_file, filtered_file, True, args)
-                create_net_class_report(output_files, all_epitopes_file, filtered_file, args, run_arguments)
-            else:
-                print("\nNo processable fusions found. Aborting.\n")
-        elif len(prediction_algorithms) == 0:
-            print("No MHC class {} prediction algorithms chosen. Skipping MHC class {} predictions.".format(mhc_class, mhc_class))
-        elif len(alleles) == 0:
-            print("No MHC class {} alleles chosen. Skipping MHC class {} predictions.".format(mhc_class, mhc_class))
+    mhc_classes = [mhc_class for (mhc_class, params) in all_params.items() if len(params['prediction_algorithms']) > 0 and len(params['alleles']) > 0]
+    if args.run_class_i_and_ii_concurrently and len(mhc_classes) > 1:
+        for (mhc_class, n_threads) in zip(mhc_classes, pvactools.lib.run_utils.split_threads(args.n_threads, len(mhc_classes))):
+            all_params[mhc_class]['n_threads'] = n_threads
+        pvactools.lib.run_utils.run_concurrently([
+            (run_mhc_class, [mhc_class, all_params[mhc_class], shared_arguments, base_output_dir, args]) for mhc_class in mhc_classes
+        ])
+    else:
+        for (mhc_class, params) in all_params.items():
+            run_mhc_class(mhc_class, params, shared_arguments, base_output_dir, args)
 
     if len(class_i_prediction_algorithms) > 0 and len(class_i_alleles) > 0 and len(class_ii_prediction_algorithms) > 0 and len(class_ii_alleles) > 0:
         print("Creating combined reports")
@@ -260,6 +284,9 @@ def main(args_input = sys.argv[1:]):
         filtered_report_file = os.path.join(output_dir, "{}.filtered.tsv".format(args.sample_name))
         create_combined_reports([file1, file2], combined_output_file, filtered_report_file, False, args)
 
+    if not args.keep_tmp_files:
+        shutil.rmtree(iedb_state_dir, ignore_errors=True)
+
     pvactools.lib.run_utils.change_permissions_recursive(base_output_dir, 0o755, 0o644)
 
 if __name__ == '__main__':
@@ -98,6 +98,11 @@ def define_parser():
              + " As a result, a higher threshold leads to the inclusion of more positions to be considered anchors.",
         default=0.8
     )
+    parser.add_argument(
+        "-t", "--n-threads", type=int,
+        help="Number of worker processes to use for aggregating variants.",
+        default=1
+    )
 
     return parser
 
@@ -129,6 +134,7 @@ def main(args_input = sys.argv[1:]):
         allele_specific_anchors=args.allele_specific_anchors,
         anchor_contribution_threshold=args.anchor_contribution_threshold,
         aggregate_inclusion_binding_threshold=args.aggregate_inclusion_binding_threshold,
+        n_threads=args.n_threads,
     ).execute()
     print("Completed")
 
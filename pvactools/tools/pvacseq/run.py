@@ -9,6 +9,7 @@ from pvactools.lib.prediction_class import *
 from pvactools.lib.pipeline import Pipeline
 from pvactools.lib.run_argument_parser import PvacseqRunArgumentParser
 from pvactools.lib.post_processor import PostProcessor
+from pvactools.lib.input_file_converter import VcfConverter
 import pvactools.lib.run_utils
 
 def define_parser():
@@ -44,6 +45,38 @@ def create_combined_reports(base_output_dir, args):
 
     PostProcessor(**post_processing_params).execute()
 
+def convert_vcf(args, output_dir, pipelines):
+    #Convert the VCF once for all MHC classes. Proximal variants are collected
+    #for the longest flanking sequence needed by any of the pipelines.
+    tsv_file = os.path.join(output_dir, "{}.tsv".format(args.sample_name))
+    proximal_variants_tsv = os.path.join(output_dir, "{}.proximal_variants.tsv".format(args.sample_name))
+    print("Converting .vcf to TSV")
+    if os.path.exists(tsv_file):
+        print("TSV file already exists. Skipping.")
+        return
+
+    os.makedirs(output_dir, exist_ok=True)
+    convert_params = {
+        'input_file' : args.input_file,
+        'output_file': "{}.tmp".format(tsv_file),
+        'sample_name': args.sample_name,
+        'pass_only': args.pass_only,
+    }
+    if args.normal_sample_name is not None:
+        convert_params['normal_sample_name'] = args.normal_sample_name
+    if args.phased_proximal_variants_vcf is not None:
+        epitope_flank_length = 9 if args.net_chop_method else 0
+        convert_params['proximal_variants_vcf'] = args.phased_proximal_variants_vcf
+        convert_params['proximal_variants_tsv'] = "{}.tmp".format(proximal_variants_tsv)
+        convert_params['flanking_bases'] = (max([max(pipeline.epitope_lengths) for pipeline in pipelines]) + epitope_flank_length) * 4
+
+    VcfConverter(**convert_params).execute()
+    if args.phased_proximal_variants_vcf is not None:
+        os.replace("{}.tmp".format(proximal_variants_tsv), proximal_variants_tsv)
+    #The TSV is moved into place last so that an interrupted conversion is redone on restart
+    os.replace("{}.tmp".format(tsv_file), tsv_file)
+    print("Completed")
+
 def main(args_input = sys.argv[1:]):
     parser = define_parser()
     args = parser.parse_args(args_input)
@@ -51,6 +84,12 @@ def main(args_input = sys.argv[1:]):
     if args.fasta_size%2 != 0:
         sys.exit("The fasta size needs to be an even number")
 
+    if args.split_tsv_by == 'bytes' and args.tsv_chunk_size is None:
+        sys.exit("The TSV chunk size needs to be set when splitting the TSV by bytes")
+
+    if args.tsv_chunk_size is not None and args.tsv_chunk_size < 1:
+        sys.exit("The TSV chunk size needs to be a positive integer")
+
     if args.iedb_retries > 100:
         sys.exit("The number of IEDB retries must be less than or equal to 100")
 
@@ -72,6 +111,8 @@ def main(args_input = sys.argv[1:]):
 
     input_file_type = 'vcf'
     base_output_dir = os.path.abspath(args.output_dir)
+    converted_vcf_dir = os.path.join(base_output_dir, 'tmp')
+    iedb_state_dir = os.path.join(base_output_dir, 'tmp')
 
     (class_i_prediction_algorithms, class_ii_prediction_algorithms) = pvactools.lib.run_utils.split_algorithms(args.prediction_algorithms)
     alleles = pvactools.lib.run_utils.combine_class_ii_alleles(args.allele)
@@ -98,12 +139,20 @@ def main(args_input = sys.argv[1:]):
         'additional_report_columns' : args.additional_report_columns,
         'fasta_size'                : args.fasta_size,
         'iedb_retries'              : args.iedb_retries,
+        'iedb_requests_per_second'  : args.iedb_requests_per_second,
+        'iedb_max_concurrent_requests': args.iedb_max_concurrent_requests,
         'downstream_sequence_length': downstream_sequence_length,
         'keep_tmp_files'            : args.keep_tmp_files,
+        'incremental'               : args.incremental,
+        'intermediate_format'       : args.intermediate_format,
         'pass_only'                 : args.pass_only,
         'normal_sample_name'        : args.normal_sample_name,
         'phased_proximal_variants_vcf' : args.phased_proximal_variants_vcf,
         'n_threads'                 : args.n_threads,
+        'prediction_cache'          : args.prediction_cache,
+        'batch_alleles'             : args.batch_alleles,
+        'in_process_predictions'    : args.in_process_predictions,
+        'prediction_cost_model'     : args.prediction_cost_model,
         'maximum_transcript_support_level': args.maximum_transcript_support_level,
         'species'                   : species,
         'run_reference_proteome_similarity': args.run_reference_proteome_similarity,
@@ -116,8 +165,13 @@ def main(args_input = sys.argv[1:]):
         'allele_specific_anchors'   : args.allele_specific_anchors,
         'anchor_contribution_threshold' : args.anchor_contribution_threshold,
         'aggregate_inclusion_binding_threshold': args.aggregate_inclusion_binding_threshold,
+        'split_tsv_by'              : args.split_tsv_by,
+        'tsv_chunk_size'            : args.tsv_chunk_size,
+        'converted_vcf_dir'         : converted_vcf_dir,
+        'iedb_state_dir'            : iedb_state_dir,
     }
 
+    pipelines = []
     if len(class_i_prediction_algorithms) > 0 and len(class_i_alleles) > 0:
         if args.iedb_install_directory:
             iedb_mhc_i_executable = os.path.join(args.iedb_install_directory, 'mhc_i', 'src', 'predict_binding.py')
@@ -138,8 +192,7 @@ def main(args_input = sys.argv[1:]):
         class_i_arguments['prediction_algorithms']   = class_i_prediction_algorithms
         class_i_arguments['output_dir']              = output_dir
         class_i_arguments['netmhc_stab']             = args.netmhc_stab
-        pipeline = Pipeline(**class_i_arguments)
-        pipeline.execute()
+        pipelines.append(Pipeline(**class_i_arguments))
     elif len(class_i_prediction_algorithms) == 0:
         print("No MHC class I prediction algorithms chosen. Skipping MHC class I predictions.")
     elif len(class_i_alleles) == 0:
@@ -165,17 +218,23 @@ def main(args_input = sys.argv[1:]):
         class_ii_arguments['epitope_lengths']         = args.class_ii_epitope_length
         class_ii_arguments['output_dir']              = output_dir
         class_ii_arguments['netmhc_stab']             = False
-        pipeline = Pipeline(**class_ii_arguments)
-        pipeline.execute()
+        pipelines.append(Pipeline(**class_ii_arguments))
     elif len(class_ii_prediction_algorithms) == 0:
         print("No MHC class II prediction algorithms chosen. Skipping MHC class II predictions.")
     elif len(class_ii_alleles) == 0:
         print("No MHC class II alleles chosen. Skipping MHC class II predictions.")
 
+    if any(pipeline.needs_converted_vcf() for pipeline in pipelines):
+        convert_vcf(args, converted_vcf_dir, pipelines)
+    pvactools.lib.run_utils.execute_pipelines(pipelines, args.n_threads, args.run_class_i_and_ii_concurrently)
+
     if len(class_i_prediction_algorithms) > 0 and len(class_i_alleles) > 0 and len(class_ii_prediction_algorithms) > 0 and len(class_ii_alleles) > 0:
         print("Creating combined reports")
         create_combined_reports(base_output_dir, args)
 
+    if not args.keep_tmp_files:
+        shutil.rmtree(converted_vcf_dir, ignore_errors=True)
+
     pvactools.lib.run_utils.change_permissions_recursive(base_output_dir, 0o755, 0o644)
 
 if __name__ == '__main__':
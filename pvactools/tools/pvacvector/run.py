@@ -27,19 +27,34 @@ import pvactools.lib.run_utils
 def define_parser():
     return PvacvectorRunArgumentParser().parser
 
+def predict_and_parse(pipeline_arguments):
+    pipeline = Pipeline(**pipeline_arguments)
+    pipeline.generate_fasta([[1, 1]])
+    pipeline.call_iedb([[1, 1]])
+    return pipeline.parse_outputs([[1, 1]])
+
 def run_pipelines(input_file, base_output_dir, args, spacer, class_i_prediction_algorithms, class_ii_prediction_algorithms, class_i_alleles, class_ii_alleles):
+    #The IEDB rate limit and concurrency state is shared by the class I and class II pipelines
+    iedb_state_dir = os.path.join(base_output_dir, 'tmp')
     shared_arguments = {
         'input_file'      : input_file,
         'input_file_type' : 'pvacvector_input_fasta',
         'sample_name'     : args.sample_name,
         'n_threads'       : args.n_threads,
+        'prediction_cache': args.prediction_cache,
+        'batch_alleles': args.batch_alleles,
+        'in_process_predictions': args.in_process_predictions,
+        'prediction_cost_model': args.prediction_cost_model,
         'spacers'         : [spacer],
         'downstream_sequence_length': 200,
         'iedb_retries'    : args.iedb_retries,
+        'iedb_requests_per_second': args.iedb_requests_per_second,
+        'iedb_max_concurrent_requests': args.iedb_max_concurrent_requests,
+        'iedb_state_dir'  : iedb_state_dir,
         'additional_report_columns' : None,
     }
 
-    parsed_output_files = []
+    pipeline_arguments = []
     if len(class_i_prediction_algorithms) > 0 and len(class_i_alleles) > 0:
         if args.iedb_install_directory:
             iedb_mhc_i_executable = os.path.join(args.iedb_install_directory, 'mhc_i', 'src', 'predict_binding.py')
@@ -59,10 +74,7 @@ def run_pipelines(input_file, base_output_dir, args, spacer, class_i_prediction_
         class_i_arguments['epitope_lengths']         = args.class_i_epitope_length
         class_i_arguments['prediction_algorithms']   = class_i_prediction_algorithms
         class_i_arguments['output_dir']              = output_dir
-        pipeline_i = Pipeline(**class_i_arguments)
-        pipeline_i.generate_fasta([[1, 1]])
-        pipeline_i.call_iedb([[1, 1]])
-        parsed_output_files.extend(pipeline_i.parse_outputs([[1, 1]]))
+        pipeline_arguments.append(class_i_arguments)
 
     if len(class_ii_prediction_algorithms) > 0 and len(class_ii_alleles) > 0:
         if args.iedb_install_directory:
@@ -84,11 +96,21 @@ def run_pipelines(input_file, base_output_dir, args, spacer, class_i_prediction_
         class_ii_arguments['epitope_lengths']         = args.class_ii_epitope_length
         class_ii_arguments['output_dir']              = output_dir
         class_ii_arguments['netmhc_stab']             = False
-        pipeline_ii = Pipeline(**class_ii_arguments)
-        pipeline_ii.generate_fasta([[1, 1]])
-        pipeline_ii.call_iedb([[1, 1]])
-        parsed_output_files.extend(pipeline_ii.parse_outputs([[1, 1]]))
+        pipeline_arguments.append(class_ii_arguments)
+
+    if args.run_class_i_and_ii_concurrently and len(pipeline_arguments) > 1:
+        for (arguments, n_threads) in zip(pipeline_arguments, pvactools.lib.run_utils.split_threads(args.n_threads, len(pipeline_arguments))):
+            arguments['n_threads'] = n_threads
+        results = pvactools.lib.run_utils.run_concurrently([(predict_and_parse, [arguments]) for arguments in pipeline_arguments])
+    else:
+        results = [predict_and_parse(arguments) for arguments in pipeline_arguments]
+
+    if not args.keep_tmp_files:
+        shutil.rmtree(iedb_state_dir, ignore_errors=True)
 
+    parsed_output_files = []
+    for result in results:
+        parsed_output_files.extend(result)
     return parsed_output_files
 
 def write_min_scores(min_scores_rows, directory, args):
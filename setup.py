@@ -90,6 +90,7 @@ setup(
         'mhcflurry==2.0.6',
         'testfixtures',
         'polars==0.16.18',
+        'importlib_metadata; python_version < "3.8"',
     ],
     package_data={
         'pvactools.tools.pvacseq': pvacseq_data_files,
@@ -46,6 +46,20 @@ class AggregateAllEptiopesTests(unittest.TestCase):
             self.assertTrue(os.path.isfile(pvacview_file))
             os.remove(pvacview_file)
 
+    def test_aggregate_all_epitopes_pvacseq_multiple_threads_produces_expected_output(self):
+        output_dir = tempfile.TemporaryDirectory()
+        output_file = os.path.join(output_dir.name, 'output.tsv')
+        self.assertFalse(PvacseqAggregateAllEpitopes(os.path.join(self.test_data_dir, 'Test.all_epitopes.tsv'), output_file, n_threads=2).execute())
+        self.assertTrue(cmp(
+            output_file,
+            os.path.join(self.test_data_dir, "output.tsv"),
+        ))
+        self.assertTrue(cmp(
+            output_file.replace('.tsv', '.metrics.json'),
+            os.path.join(self.test_data_dir, "output.metrics.json"),
+        ))
+        output_dir.cleanup()
+
     def test_aggregate_all_epitopes_HCC1395_pvacseq_runs_and_produces_expected_output(self):
         self.assertTrue(py_compile.compile(self.executable))
         output_file = tempfile.NamedTemporaryFile(suffix='.tsv')
@@ -212,3 +226,39 @@ class AggregateAllEptiopesTests(unittest.TestCase):
             output_file.name,
             os.path.join(self.test_data_dir, "output.pvacbind.lowest_top_score_metric.tsv"),
         ))
+
+    def row_by_row_good_binders(self, aggregator, df, ic50_column):
+        if not aggregator.use_allele_specific_binding_thresholds:
+            return df[df[ic50_column] < aggregator.aggregate_inclusion_binding_threshold]
+        selection = []
+        for index, row in df.iterrows():
+            if row['HLA Allele'] in aggregator.allele_specific_binding_thresholds:
+                binding_threshold = aggregator.allele_specific_binding_thresholds[row['HLA Allele']]
+            else:
+                binding_threshold = aggregator.binding_threshold
+            if row[ic50_column] < binding_threshold:
+                selection.append(index)
+        return df[df.index.isin(selection)]
+
+    def test_get_good_binders_matches_row_by_row_selection(self):
+        output_file = tempfile.NamedTemporaryFile(suffix='.tsv')
+        for (aggregate_class, input_file, ic50_column) in [
+            (PvacseqAggregateAllEpitopes, 'Test.all_epitopes.tsv', 'Median MT IC50 Score'),
+            (PvacbindAggregateAllEpitopes, 'Test.all_epitopes.pvacbind.tsv', 'Median IC50 Score'),
+        ]:
+            for allele_specific_binding_thresholds in [False, True]:
+                aggregator = aggregate_class(
+                    os.path.join(self.test_data_dir, input_file),
+                    output_file.name,
+                    binding_threshold=100,
+                    allele_specific_binding_thresholds=allele_specific_binding_thresholds,
+                )
+                prediction_algorithms = aggregator.determine_used_prediction_algorithms()
+                el_algorithms = aggregator.determine_used_el_algorithms()
+                df = aggregator.read_input_file(aggregator.determine_columns_used_for_aggregation(prediction_algorithms, el_algorithms), aggregator.set_column_types(prediction_algorithms))
+                keys = aggregator.get_list_unique_mutation_keys(df)
+                for (sub_df, key) in aggregator.get_sub_dfs(df, keys, aggregator.get_rows_for_key(df)):
+                    self.assertEqual(
+                        aggregator.get_good_binders(sub_df).index.tolist(),
+                        self.row_by_row_good_binders(aggregator, sub_df, ic50_column).index.tolist(),
+                    )
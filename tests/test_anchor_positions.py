@@ -0,0 +1,48 @@
+import unittest
+import itertools
+import numpy as np
+
+from pvactools.lib.anchor_positions import AnchorPositions
+from pvactools.lib.run_utils import get_anchor_positions
+
+class AnchorPositionsTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.alleles = ['HLA-A*01:01', 'HLA-B*08:01', 'HLA-C*07:01', 'H-2-Db', 'H-2-Kb', 'DLA-88*01:01']
+        cls.lengths = [8, 9, 10, 11, 15]
+        cls.positions = [np.nan, 'NA', '1', '2', '5', '9', '1-2', '2-3', '8-9', '10-11', '3-2']
+
+    def anchor_residue_pass(self, anchor_positions, hla_allele, epitope_length, position, wt_ic50, binding_threshold):
+        #Reference implementation that derives the anchor positions from scratch for every peptide
+        anchors = get_anchor_positions(hla_allele, epitope_length, anchor_positions.allele_specific_anchors, anchor_positions.anchor_probabilities, anchor_positions.anchor_contribution_threshold, anchor_positions.mouse_anchor_positions)
+        if not isinstance(position, str) or position == 'NA':
+            return True
+        elif '-' in position:
+            d_ind = position.index('-')
+            mutated_positions = range(int(position[0:d_ind]), int(position[d_ind+1:])+1)
+        else:
+            mutated_positions = [int(position)]
+        if all(pos in anchors for pos in mutated_positions):
+            if np.isnan(wt_ic50) or wt_ic50 < binding_threshold:
+                return False
+        return True
+
+    def test_anchor_residue_passes_matches_reference(self):
+        for allele_specific_anchors in [False, True]:
+            anchor_positions = AnchorPositions(allele_specific_anchors, 0.8)
+            combinations = list(itertools.product(self.alleles, self.lengths, self.positions, [np.nan, 100.0, 1000.0]))
+            (alleles, lengths, positions, wt_ic50s) = zip(*combinations)
+            passes = anchor_positions.anchor_residue_passes(alleles, lengths, positions, wt_ic50s, [500] * len(combinations))
+            for (combination, anchor_residue_pass) in zip(combinations, passes):
+                expected = self.anchor_residue_pass(anchor_positions, *combination, 500)
+                self.assertEqual(anchor_residue_pass, expected, combination)
+                self.assertEqual(anchor_positions.anchor_residue_pass(*combination, 500), expected, combination)
+
+    def test_positions_beyond_int64(self):
+        anchor_positions = AnchorPositions()
+        passes = anchor_positions.anchor_residue_passes(['HLA-A*01:01'] * 3, [70, 70, 9], ['69-70', '68', '1'], [100.0, 100.0, 100.0], [500] * 3)
+        self.assertEqual(list(passes), [False, True, False])
+
+    def test_no_peptides(self):
+        anchor_positions = AnchorPositions()
+        self.assertEqual(len(anchor_positions.anchor_residue_passes([], [], [], [], [])), 0)
@@ -8,10 +8,12 @@ from subprocess import call
 from filecmp import cmp
 import py_compile
 import pandas as pd
+from Bio import SeqIO
 from mock import patch
 
 import pvactools.lib.call_iedb
-from pvactools.lib.prediction_class import PredictionClass, IEDB
+from pvactools.lib.prediction_class import PredictionClass, IEDB, BigMHC_EL
+from pvactools.lib.prediction_cache import PredictionCache
 
 from tests.utils import *
 
@@ -57,7 +59,7 @@ class CallIEDBClassITests(CallIEDBTests):
         cls.methods = ['ann', 'smmpmbec', 'smm']
 
     def test_iedb_methods_generate_expected_files(self):
-        with patch('requests.post', unittest.mock.Mock(side_effect = lambda url, data, files=None: make_response(
+        with patch('requests.Session.post', unittest.mock.Mock(side_effect = lambda url, data, files=None: make_response(
             data,
             files,
             test_data_directory()
@@ -82,6 +84,38 @@ class CallIEDBClassITests(CallIEDBTests):
                 expected_output_file = os.path.join(self.test_data_dir, 'output_%s.tsv' % method)
                 self.assertTrue(cmp(call_iedb_output_file.name, expected_output_file))
 
+    def test_iedb_method_uses_state_dir(self):
+        state_dir = tempfile.TemporaryDirectory()
+        with patch('requests.Session.post', unittest.mock.Mock(side_effect = lambda url, data, files=None: make_response(
+            data,
+            files,
+            test_data_directory()
+        ))):
+            call_iedb_output_file = tempfile.NamedTemporaryFile()
+            pvactools.lib.call_iedb.main([
+                self.input_file,
+                call_iedb_output_file.name,
+                'SMM',
+                self.allele,
+                '-l', str(self.epitope_length),
+                '--iedb-requests-per-second', '10',
+                '--iedb-state-dir', state_dir.name,
+            ])
+        self.assertTrue(os.path.exists(os.path.join(state_dir.name, 'iedb_client.state')))
+
+    def test_iedb_request_limits_require_state_dir(self):
+        call_iedb_output_file = tempfile.NamedTemporaryFile()
+        with self.assertRaises(SystemExit) as cm:
+            pvactools.lib.call_iedb.main([
+                self.input_file,
+                call_iedb_output_file.name,
+                'SMM',
+                self.allele,
+                '-l', str(self.epitope_length),
+                '--iedb-max-concurrent-requests', '2',
+            ])
+        self.assertEqual(str(cm.exception), "--iedb-state-dir or --tmp-dir is required to limit the IEDB requests")
+
     #the output from MHCflurry varies between operating systems and the version of tensorflow installed
     #these outputs where created on tensorflow 2.2.2
     def test_mhcflurry_method_generates_expected_files(self):
@@ -165,6 +199,191 @@ class CallIEDBClassITests(CallIEDBTests):
         actual_df = pd.read_csv(call_iedb_output_file.name, sep="\t", index_col=[0,3,4])
         pd.testing.assert_frame_equal(expected_df, actual_df, check_like=True, check_exact=False)
 
+    def test_mhcnuggetsi_method_with_prediction_cache_generates_expected_files(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        prediction_cache = os.path.join(cache_dir.name, 'predictions.sqlite')
+        arguments = [
+            self.input_file,
+            None,
+            'MHCnuggetsI',
+            self.allele,
+            '-l', str(self.epitope_length),
+        ]
+
+        uncached_output_file = tempfile.NamedTemporaryFile()
+        arguments[1] = uncached_output_file.name
+        pvactools.lib.call_iedb.main(arguments)
+        expected_df = pd.read_csv(uncached_output_file.name, sep="\t", index_col=[0,3,4])
+
+        cached_output_file = tempfile.NamedTemporaryFile()
+        arguments[1] = cached_output_file.name
+        predicted_peptides = pvactools.lib.call_iedb.main(arguments + ['--prediction-cache', prediction_cache])
+        self.assertEqual(predicted_peptides, len(set(peptide for (seq_num, start, peptide) in pvactools.lib.prediction_cache.kmer_positions(self.input_file, self.epitope_length))))
+        actual_df = pd.read_csv(cached_output_file.name, sep="\t", index_col=[0,3,4])
+        pd.testing.assert_frame_equal(expected_df, actual_df, check_exact=False)
+
+        #All peptides are cached now so the predictor should not be called again
+        with patch('pvactools.lib.prediction_class.MHCnuggets.predict', unittest.mock.Mock(side_effect=Exception("Predictor called"))):
+            predicted_peptides = pvactools.lib.call_iedb.main(arguments + ['--prediction-cache', prediction_cache])
+        self.assertEqual(predicted_peptides, 0)
+        actual_df = pd.read_csv(cached_output_file.name, sep="\t", index_col=[0,3,4])
+        pd.testing.assert_frame_equal(expected_df, actual_df, check_exact=False)
+        cache_dir.cleanup()
+
+    def test_peptides_without_predictions_are_cached(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        prediction_cache = os.path.join(cache_dir.name, 'predictions.sqlite')
+        def predict(input_file, allele, epitope_length, *args, **kwargs):
+            #Only the first peptide gets a prediction
+            peptide = str(next(SeqIO.parse(input_file, "fasta")).seq)[0:epitope_length]
+            return (pd.DataFrame({'allele': [allele], 'peptide': [peptide], 'ic50': [100.0], 'seq_num': ['1'], 'start': [1]}), 'pandas')
+        arguments = [
+            self.input_file,
+            tempfile.NamedTemporaryFile().name,
+            'MHCflurry',
+            self.allele,
+            '-l', str(self.epitope_length),
+            '--prediction-cache', prediction_cache,
+        ]
+        with patch('pvactools.lib.prediction_class.MHCflurry.predict', unittest.mock.Mock(side_effect=predict)):
+            self.assertGreater(pvactools.lib.call_iedb.main(arguments), 1)
+        with patch('pvactools.lib.prediction_class.MHCflurry.predict', unittest.mock.Mock(side_effect=Exception("Predictor called"))):
+            self.assertEqual(pvactools.lib.call_iedb.main(arguments), 0)
+        cache_dir.cleanup()
+
+    def test_predictor_version_of_missing_distribution(self):
+        self.assertEqual(PredictionCache.distribution_version('not-an-installed-distribution'), 'unknown')
+        version = PredictionCache.predictor_version('BigMHC_EL', BigMHC_EL(), None)
+        self.assertEqual(version.split('|')[1], PredictionCache.distribution_version('bigmhc'))
+
+    def test_mhcnuggetsi_method_in_process_generates_expected_files(self):
+        arguments = [
+            self.input_file,
+            None,
+            'MHCnuggetsI',
+            self.allele,
+            '-l', str(self.epitope_length),
+        ]
+
+        subprocess_output_file = tempfile.NamedTemporaryFile()
+        arguments[1] = subprocess_output_file.name
+        pvactools.lib.call_iedb.main(arguments)
+        expected_df = pd.read_csv(subprocess_output_file.name, sep="\t", index_col=[0,3,4]).sort_index()
+
+        in_process_output_file = tempfile.NamedTemporaryFile()
+        arguments[1] = in_process_output_file.name
+        with patch('pvactools.lib.prediction_class.run', unittest.mock.Mock(side_effect=Exception("Subprocess launched"))):
+            pvactools.lib.call_iedb.main(arguments + ['--in-process'])
+        actual_df = pd.read_csv(in_process_output_file.name, sep="\t", index_col=[0,3,4]).sort_index()
+        pd.testing.assert_frame_equal(expected_df, actual_df, check_like=True, check_exact=False)
+
+    def test_mhcflurry_method_in_process_generates_expected_files(self):
+        arguments = [
+            self.input_file,
+            None,
+            'MHCflurry',
+            self.allele,
+            '-l', str(self.epitope_length),
+        ]
+
+        subprocess_output_file = tempfile.NamedTemporaryFile()
+        arguments[1] = subprocess_output_file.name
+        pvactools.lib.call_iedb.main(arguments)
+        expected_df = pd.read_csv(subprocess_output_file.name, sep="\t", index_col=[1,7,8]).sort_index()
+
+        in_process_output_file = tempfile.NamedTemporaryFile()
+        arguments[1] = in_process_output_file.name
+        with patch('pvactools.lib.prediction_class.run', unittest.mock.Mock(side_effect=Exception("Subprocess launched"))):
+            pvactools.lib.call_iedb.main(arguments + ['--in-process'])
+        actual_df = pd.read_csv(in_process_output_file.name, sep="\t", index_col=[1,7,8]).sort_index()
+        pd.testing.assert_frame_equal(expected_df, actual_df, check_like=True, check_exact=False)
+
+    def test_multiple_alleles_are_predicted_in_a_single_call(self):
+        alleles = ['HLA-A*02:01', 'HLA-B*35:01']
+        prediction_df = pd.DataFrame({
+            'allele': alleles,
+            'peptide': ['AAAAAAAAA', 'AAAAAAAAA'],
+            'ic50': [100.0, 200.0],
+            'seq_num': [1, 1],
+            'start': [1, 1],
+        })
+        output_files = [tempfile.NamedTemporaryFile(), tempfile.NamedTemporaryFile()]
+        with patch('pvactools.lib.prediction_class.MHCflurry.predict', unittest.mock.Mock(return_value=(prediction_df, 'pandas'))) as mock_predict:
+            pvactools.lib.call_iedb.main([
+                self.input_file,
+                ",".join([f.name for f in output_files]),
+                'MHCflurry',
+                ",".join(alleles),
+                '-l', str(self.epitope_length)
+            ])
+        self.assertEqual(mock_predict.call_count, 1)
+        self.assertEqual(mock_predict.call_args[0][1], alleles)
+        for (allele, output_file) in zip(alleles, output_files):
+            output_df = pd.read_csv(output_file.name, sep="\t")
+            self.assertEqual(list(output_df['allele']), [allele])
+
+    def test_mhcflurry_predicts_multiple_alleles_in_a_single_process(self):
+        alleles = ['HLA-A*02:01', 'HLA-B*35:01']
+        def mhcflurry_predict(arguments, **kwargs):
+            #Same output as mhcflurry-predict, which predicts all combinations of alleles and peptides
+            #and reports each allele as it was passed in
+            alleles = arguments[arguments.index('--alleles') + 1:arguments.index('--out')]
+            peptides = arguments[arguments.index('--peptides') + 1:]
+            pd.DataFrame([
+                {'allele': a, 'peptide': p, 'mhcflurry_affinity': 100.0, 'mhcflurry_affinity_percentile': 1.0}
+                for a in alleles for p in peptides
+            ]).to_csv(arguments[arguments.index('--out') + 1], index=False)
+        output_files = [tempfile.NamedTemporaryFile(), tempfile.NamedTemporaryFile()]
+        with patch('pvactools.lib.prediction_class.run', unittest.mock.Mock(side_effect=mhcflurry_predict)) as mock_run:
+            pvactools.lib.call_iedb.main([
+                self.input_file,
+                ",".join([f.name for f in output_files]),
+                'MHCflurry',
+                ",".join(alleles),
+                '-l', str(self.epitope_length)
+            ])
+        self.assertEqual(mock_run.call_count, 1)
+        arguments = mock_run.call_args[0][0]
+        self.assertEqual(arguments[arguments.index('--alleles') + 1:arguments.index('--out')], alleles)
+        peptides = len(arguments) - arguments.index('--peptides') - 1
+        for (allele, output_file) in zip(alleles, output_files):
+            output_df = pd.read_csv(output_file.name, sep="\t")
+            self.assertEqual(set(output_df['allele']), set([allele]))
+            self.assertEqual(output_df['peptide'].nunique(), peptides)
+
+    def test_predictions_for_unrequested_alleles_raise_exception(self):
+        prediction_df = pd.DataFrame({
+            'allele': ['HLA-A*02:01', 'HLA-A02:01'],
+            'peptide': ['AAAAAAAAA', 'AAAAAAAAA'],
+            'ic50': [100.0, 200.0],
+            'seq_num': [1, 1],
+            'start': [1, 1],
+        })
+        output_files = [tempfile.NamedTemporaryFile(), tempfile.NamedTemporaryFile()]
+        with patch('pvactools.lib.prediction_class.MHCflurry.predict', unittest.mock.Mock(return_value=(prediction_df, 'pandas'))):
+            with self.assertRaises(Exception) as cm:
+                pvactools.lib.call_iedb.main([
+                    self.input_file,
+                    ",".join([f.name for f in output_files]),
+                    'MHCflurry',
+                    'HLA-A*02:01,HLA-B*35:01',
+                    '-l', str(self.epitope_length)
+                ])
+        self.assertEqual(str(cm.exception), "Predictions for alleles HLA-A02:01 don't match the requested alleles HLA-A*02:01, HLA-B*35:01")
+
+    def test_bigmhc_alleles_are_predicted_separately(self):
+        alleles = ['HLA-A*02:01', 'HLA-B*35:01']
+        output_files = [tempfile.NamedTemporaryFile(), tempfile.NamedTemporaryFile()]
+        with patch('pvactools.lib.prediction_class.BigMHC_EL.predict', unittest.mock.Mock(return_value=(pd.DataFrame(), 'pandas'))) as mock_predict:
+            pvactools.lib.call_iedb.main([
+                self.input_file,
+                ",".join([f.name for f in output_files]),
+                'BigMHC_EL',
+                ",".join(alleles),
+                '-l', str(self.epitope_length)
+            ])
+        self.assertEqual([c[0][1] for c in mock_predict.call_args_list], alleles)
+
 class CallIEDBClassIITests(CallIEDBTests):
     @classmethod
     def additional_setup(cls):
@@ -173,7 +392,7 @@ class CallIEDBClassIITests(CallIEDBTests):
         cls.methods = ['nn_align']
 
     def test_iedb_methods_generate_expected_files(self):
-        with patch('requests.post', unittest.mock.Mock(side_effect = lambda url, data, files=None: make_response(
+        with patch('requests.Session.post', unittest.mock.Mock(side_effect = lambda url, data, files=None: make_response(
             data,
             files,
             test_data_directory()
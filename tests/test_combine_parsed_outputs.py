@@ -2,9 +2,13 @@ import unittest
 import sys
 import os
 import tempfile
+import csv
 import py_compile
 from subprocess import call
 
+import pvactools.lib.combine_parsed_outputs
+import pvactools.lib.sort
+
 from tests.utils import *
 
 class CombineParsedOutputsTests(unittest.TestCase):
@@ -31,3 +35,47 @@ class CombineParsedOutputsTests(unittest.TestCase):
 
         expected_output_file  = os.path.join(self.test_data_dir, "Test.combined.parsed.tsv")
         self.assertTrue(compare(combine_parsed_outputs_output_file.name, expected_output_file))
+
+    def read_rows(self, path):
+        with open(path, 'r') as fh:
+            return list(csv.DictReader(fh, delimiter='\t'))
+
+    def assert_sorted_merge_matches(self, input_files, sort, args):
+        combined_file = tempfile.NamedTemporaryFile()
+        pvactools.lib.combine_parsed_outputs.main([*input_files, combined_file.name, *args])
+        sorted_file = tempfile.NamedTemporaryFile()
+        pvactools.lib.combine_parsed_outputs.main([*input_files, sorted_file.name, *args, '--sort'])
+        self.assertEqual(self.read_rows(sorted_file.name), sort(self.read_rows(combined_file.name)))
+
+    def test_sorted_merge_matches_default_sort(self):
+        input_files = [
+            os.path.join(self.test_data_dir, 'Test.HLA-E*01:01.9.parsed.tsv'),
+            os.path.join(self.test_data_dir, 'Test.HLA-G*01:09.9.parsed.tsv'),
+        ]
+        for top_score_metric in ['median', 'lowest']:
+            self.assert_sorted_merge_matches(
+                input_files,
+                lambda rows: pvactools.lib.sort.default_sort(rows, top_score_metric),
+                ['--top-score-metric', top_score_metric],
+            )
+
+    def test_sorted_merge_matches_pvacbind_sort(self):
+        test_data_dir = os.path.join(pvactools_directory(), 'tests', 'test_data', 'pvacbind', 'MHC_Class_I', 'tmp')
+        input_files = [
+            os.path.join(test_data_dir, 'Test.HLA-E*01:01.9.parsed.tsv_1-48'),
+            os.path.join(test_data_dir, 'Test.HLA-G*01:09.9.parsed.tsv_1-48'),
+        ]
+        self.assert_sorted_merge_matches(
+            input_files,
+            lambda rows: pvactools.lib.sort.pvacbind_sort(rows, 'median'),
+            ['--file-type', 'pVACbind'],
+        )
+
+    def test_lines_that_need_quoting_are_parsed(self):
+        input_file = tempfile.NamedTemporaryFile('w', suffix='.tsv')
+        input_file.write('Mutation\tEpitope Seq\r\n1\tAAA\r\n2\t"A\tB"\r\n3\n\n4\tCCC\r\n')
+        input_file.flush()
+        output_file = tempfile.NamedTemporaryFile()
+        pvactools.lib.combine_parsed_outputs.main([input_file.name, output_file.name])
+        with open(output_file.name, 'r', newline='') as fh:
+            self.assertEqual(fh.read(), 'Mutation\tEpitope Seq\n1\tAAA\n2\t"A\tB"\n3\t\n4\tCCC\n')
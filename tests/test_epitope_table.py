@@ -0,0 +1,100 @@
+import unittest
+import os
+import csv
+import shutil
+import tempfile
+import pandas as pd
+from filecmp import cmp
+
+import pvactools.lib.epitope_table as epitope_table
+import pvactools.lib.combine_parsed_outputs
+from pvactools.lib.aggregate_all_epitopes import PvacseqAggregateAllEpitopes
+from tests.utils import *
+
+class EpitopeTableTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.test_data_dir = os.path.join(pvactools_directory(), "tests", "test_data")
+
+    def setUp(self):
+        self.output_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.output_dir.cleanup()
+
+    def split_into_parquet_files(self, tsv_file, count):
+        #Write the rows of a TSV to Parquet files and combine them again
+        with open(tsv_file, 'r') as fh:
+            reader = csv.DictReader(fh, delimiter='\t')
+            fieldnames = reader.fieldnames
+            rows = list(reader)
+        parquet_files = []
+        chunk_size = len(rows) // count + 1
+        for i in range(count):
+            parquet_file = os.path.join(self.output_dir.name, "parsed.parquet_{}".format(i))
+            writer = epitope_table.DictWriter(parquet_file, fieldnames, 'parquet')
+            writer.writeheader()
+            writer.writerows(rows[i * chunk_size:(i + 1) * chunk_size])
+            writer.close()
+            parquet_files.append(parquet_file)
+        combined_file = os.path.join(self.output_dir.name, os.path.basename(tsv_file))
+        pvactools.lib.combine_parsed_outputs.main([*parquet_files, combined_file])
+        return (combined_file, parquet_files)
+
+    def test_parquet_rows_match_tsv_rows(self):
+        rows = [
+            {'HLA Allele': 'HLA-A*02:01', 'Median IC50 Score': 12.5, 'Best Percentile': None},
+            {'HLA Allele': 'HLA-B*07:02', 'Median IC50 Score': 'NA'},
+        ]
+        for output_format in ['tsv', 'parquet']:
+            output_file = os.path.join(self.output_dir.name, "parsed.{}".format(output_format))
+            writer = epitope_table.DictWriter(output_file, ['HLA Allele', 'Median IC50 Score', 'Best Percentile'], output_format)
+            writer.writeheader()
+            writer.writerows(rows)
+            writer.close()
+            self.assertEqual(epitope_table.is_parquet(output_file), output_format == 'parquet')
+            self.assertEqual(epitope_table.fieldnames(output_file), ['HLA Allele', 'Median IC50 Score', 'Best Percentile'])
+            self.assertEqual([dict(row) for row in epitope_table.reader(output_file)], [
+                {'HLA Allele': 'HLA-A*02:01', 'Median IC50 Score': '12.5', 'Best Percentile': ''},
+                {'HLA Allele': 'HLA-B*07:02', 'Median IC50 Score': 'NA', 'Best Percentile': ''},
+            ])
+
+    def test_unknown_fieldname_raises_exception(self):
+        writer = epitope_table.DictWriter(os.path.join(self.output_dir.name, 'parsed.parquet'), ['HLA Allele'], 'parquet')
+        with self.assertRaises(ValueError):
+            writer.writerow({'HLA Allele': 'HLA-A*02:01', 'Epitope Seq': 'AAAAAAAAA'})
+
+    def test_combined_parquet_files_match_tsv(self):
+        tsv_file = os.path.join(self.test_data_dir, 'aggregate_all_epitopes', 'Test.all_epitopes.tsv')
+        (combined_file, parquet_files) = self.split_into_parquet_files(tsv_file, 3)
+        self.assertTrue(cmp(combined_file, tsv_file, shallow=False))
+        self.assertEqual(epitope_table.columnar_files(combined_file), parquet_files)
+
+    def test_read_csv_reads_columns_from_parquet_files(self):
+        tsv_file = os.path.join(self.test_data_dir, 'aggregate_all_epitopes', 'Test.all_epitopes.tsv')
+        (combined_file, parquet_files) = self.split_into_parquet_files(tsv_file, 3)
+        for (usecols, kwargs) in [
+            (['HLA Allele'], {}),
+            (['Tumor DNA VAF', 'Median MT IC50 Score', 'Mutation'], {'float_precision': 'high', 'na_values': 'NA', 'keep_default_na': False, 'dtype': {'Mutation': str}}),
+        ]:
+            pd.testing.assert_frame_equal(
+                epitope_table.read_csv(combined_file, usecols=usecols, **kwargs),
+                pd.read_csv(tsv_file, delimiter='\t', usecols=usecols, **kwargs),
+            )
+
+    def test_changed_tsv_is_read_directly(self):
+        tsv_file = os.path.join(self.test_data_dir, 'aggregate_all_epitopes', 'Test.all_epitopes.tsv')
+        (combined_file, parquet_files) = self.split_into_parquet_files(tsv_file, 3)
+        with open(combined_file, 'a') as fh:
+            fh.write("\n")
+        self.assertIsNone(epitope_table.columnar_files(combined_file))
+        pvactools.lib.combine_parsed_outputs.main([tsv_file, combined_file])
+        self.assertFalse(os.path.exists(epitope_table.columnar_index_path(combined_file)))
+
+    def test_aggregate_all_epitopes_from_parquet_files(self):
+        test_data_dir = os.path.join(self.test_data_dir, 'aggregate_all_epitopes')
+        (combined_file, parquet_files) = self.split_into_parquet_files(os.path.join(test_data_dir, 'Test.all_epitopes.tsv'), 3)
+        output_file = os.path.join(self.output_dir.name, 'output.tsv')
+        PvacseqAggregateAllEpitopes(combined_file, output_file).execute()
+        self.assertTrue(cmp(output_file, os.path.join(test_data_dir, "output.tsv")))
+        self.assertTrue(cmp(output_file.replace('.tsv', '.metrics.json'), os.path.join(test_data_dir, "output.metrics.json")))
@@ -1,6 +1,7 @@
 import unittest
 import os
 import tempfile
+import csv
 from filecmp import cmp
 import py_compile
 
@@ -183,3 +184,46 @@ class FilterTests(unittest.TestCase):
             os.path.join(self.test_data_path, "output.inf.tsv"),
             False
         ))
+
+    def test_numeric_thresholds(self):
+        criterion = FilterCriterion("Tumor DNA VAF", ">=", 0.25)
+        self.assertTrue(criterion.passes('0.25'))
+        self.assertFalse(criterion.passes('0.249'))
+        self.assertTrue(criterion.passes('inf'))
+        self.assertTrue(criterion.passes('NA'))
+        self.assertFalse(FilterCriterion("Tumor DNA VAF", ">=", 0.25, exclude_nas=True).passes('NA'))
+        self.assertTrue(FilterCriterion("Transcript Support Level", "<=", 1, skip_value='Not Supported').passes('Not Supported'))
+        with self.assertRaises(Exception):
+            FilterCriterion("Tumor DNA VAF", "=>", 0.25)
+
+    def test_column_and_row_evaluation_match(self):
+        input_file = os.path.join(self.test_data_path, 'Test.combined.parsed.tsv')
+        for (operator, exclude_nas) in [('<', False), ('<=', True), ('==', False), ('>=', True), ('>', False)]:
+            filter = Filter(input_file, None, [
+                FilterCriterion("Median MT IC50 Score", operator, 500, exclude_nas=exclude_nas),
+                FilterCriterion("Median Fold Change", '>=', 0.5, exclude_nas=exclude_nas),
+            ])
+            with open(input_file) as fh:
+                lines = list(csv.DictReader(fh, delimiter='\t'))
+            self.assertEqual(filter.passing_rows(lines), [filter.passes(line) for line in lines])
+
+    def test_rows_are_filtered_in_batches(self):
+        input_file = os.path.join(self.test_data_path, 'Test.combined.parsed.tsv')
+        filter_criteria = [FilterCriterion("Median MT IC50 Score", '<=', 500, exclude_nas=True)]
+        output_file = tempfile.NamedTemporaryFile()
+        Filter(input_file, output_file.name, filter_criteria).execute()
+        batched_output_file = tempfile.NamedTemporaryFile()
+        filter = Filter(input_file, batched_output_file.name, filter_criteria)
+        filter.batch_size = 3
+        filter.execute()
+        self.assertTrue(cmp(batched_output_file.name, output_file.name, False))
+        with open(input_file) as fh:
+            expected_lines = [line for line in csv.DictReader(fh, delimiter='\t') if filter.passes(line)]
+        with open(batched_output_file.name) as fh:
+            self.assertEqual(list(csv.DictReader(fh, delimiter='\t')), expected_lines)
+
+    def test_invalid_thresholds_raise_an_error(self):
+        for threshold in [None, '', 'high']:
+            with self.assertRaises(Exception) as context:
+                FilterCriterion("Tumor DNA VAF", ">=", threshold)
+            self.assertEqual(str(context.exception), "Threshold for filtering on Tumor DNA VAF needs to be a number: {}".format(threshold))
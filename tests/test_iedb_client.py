@@ -0,0 +1,113 @@
+import unittest
+import os
+import time
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from multiprocessing import Process
+
+from pvactools.lib.iedb_client import IEDBClient, ConcurrencyLimiter
+
+class StubIEDBHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        server = self.server
+        self.rfile.read(int(self.headers['Content-Length']))
+        with server.lock:
+            server.request_times.append(time.time())
+            server.active_requests += 1
+            server.max_active_requests = max(server.max_active_requests, server.active_requests)
+            status = server.statuses.pop(0) if len(server.statuses) > 0 else 200
+        time.sleep(server.response_delay)
+        body = b"allele\tpeptide\n"
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        with server.lock:
+            server.active_requests -= 1
+
+    def log_message(self, format, *args):
+        pass
+
+def post_requests(url, state_dir, requests_per_second, max_concurrent_requests, count):
+    client = IEDBClient(url, state_dir, requests_per_second, max_concurrent_requests)
+    for i in range(count):
+        client.post({'sequence_text': '>1\nAAAAAAAAA'})
+
+class IEDBClientTests(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubIEDBHandler)
+        self.server.lock = threading.Lock()
+        self.server.request_times = []
+        self.server.active_requests = 0
+        self.server.max_active_requests = 0
+        self.server.statuses = []
+        self.server.response_delay = 0
+        self.server.daemon_threads = True
+        self.server_thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.server_thread.start()
+        self.url = "http://127.0.0.1:{}/tools_api/mhci/".format(self.server.server_address[1])
+        self.state_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.state_dir.cleanup()
+
+    def test_post_returns_response(self):
+        client = IEDBClient(self.url, self.state_dir.name)
+        response = client.post({'sequence_text': '>1\nAAAAAAAAA'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.text, "allele\tpeptide\n")
+
+    def test_session_is_reused(self):
+        client = IEDBClient(self.url, self.state_dir.name)
+        self.assertIs(client.session(), IEDBClient(self.url, self.state_dir.name).session())
+
+    def test_rate_limit_is_shared_between_processes(self):
+        processes = [Process(target=post_requests, args=(self.url, self.state_dir.name, 10, None, 10)) for i in range(3)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+            self.assertEqual(process.exitcode, 0)
+        request_times = sorted(self.server.request_times)
+        self.assertEqual(len(request_times), 30)
+        #The bucket starts with 10 tokens and the remaining 20 requests are spread out at 10 per second
+        self.assertGreaterEqual(request_times[-1] - request_times[0], 1.8)
+        for (i, request_time) in enumerate(request_times):
+            requests_within_one_second = len([t for t in request_times[i:] if t - request_time < 1])
+            self.assertLessEqual(requests_within_one_second, 21)
+
+    def test_concurrent_requests_are_limited_between_processes(self):
+        self.server.response_delay = 0.2
+        processes = [Process(target=post_requests, args=(self.url, self.state_dir.name, None, 2, 2)) for i in range(4)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+            self.assertEqual(process.exitcode, 0)
+        self.assertEqual(len(self.server.request_times), 8)
+        self.assertLessEqual(self.server.max_active_requests, 2)
+
+    def test_backoff_pauses_all_clients(self):
+        client = IEDBClient(self.url, self.state_dir.name, backoff_range=(1, 1))
+        other_client = IEDBClient(self.url, self.state_dir.name)
+        self.server.statuses = [403]
+        self.assertEqual(client.post({}).status_code, 403)
+        client.backoff(1)
+        start = time.time()
+        self.assertEqual(other_client.post({}).status_code, 200)
+        self.assertGreaterEqual(time.time() - start, 0.9)
+
+    def test_concurrency_limiter_releases_slot(self):
+        slot_file_prefix = os.path.join(self.state_dir.name, 'slot')
+        with ConcurrencyLimiter(slot_file_prefix, 1):
+            pass
+        limiter = ConcurrencyLimiter(slot_file_prefix, 1)
+        limiter.poll_interval = 0
+        with limiter:
+            self.assertIsNotNone(limiter.slot_fh)
+        self.assertIsNone(limiter.slot_fh)
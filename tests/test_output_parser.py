@@ -2,9 +2,13 @@ import unittest
 import os
 import sys
 import tempfile
+import copy
 import py_compile
+import tracemalloc
+import unittest.mock
 
 from pvactools.lib.output_parser import DefaultOutputParser, UnmatchedSequencesOutputParser
+import pvactools.lib.epitope_table
 from tests.utils import *
 
 class OutputParserTests(unittest.TestCase):
@@ -441,3 +445,93 @@ class OutputParserTests(unittest.TestCase):
         shutil.copy(parse_output_output_file.name, expected_output_file)
 
         self.assertTrue(compare(parse_output_output_file.name, expected_output_file))
+
+    def test_results_processed_by_variant_match_results_processed_at_once(self):
+        for (input_iedb_files, input_tsv_file, key_file, sample_name) in [
+            (["input.ann.HLA-A*29:02.9.tsv", "input.smm.HLA-A*29:02.9.tsv", "input.smmpmbec.HLA-A*29:02.9.tsv"], "Test.tsv", "Test_21.key", 'input'),
+            (["input_multiple_transcripts_per_alt.ann.HLA-A*29:02.9.tsv"], "input_multiple_transcripts_per_alt.tsv", "input_multiple_transcripts_per_alt.key", 'input_multiple_transcripts_per_alt'),
+        ]:
+            parser = DefaultOutputParser(**{
+                'input_iedb_files'       : [os.path.join(self.test_data_dir, f) for f in input_iedb_files],
+                'input_tsv_file'         : os.path.join(self.test_data_dir, input_tsv_file),
+                'key_file'               : os.path.join(self.test_data_dir, key_file),
+                'output_file'            : None,
+                'sample_name'            : sample_name,
+            })
+            all_tsv_entries = parser.parse_input_tsv_file()
+            expected_results = parser.flatten_iedb_results(parser.add_summary_metrics(parser.parse_iedb_file(all_tsv_entries)))
+            results = []
+            for (tsv_entries, variant_results) in parser.variant_iedb_results():
+                self.assertEqual(len(tsv_entries), 1)
+                for (tsv_index, tsv_entry) in tsv_entries.items():
+                    self.assertEqual(tsv_entry, all_tsv_entries[tsv_index])
+                    self.assertEqual(set(result[10] for result in variant_results), {tsv_index})
+                results.extend(variant_results)
+            sort_key = lambda result: (result[10], int(result[2]))
+            self.assertEqual(sorted(results, key=sort_key), sorted(expected_results, key=sort_key))
+
+    def test_results_are_processed_one_variant_at_a_time(self):
+        parser = DefaultOutputParser(**{
+            'input_iedb_files'       : [os.path.join(self.test_data_dir, "input.{}.HLA-A*29:02.9.tsv".format(method)) for method in ['ann', 'smm', 'smmpmbec']],
+            'input_tsv_file'         : os.path.join(self.test_data_dir, "Test.tsv"),
+            'key_file'               : os.path.join(self.test_data_dir, "Test_21.key"),
+            'output_file'            : None,
+            'sample_name'            : 'input',
+        })
+        tracemalloc.start()
+        tsv_entries = parser.parse_input_tsv_file()
+        expected_results = parser.flatten_iedb_results(parser.add_summary_metrics(parser.parse_iedb_file(tsv_entries)))
+        expected_peak = tracemalloc.get_traced_memory()[1]
+        expected_result_count = len(expected_results)
+        del tsv_entries, expected_results
+        tracemalloc.reset_peak()
+        result_count = 0
+        for (tsv_entries, results) in parser.variant_iedb_results():
+            result_count += len(results)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        self.assertLess(peak, expected_peak)
+        self.assertEqual(result_count, expected_result_count)
+
+        #Each variant is matched on its own and its rows are written before the next variant is read
+        events = []
+        variant_iedb_records = parser.variant_iedb_records
+        def read_variant(*args):
+            events.append('read')
+            return variant_iedb_records(*args)
+        writerow = pvactools.lib.epitope_table.DictWriter.writerow
+        def write_row(tsv_writer, row):
+            events.append('write')
+            return writerow(tsv_writer, row)
+        output_file = tempfile.NamedTemporaryFile()
+        parser.output_file = output_file.name
+        with unittest.mock.patch.object(parser, 'variant_iedb_records', side_effect=read_variant), \
+             unittest.mock.patch.object(pvactools.lib.epitope_table.DictWriter, 'writerow', autospec=True, side_effect=write_row), \
+             unittest.mock.patch.object(parser, 'match_wildtype_and_mutant_entries', wraps=parser.match_wildtype_and_mutant_entries) as match:
+            parser.execute()
+        for ((variant_iedb_results, variant_wt_iedb_results), kwargs) in match.call_args_list:
+            self.assertEqual(len(variant_wt_iedb_results), 1)
+            self.assertEqual(set(key.split('|', 1)[0] for key in variant_iedb_results.keys()), set(variant_wt_iedb_results.keys()))
+        self.assertEqual(match.call_count, events.count('read'))
+        self.assertGreater(events.count('read'), 1)
+        self.assertLess(events.index('write'), len(events) - 1 - events[::-1].index('read'))
+
+    def test_variants_are_matched_independently(self):
+        iedb_results = {}
+        wt_iedb_results = {}
+        expected_results = {}
+        for name in ['input_inframe_deletion_aa_deletion', 'input_inframe_insertion_aa_insertion']:
+            parser = DefaultOutputParser(**{
+                'input_iedb_files'       : [os.path.join(self.test_data_dir, "{}.ann.HLA-A*29:02.9.tsv".format(name))],
+                'input_tsv_file'         : os.path.join(self.test_data_dir, "{}.tsv".format(name)),
+                'key_file'               : os.path.join(self.test_data_dir, "{}.key".format(name)),
+                'output_file'            : None,
+                'sample_name'            : name,
+            })
+            tsv_entries = parser.parse_input_tsv_file()
+            (variant_iedb_results, variant_wt_iedb_results) = parser.collect_iedb_results(parser.iedb_records(tsv_entries), tsv_entries)
+            expected_results.update({"{}{}".format(name, key): result for (key, result) in copy.deepcopy(parser.match_wildtype_and_mutant_entries(variant_iedb_results, variant_wt_iedb_results)).items()})
+            (variant_iedb_results, variant_wt_iedb_results) = parser.collect_iedb_results(parser.iedb_records(tsv_entries), tsv_entries)
+            iedb_results.update({"{}{}".format(name, key): result for (key, result) in variant_iedb_results.items()})
+            wt_iedb_results.update({"{}{}".format(name, key): results for (key, results) in variant_wt_iedb_results.items()})
+        self.assertEqual(parser.match_wildtype_and_mutant_entries(iedb_results, wt_iedb_results), expected_results)
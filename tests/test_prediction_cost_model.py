@@ -0,0 +1,75 @@
+import unittest
+import os
+import tempfile
+from Bio import SeqIO
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+
+from pvactools.lib.prediction_cost_model import PredictionCostModel, count_peptides
+
+class PredictionCostModelTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.model_file = os.path.join(self.tmp_dir.name, 'prediction_costs.json')
+        self.short_fasta = self.write_fasta('short.fa', ['AAAAAAAAAA'])
+        self.long_fasta = self.write_fasta('long.fa', ['A' * 30, 'C' * 17])
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_fasta(self, name, sequences):
+        path = os.path.join(self.tmp_dir.name, name)
+        with open(path, 'w') as fh:
+            for (i, sequence) in enumerate(sequences):
+                fh.write(">{}\n{}\n".format(i, sequence))
+        return path
+
+    def arguments(self, fasta, method, alleles):
+        return [fasta, 'out.tsv', method, alleles, '-r', '5', '-e', None, '-l', '9']
+
+    def test_count_peptides(self):
+        self.assertEqual(count_peptides(self.short_fasta, 9), 2)
+        self.assertEqual(count_peptides(self.long_fasta, 9), 22 + 9)
+
+    def test_count_peptides_of_wrapped_sequences(self):
+        wrapped_fasta = os.path.join(self.tmp_dir.name, 'wrapped.fa')
+        SeqIO.write([SeqRecord(Seq('A' * 130), id='1', description=''), SeqRecord(Seq('C' * 17), id='2', description='')], wrapped_fasta, 'fasta')
+        self.assertEqual(count_peptides(wrapped_fasta, 9), 122 + 9)
+
+    def test_order_by_cost_without_timings(self):
+        argument_sets = [
+            self.arguments(self.short_fasta, 'NetMHC', 'HLA-A*02:01'),
+            self.arguments(self.long_fasta, 'NetMHC', 'HLA-A*02:01'),
+            self.arguments(self.short_fasta, 'MHCflurry', 'HLA-A*02:01,HLA-B*07:02,HLA-C*07:02'),
+        ]
+        (ordered_argument_sets, costs) = PredictionCostModel(self.model_file).order_by_cost(argument_sets)
+        self.assertEqual(ordered_argument_sets, [argument_sets[1], argument_sets[2], argument_sets[0]])
+        self.assertEqual(costs, sorted(costs, reverse=True))
+
+    def test_order_by_cost_uses_recorded_timings(self):
+        model = PredictionCostModel(self.model_file)
+        model.record(self.arguments(self.short_fasta, 'NetMHCpan', 'HLA-A*02:01'), 20)
+        model.record(self.arguments(self.long_fasta, 'MHCflurry', 'HLA-A*02:01'), 1)
+        argument_sets = [
+            self.arguments(self.long_fasta, 'MHCflurry', 'HLA-A*02:01'),
+            self.arguments(self.short_fasta, 'NetMHCpan', 'HLA-A*02:01'),
+        ]
+        (ordered_argument_sets, costs) = PredictionCostModel(self.model_file).order_by_cost(argument_sets)
+        self.assertEqual(ordered_argument_sets, [argument_sets[1], argument_sets[0]])
+        self.assertAlmostEqual(costs[0], 20)
+
+    def test_record_only_counts_predicted_peptides(self):
+        model = PredictionCostModel(self.model_file)
+        arguments = self.arguments(self.long_fasta, 'NetMHCpan', 'HLA-A*02:01')
+        #All peptides were taken from the prediction cache
+        model.record(arguments, 0.01, 0)
+        self.assertEqual(model.seconds_per_peptide(), {})
+        model.record(arguments, 2, 4)
+        self.assertAlmostEqual(model.seconds_per_peptide()['NetMHCpan'], 0.5)
+
+    def test_record_smooths_timings(self):
+        model = PredictionCostModel(self.model_file)
+        arguments = self.arguments(self.short_fasta, 'NetMHCpan', 'HLA-A*02:01')
+        model.record(arguments, 2)
+        model.record(arguments, 4)
+        self.assertAlmostEqual(model.seconds_per_peptide()['NetMHCpan'], 1.5)
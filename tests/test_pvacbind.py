@@ -14,8 +14,11 @@ from mock import patch
 from urllib.request import urlopen
 from shutil import copyfileobj
 from tempfile import NamedTemporaryFile
+import pandas as pd
+from Bio import SeqIO
 
 from pvactools.lib.pipeline import PvacbindPipeline
+from pvactools.lib.prediction_class import MHCflurry
 from pvactools.tools.pvacbind import *
 from tests.utils import *
 import logging
@@ -146,7 +149,7 @@ class PvacbindTests(unittest.TestCase):
         output_dir.cleanup()
 
     def test_pvacbind_pipeline(self):
-        with patch('pvactools.lib.call_iedb.requests.post', unittest.mock.Mock(side_effect = lambda url, data, files=None: make_response(
+        with patch('requests.Session.post', unittest.mock.Mock(side_effect = lambda url, data, files=None: make_response(
             data,
             files,
             test_data_directory()
@@ -297,6 +300,149 @@ class PvacbindTests(unittest.TestCase):
 
             output_dir.cleanup()
 
+    def test_pvacbind_incremental_restart(self):
+        with patch('requests.Session.post', unittest.mock.Mock(side_effect = lambda url, data, files=None: make_response(
+            data,
+            files,
+            test_data_directory()
+        ))) as mock_request:
+            output_dir = tempfile.TemporaryDirectory(dir = self.test_data_directory)
+            params = [
+                os.path.join(self.test_data_directory, "input.fasta"),
+                'sample.name',
+                'HLA-G*01:09',
+                'PickPocket',
+                output_dir.name,
+                '-e1', '9',
+                '--top-score-metric=lowest',
+                '--keep-tmp-files',
+            ]
+            run.main(params)
+            self.assertEqual(mock_request.call_count, 1)
+            #The IEDB request limits are shared with the MHC class II predictions of the run
+            self.assertTrue(os.path.exists(os.path.join(output_dir.name, 'tmp', 'iedb_client.state')))
+            self.assertFalse(os.path.exists(os.path.join(output_dir.name, 'MHC_Class_I', 'tmp', 'iedb_client.state')))
+
+            params[2] = 'HLA-G*01:09,HLA-E*01:01'
+            with self.assertRaises(SystemExit) as cm:
+                run.main(params)
+            self.assertEqual(
+                str(cm.exception),
+                "Restart inputs are different from past inputs: \n" +
+                "Past input: alleles - ['HLA-G*01:09']\n" +
+                "Current input: alleles - ['HLA-E*01:01', 'HLA-G*01:09']\n" +
+                "Use --incremental to only run the predictions that don't exist yet.\nAborting."
+            )
+
+            mock_request.reset_mock()
+            run.main(params + ['--incremental'])
+            close_mock_fhs()
+            mock_request.assert_has_calls([
+                generate_class_i_call('pickpocket', 'HLA-E*01:01', 9, os.path.join(output_dir.name, "MHC_Class_I", "tmp", "sample.name.9.fa.split_1-48"))
+            ])
+            self.assertEqual(mock_request.call_count, 1)
+            with open(os.path.join(output_dir.name, 'MHC_Class_I', 'log', 'inputs.yml')) as fh:
+                self.assertEqual(yaml.load(fh, Loader=yaml.FullLoader)['alleles'], ['HLA-E*01:01', 'HLA-G*01:09'])
+            with open(os.path.join(output_dir.name, 'MHC_Class_I', 'sample.name.all_epitopes.tsv')) as fh:
+                alleles = set(line.split('\t')[1] for line in fh.readlines()[1:])
+            self.assertEqual(alleles, set(['HLA-G*01:09', 'HLA-E*01:01']))
+
+            output_dir.cleanup()
+
+    def test_pvacbind_incremental_restart_adding_mhcflurry_el(self):
+        def mock_mhcflurry_predict(self, input_file, allele, epitope_length, *args, **kwargs):
+            peptides = sorted(set(peptide for record in SeqIO.parse(input_file, "fasta") for peptide in self.determine_neoepitopes(str(record.seq), epitope_length).values()))
+            df = pd.DataFrame({
+                'allele': [allele] * len(peptides),
+                'peptide': peptides,
+                'ic50': [100.0 + i for i in range(len(peptides))],
+                'percentile': [1.0] * len(peptides),
+                'mhcflurry_processing_score': [0.5] * len(peptides),
+                'mhcflurry_presentation_score': [0.25] * len(peptides),
+                'mhcflurry_presentation_percentile': [2.0] * len(peptides),
+            })
+            return (self.merge_epitope_positions(input_file, epitope_length, df), 'pandas')
+
+        output_dir = tempfile.TemporaryDirectory(dir = self.test_data_directory)
+        params = [
+            os.path.join(self.test_data_directory, "input.fasta"),
+            'sample.name',
+            'HLA-A*02:01',
+            'MHCflurry',
+            output_dir.name,
+            '-e1', '9',
+            '--keep-tmp-files',
+        ]
+        with patch.object(MHCflurry, 'predict', autospec=True, side_effect=mock_mhcflurry_predict) as mock_predict:
+            run.main(params)
+            self.assertEqual(mock_predict.call_count, 1)
+
+            params.insert(4, 'MHCflurryEL')
+            with self.assertRaises(SystemExit) as cm:
+                run.main(params)
+            self.assertEqual(
+                str(cm.exception),
+                "Restart inputs are different from past inputs: \n" +
+                "Past input: flurry_state - BA_only\n" +
+                "Current input: flurry_state - both\n" +
+                "Use --incremental to only run the predictions that don't exist yet.\nAborting."
+            )
+
+            #The MHCflurry predictions include the presentation scores so only the parsing and reports are redone
+            mock_predict.reset_mock()
+            run.main(params + ['--incremental'])
+            self.assertEqual(mock_predict.call_count, 0)
+        with open(os.path.join(output_dir.name, 'MHC_Class_I', 'log', 'inputs.yml')) as fh:
+            self.assertEqual(yaml.load(fh, Loader=yaml.FullLoader)['flurry_state'], 'both')
+        with open(os.path.join(output_dir.name, 'MHC_Class_I', 'sample.name.all_epitopes.tsv')) as fh:
+            header = fh.readline().rstrip('\n').split('\t')
+        self.assertIn('MHCflurryEL Presentation Score', header)
+
+        output_dir.cleanup()
+
+    def test_pvacbind_restart_with_inputs_from_before_new_options(self):
+        with patch('requests.Session.post', unittest.mock.Mock(side_effect = lambda url, data, files=None: make_response(
+            data,
+            files,
+            test_data_directory()
+        ))):
+            output_dir = tempfile.TemporaryDirectory(dir = self.test_data_directory)
+            params = [
+                os.path.join(self.test_data_directory, "input.fasta"),
+                'sample.name',
+                'HLA-G*01:09',
+                'PickPocket',
+                output_dir.name,
+                '-e1', '9',
+                '--top-score-metric=lowest',
+                '--keep-tmp-files',
+            ]
+            run.main(params)
+            close_mock_fhs()
+
+            #Remove the inputs that runs of older versions didn't log
+            log_file = os.path.join(output_dir.name, 'MHC_Class_I', 'log', 'inputs.yml')
+            with open(log_file) as fh:
+                past_inputs = yaml.load(fh, Loader=yaml.FullLoader)
+            for key in ['prediction_cache', 'batch_alleles', 'in_process_predictions', 'iedb_requests_per_second', 'iedb_max_concurrent_requests', 'prediction_cost_model', 'incremental', 'intermediate_format']:
+                del past_inputs[key]
+            with open(log_file, 'w') as fh:
+                yaml.dump(past_inputs, fh, default_flow_style=False)
+
+            run.main(params)
+            close_mock_fhs()
+
+            with self.assertRaises(SystemExit) as cm:
+                run.main(params + ['--batch-alleles'])
+            self.assertEqual(
+                str(cm.exception),
+                "Restart inputs are different from past inputs: \n" +
+                "Additional input: batch_alleles - True\n" +
+                "Aborting."
+            )
+
+            output_dir.cleanup()
+
     def test_duplicate_fasta_header(self):
         with self.assertRaises(Exception) as cm:
             output_dir = tempfile.TemporaryDirectory(dir = self.test_data_directory)
@@ -221,7 +221,7 @@ class PvacfuseTests(unittest.TestCase):
         valid_algorithms.main("")
 
     def test_pvacfuse_pipeline(self):
-        with patch('requests.post', unittest.mock.Mock(side_effect = lambda url, data, files=None: make_response(
+        with patch('requests.Session.post', unittest.mock.Mock(side_effect = lambda url, data, files=None: make_response(
             data,
             files,
             test_data_directory(),
@@ -268,7 +268,7 @@ class PvacfuseTests(unittest.TestCase):
             output_dir.cleanup()
 
     def test_pvacfuse_pipeline_agfusion_starfusion(self):
-        with patch('requests.post', unittest.mock.Mock(side_effect = lambda url, data, files=None: make_response(
+        with patch('requests.Session.post', unittest.mock.Mock(side_effect = lambda url, data, files=None: make_response(
             data,
             files,
             test_data_directory(),
@@ -309,7 +309,7 @@ class PvacfuseTests(unittest.TestCase):
             output_dir.cleanup()
 
     def test_pvacfuse_pipeline_arriba(self):
-        with patch('requests.post', unittest.mock.Mock(side_effect = lambda url, data, files=None: make_response(
+        with patch('requests.Session.post', unittest.mock.Mock(side_effect = lambda url, data, files=None: make_response(
             data,
             files,
             test_data_directory(),
@@ -341,7 +341,7 @@ class PvacfuseTests(unittest.TestCase):
 
 
     def test_pvacfuse_combine_and_condense_steps(self):
-        with patch('requests.post', unittest.mock.Mock(side_effect = lambda url, data, files=None: make_response(
+        with patch('requests.Session.post', unittest.mock.Mock(side_effect = lambda url, data, files=None: make_response(
             data,
             files,
             test_data_directory(),
@@ -17,6 +17,9 @@ from shutil import copyfileobj
 from tempfile import NamedTemporaryFile
 
 from pvactools.tools.pvacseq import *
+import pvactools.lib.pipeline
+from pvactools.lib.pipeline import Pipeline
+from pvactools.lib.task_graph import TaskGraph
 import pvactools.tools.pvacseq.main as pvacseq_main
 from tests.utils import *
 
@@ -278,7 +281,7 @@ class PvacseqTests(unittest.TestCase):
         identify_problematic_amino_acids.main([input_file, output_file.name, "C"])
 
     def test_pvacseq_pipeline(self):
-        with patch('requests.post', unittest.mock.Mock(side_effect = lambda url, data, files=None: make_response(
+        with patch('requests.Session.post', unittest.mock.Mock(side_effect = lambda url, data, files=None: make_response(
             data,
             files,
             test_data_directory()
@@ -444,7 +447,7 @@ class PvacseqTests(unittest.TestCase):
 
             output_dir.cleanup()
 
-    @patch('requests.post', unittest.mock.Mock(side_effect = lambda url, data, files=None: make_response(
+    @patch('requests.Session.post', unittest.mock.Mock(side_effect = lambda url, data, files=None: make_response(
         data,
         files,
         test_data_directory()
@@ -468,7 +471,7 @@ class PvacseqTests(unittest.TestCase):
         self.assertTrue(cmp(output_file, expected_file, False))
         output_dir.cleanup()
 
-    @patch('requests.post', unittest.mock.Mock(side_effect = lambda url, data, files=None: make_response(
+    @patch('requests.Session.post', unittest.mock.Mock(side_effect = lambda url, data, files=None: make_response(
         data,
         files,
         test_data_directory()
@@ -503,6 +506,64 @@ class PvacseqTests(unittest.TestCase):
             self.assertTrue(cmp(output_file, expected_file, False), "files don't match %s - %s" %(output_file, expected_file))
         output_dir.cleanup()
 
+    def test_pvacseq_pipeline_tasks_in_parallel(self):
+        output_dir = tempfile.TemporaryDirectory()
+        tasks = []
+        add_task = TaskGraph.add_task
+        def record_task(task_graph, function, args=[], dependencies=[], callback=None, priority=0):
+            tasks.append((function, priority))
+            return add_task(task_graph, function, args, dependencies, callback, priority)
+
+        #The pipeline itself shouldn't be sent to the worker processes
+        with patch.object(Pipeline, '__getstate__', unittest.mock.Mock(side_effect=Exception("Pipeline pickled")), create=True), \
+             patch.object(TaskGraph, 'add_task', autospec=True, side_effect=record_task):
+            run.main([
+                os.path.join(self.test_data_directory, "input.vcf"),
+                'Test',
+                'HLA-A*02:01',
+                'MHCnuggetsI',
+                output_dir.name,
+                '-e1', '9',
+                '-s', '20',
+                '-t', '2',
+            ])
+        self.assertTrue(os.path.exists(os.path.join(output_dir.name, 'MHC_Class_I', 'Test.all_epitopes.tsv')))
+
+        #Each chunk's parse tasks get the priority of its most expensive prediction
+        chunk_priorities = []
+        prediction_priorities = []
+        for (function, priority) in tasks:
+            if function is pvactools.lib.pipeline.run_call_iedb:
+                prediction_priorities.append(priority)
+            elif function is None:
+                self.assertEqual(priority, max(prediction_priorities))
+                chunk_priorities.append(priority)
+                prediction_priorities = []
+        parse_priorities = [priority for (function, priority) in tasks if function is pvactools.lib.pipeline.parse_output]
+        self.assertGreater(len(chunk_priorities), 1)
+        self.assertEqual(sorted(parse_priorities), sorted(chunk_priorities))
+        self.assertTrue(all(priority > 0 for priority in parse_priorities))
+        output_dir.cleanup()
+
+    def test_pvacseq_restart_does_not_convert_the_vcf_again(self):
+        output_dir = tempfile.TemporaryDirectory()
+        params = [
+            os.path.join(self.test_data_directory, "input.vcf"),
+            'Test',
+            'HLA-A*02:01',
+            'MHCnuggetsI',
+            output_dir.name,
+            '-e1', '9',
+        ]
+        run.main(params)
+        self.assertFalse(os.path.exists(os.path.join(output_dir.name, 'tmp')))
+        os.unlink(os.path.join(output_dir.name, 'MHC_Class_I', 'Test.all_epitopes.tsv'))
+
+        with patch('pvactools.tools.pvacseq.run.VcfConverter.execute', unittest.mock.Mock(side_effect=Exception("VCF converted again"))):
+            run.main(params)
+        self.assertTrue(os.path.exists(os.path.join(output_dir.name, 'MHC_Class_I', 'Test.all_epitopes.tsv')))
+        output_dir.cleanup()
+
     def test_pvacseq_combine_and_condense_steps(self):
         output_dir = tempfile.TemporaryDirectory(dir = self.test_data_directory)
         for subdir in ['MHC_Class_I', 'MHC_Class_II']:
@@ -552,7 +613,7 @@ class PvacseqTests(unittest.TestCase):
 
     def test_problematic_amino_acids(self):
         output_dir = tempfile.TemporaryDirectory(dir = self.test_data_directory)
-        with patch('requests.post', unittest.mock.Mock(side_effect = lambda url, data, files=None: make_response(
+        with patch('requests.Session.post', unittest.mock.Mock(side_effect = lambda url, data, files=None: make_response(
             data,
             files,
             test_data_directory()
@@ -171,8 +171,29 @@ class TestPvacvector(unittest.TestCase):
     def test_valid_algorithms_runs(self):
         valid_algorithms.main("")
 
+    def test_run_pipelines_share_the_iedb_state_dir(self):
+        def predict_and_parse(pipeline_arguments):
+            os.makedirs(pipeline_arguments['iedb_state_dir'], exist_ok=True)
+            return []
+        for keep_tmp_files in [True, False]:
+            output_dir = tempfile.TemporaryDirectory()
+            args = run.define_parser().parse_args([
+                self.input_file,
+                self.test_run_name,
+                self.allele,
+                self.method,
+                output_dir.name,
+                '-e1', self.epitope_length,
+            ] + (['-k'] if keep_tmp_files else []))
+            with patch('pvactools.tools.pvacvector.run.predict_and_parse', unittest.mock.Mock(side_effect=predict_and_parse)) as mock_predict_and_parse:
+                run.run_pipelines(self.input_file, output_dir.name, args, 'None', ['NetMHC'], ['NNalign'], ['HLA-A*02:01'], ['DRB1*11:01'])
+            iedb_state_dir = os.path.join(output_dir.name, 'tmp')
+            self.assertEqual([pipeline_arguments['iedb_state_dir'] for ((pipeline_arguments,), kwargs) in mock_predict_and_parse.call_args_list], [iedb_state_dir, iedb_state_dir])
+            self.assertEqual(os.path.exists(iedb_state_dir), keep_tmp_files)
+            output_dir.cleanup()
+
     def test_pvacvector_fa_input_runs_and_produces_expected_output(self):
-        with patch('requests.post', unittest.mock.Mock(side_effect = lambda url, data: make_response(
+        with patch('requests.Session.post', unittest.mock.Mock(side_effect = lambda url, data: make_response(
             data,
             test_data_directory(),
             'fa_input',
@@ -213,7 +234,7 @@ class TestPvacvector(unittest.TestCase):
             output_dir.cleanup()
 
     def test_pvacvector_generate_fa_runs_and_produces_expected_output(self):
-        with patch('requests.post', unittest.mock.Mock(side_effect = lambda url, data, files=None: make_response(
+        with patch('requests.Session.post', unittest.mock.Mock(side_effect = lambda url, data, files=None: make_response(
             data,
             test_data_directory(),
             'generate_fa',
@@ -248,7 +269,7 @@ class TestPvacvector(unittest.TestCase):
             output_dir.cleanup()
 
     def test_pvacvector_generate_fa_with_epitope_at_beginning_of_transcript(self):
-        with patch('requests.post', unittest.mock.Mock(side_effect = lambda url, data, files=None: make_response(
+        with patch('requests.Session.post', unittest.mock.Mock(side_effect = lambda url, data, files=None: make_response(
             data,
             test_data_directory(),
             'negative_start',
@@ -0,0 +1,72 @@
+import unittest
+import os
+import tempfile
+import unittest.mock
+
+from pvactools.lib.run_manifest import RunManifest
+import pvactools.lib.pipeline
+
+class RunManifestTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.manifest = RunManifest(os.path.join(self.tmp_dir.name, 'run_manifest.db'))
+        self.input_file = self.write_file('input.fa', ">1\nAAAAAAAAA\n")
+        self.output_file = self.write_file('output.tsv', "allele\tpeptide\n")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_file(self, name, contents):
+        path = os.path.join(self.tmp_dir.name, name)
+        with open(path, 'w') as fh:
+            fh.write(contents)
+        return path
+
+    def test_task_is_complete_after_marking_it_complete(self):
+        input_hash = RunManifest.input_hash([self.input_file], {'allele': 'HLA-A*02:01'})
+        self.assertFalse(self.manifest.is_complete(self.output_file, input_hash))
+        self.manifest.mark_complete(self.output_file, input_hash)
+        self.assertTrue(self.manifest.is_complete(self.output_file, input_hash))
+        self.assertTrue(RunManifest(self.manifest.manifest_file).is_complete(self.output_file, input_hash))
+
+    def test_changed_inputs_are_not_complete(self):
+        input_hash = RunManifest.input_hash([self.input_file], {'allele': 'HLA-A*02:01'})
+        self.manifest.mark_complete(self.output_file, input_hash)
+        self.assertNotEqual(RunManifest.input_hash([self.input_file], {'allele': 'HLA-B*07:02'}), input_hash)
+        self.write_file('input.fa', ">1\nCCCCCCCCC\n")
+        changed_input_hash = RunManifest.input_hash([self.input_file], {'allele': 'HLA-A*02:01'})
+        self.assertNotEqual(changed_input_hash, input_hash)
+        self.assertFalse(self.manifest.is_complete(self.output_file, changed_input_hash))
+
+    def test_modified_or_missing_outputs_are_not_complete(self):
+        input_hash = RunManifest.input_hash([self.input_file])
+        self.manifest.mark_complete(self.output_file, input_hash)
+        self.write_file('output.tsv', "allele\t")
+        self.assertFalse(self.manifest.is_complete(self.output_file, input_hash))
+        os.unlink(self.output_file)
+        self.assertFalse(self.manifest.is_complete(self.output_file, input_hash))
+
+    def test_all_outputs_need_to_be_complete(self):
+        key_file = self.write_file('output.tsv.key', "1: []\n")
+        input_hash = RunManifest.input_hash([self.input_file])
+        self.manifest.mark_complete(self.output_file, input_hash)
+        self.assertFalse(self.manifest.is_complete([self.output_file, key_file], input_hash))
+        self.manifest.mark_complete([self.output_file, key_file], input_hash)
+        self.assertTrue(self.manifest.is_complete([self.output_file, key_file], input_hash))
+
+    def test_outputs_older_than_the_manifest_are_complete(self):
+        input_hash = RunManifest.input_hash([self.input_file])
+        self.assertFalse(self.manifest.is_complete(self.output_file, input_hash))
+        os.utime(self.output_file, (0, 0))
+        self.assertTrue(self.manifest.is_complete(self.output_file, input_hash))
+
+    def test_batched_predictions_are_marked_complete_per_allele(self):
+        alleles = ['HLA-A*02:01', 'HLA-B*07:02']
+        output_files = [self.write_file('output.{}.tsv'.format(allele), "allele\tpeptide\n") for allele in alleles]
+        arguments = [self.input_file, ','.join(output_files), 'MHCflurry', ','.join(alleles), '-r', '5', '-e', None, '-l', '9']
+        with unittest.mock.patch('pvactools.lib.call_iedb.main', return_value=[]), \
+             unittest.mock.patch('pvactools.lib.pipeline.status_message') as status_message:
+            pvactools.lib.pipeline.run_call_iedb(arguments, run_manifest=self.manifest)
+        for (output_file, allele) in zip(output_files, alleles):
+            self.assertTrue(self.manifest.is_complete(output_file, pvactools.lib.pipeline.prediction_input_hash(arguments, allele)))
+        self.assertIn("Allele {} and".format(','.join(alleles)), status_message.call_args_list[-1][0][0])
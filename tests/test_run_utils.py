@@ -9,6 +9,14 @@ from pvactools.lib.aggregate_all_epitopes import PvacseqAggregateAllEpitopes
 from pvactools.lib.run_utils import *
 from tests.utils import *
 
+def write_pid(output_file):
+    with open(output_file, 'w') as fh:
+        fh.write(str(os.getpid()))
+    return output_file
+
+def fail(message):
+    sys.exit(message)
+
 #python -m unittest tests/test_run_utils.py
 class RunUtilsTests(unittest.TestCase):
     @classmethod
@@ -55,3 +63,24 @@ class RunUtilsTests(unittest.TestCase):
             get_anchor_positions("H-2-Kb", 11, agg_obj.allele_specific_anchors, agg_obj.anchor_probabilities, agg_obj.anchor_contribution_threshold, agg_obj.mouse_anchor_positions),
             [1, 2, 10, 11]
         )
+
+    def test_split_threads(self):
+        self.assertEqual(split_threads(8, 2), [4, 4])
+        self.assertEqual(split_threads(5, 2), [3, 2])
+        self.assertEqual(split_threads(1, 2), [1, 1])
+
+    def test_run_concurrently(self):
+        output_dir = tempfile.TemporaryDirectory()
+        output_files = [os.path.join(output_dir.name, "{}.txt".format(i)) for i in range(2)]
+        self.assertEqual(run_concurrently([(write_pid, [output_file]) for output_file in output_files]), output_files)
+        pids = set()
+        for output_file in output_files:
+            with open(output_file) as fh:
+                pids.add(fh.read())
+        self.assertEqual(len(pids), 2)
+        self.assertNotIn(str(os.getpid()), pids)
+
+        with self.assertRaises(SystemExit) as context:
+            run_concurrently([(write_pid, [output_files[0]]), (fail, ["Class II failed"])])
+        self.assertEqual(str(context.exception), "Class II failed")
+        output_dir.cleanup()
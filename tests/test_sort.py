@@ -0,0 +1,51 @@
+import unittest
+import unittest.mock
+import os
+import csv
+
+import pvactools.lib.sort
+from tests.utils import *
+
+class SortTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with open(os.path.join(pvactools_directory(), 'tests', 'test_data', 'combine_parsed_outputs', 'Test.combined.parsed.tsv'), 'r') as fh:
+            cls.rows = list(csv.DictReader(fh, delimiter='\t'))
+            cls.fieldnames = list(cls.rows[0].keys())
+
+    def three_pass_sort(self, rows, top_score_metric):
+        #Reference ordering: sort by the secondary score, then by descending fold change, then by the top score metric
+        (first_column, last_column) = ('Best MT IC50 Score', 'Median MT IC50 Score') if top_score_metric == 'median' else ('Median MT IC50 Score', 'Best MT IC50 Score')
+        sorted_rows = sorted(rows, key=lambda row: float(row[first_column]))
+        sorted_rows = sorted(sorted_rows, key=lambda row: float(row['Corresponding Fold Change']) if row['Corresponding Fold Change'].isdigit() else float('inf'), reverse=True)
+        return sorted(sorted_rows, key=lambda row: float(row[last_column]))
+
+    def test_default_sort_matches_three_pass_sort(self):
+        for top_score_metric in ['median', 'lowest']:
+            self.assertEqual(pvactools.lib.sort.default_sort(self.rows, top_score_metric), self.three_pass_sort(self.rows, top_score_metric))
+
+    def test_default_sort_from_pd_dict_keeps_fold_change_order(self):
+        rows = [
+            {'Median MT IC50 Score': 10.0, 'Best MT IC50 Score': 5.0, 'Corresponding Fold Change': float('nan'), 'id': 1},
+            {'Median MT IC50 Score': 10.0, 'Best MT IC50 Score': 4.0, 'Corresponding Fold Change': 2.5, 'id': 2},
+            {'Median MT IC50 Score': 10.0, 'Best MT IC50 Score': 3.0, 'Corresponding Fold Change': 'NA', 'id': 3},
+            {'Median MT IC50 Score': 1.0, 'Best MT IC50 Score': 8.0, 'Corresponding Fold Change': 0.5, 'id': 4},
+        ]
+        self.assertEqual([row['id'] for row in pvactools.lib.sort.default_sort_from_pd_dict(rows, 'median')], [4, 3, 2, 1])
+        self.assertEqual([row['id'] for row in pvactools.lib.sort.default_sort_from_pd_dict(rows, 'lowest')], [3, 2, 1, 4])
+
+    def test_external_sort_matches_sorted(self):
+        key = pvactools.lib.sort.default_sort_key('median')
+        self.assertEqual(
+            list(pvactools.lib.sort.external_sort(self.rows, key, self.fieldnames, run_size=100)),
+            sorted(self.rows, key=key),
+        )
+        self.assertEqual(list(pvactools.lib.sort.external_sort([], key, self.fieldnames)), [])
+
+    def test_external_sort_keeps_a_single_run_in_memory(self):
+        key = pvactools.lib.sort.default_sort_key('median')
+        with unittest.mock.patch('tempfile.TemporaryDirectory', side_effect=Exception("Run written to disk")):
+            self.assertEqual(
+                list(pvactools.lib.sort.external_sort(self.rows, key, self.fieldnames, run_size=len(self.rows))),
+                sorted(self.rows, key=key),
+            )
@@ -0,0 +1,96 @@
+import unittest
+import os
+import time
+import tempfile
+
+from pvactools.lib.task_graph import TaskGraph
+
+def write_file(path, contents):
+    with open(path, 'w') as fh:
+        fh.write(contents)
+    return path
+
+def read_files(paths):
+    contents = []
+    for path in paths:
+        with open(path) as fh:
+            contents.append(fh.read())
+    return contents
+
+def sleep_and_return(seconds, value):
+    time.sleep(seconds)
+    return (value, time.time())
+
+def noop():
+    pass
+
+def fail():
+    raise Exception("Task failed")
+
+class TaskGraphTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def run_dependent_tasks(self, n_workers):
+        task_graph = TaskGraph()
+        results = {}
+        def add_read_task(chunk, paths):
+            task_graph.add_task(read_files, [paths], dependencies=paths_tasks[chunk], callback=lambda contents: results.__setitem__(chunk, contents))
+        paths_tasks = {}
+        for chunk in range(3):
+            paths = [os.path.join(self.tmp_dir.name, "{}_{}".format(chunk, i)) for i in range(2)]
+            paths_tasks[chunk] = [task_graph.add_task(write_file, [path, "{}{}".format(chunk, i)]) for (i, path) in enumerate(paths)]
+            task_graph.add_task(noop, callback=lambda result, chunk=chunk, paths=paths: add_read_task(chunk, paths))
+        task_graph.run(n_workers)
+        return results
+
+    def test_dependent_tasks_run_after_their_dependencies(self):
+        self.assertEqual(self.run_dependent_tasks(1), {0: ['00', '01'], 1: ['10', '11'], 2: ['20', '21']})
+
+    def test_dependent_tasks_run_after_their_dependencies_in_parallel(self):
+        self.assertEqual(self.run_dependent_tasks(2), {0: ['00', '01'], 1: ['10', '11'], 2: ['20', '21']})
+
+    def test_independent_tasks_overlap(self):
+        task_graph = TaskGraph()
+        results = []
+        for i in range(2):
+            task_graph.add_task(sleep_and_return, [1, i], callback=results.append)
+        start = time.time()
+        task_graph.run(2)
+        self.assertLess(time.time() - start, 1.9)
+        self.assertEqual(sorted([value for (value, end) in results]), [0, 1])
+
+    def test_tasks_added_first_run_first(self):
+        task_graph = TaskGraph()
+        order = []
+        for i in range(3):
+            task_graph.add_task(order.append, [i])
+        task_graph.run(1)
+        self.assertEqual(order, [0, 1, 2])
+
+    def test_tasks_with_higher_priority_run_first(self):
+        task_graph = TaskGraph()
+        order = []
+        for (i, priority) in enumerate([1, 5, 1, 3]):
+            task_graph.add_task(order.append, [i], priority=priority)
+        task_graph.run(1)
+        self.assertEqual(order, [1, 3, 0, 2])
+
+    def test_failing_task_raises(self):
+        task_graph = TaskGraph()
+        task_graph.add_task(fail)
+        with self.assertRaises(Exception) as context:
+            task_graph.run(2)
+        self.assertEqual(str(context.exception), "Task failed")
+
+    def test_task_without_function_waits_for_dependencies(self):
+        task_graph = TaskGraph()
+        results = []
+        dependencies = [task_graph.add_task(sleep_and_return, [0.2, i], callback=results.append) for i in range(2)]
+        task_graph.add_task(None, dependencies=dependencies, callback=lambda result: results.append('done'))
+        task_graph.run(2)
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results[-1], 'done')
@@ -0,0 +1,80 @@
+import unittest
+import os
+import shutil
+import tempfile
+import csv
+import yaml
+from filecmp import cmp
+
+from pvactools.lib.tsv_splitter import TsvSplitter
+from tests.utils import *
+
+class TsvSplitterTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.test_data_dir = os.path.join(pvactools_directory(), "tests", "test_data", "pvacseq", "MHC_Class_I")
+
+    def setUp(self):
+        self.output_dir = tempfile.TemporaryDirectory()
+        self.input_file = os.path.join(self.output_dir.name, 'Test.tsv')
+        shutil.copy(os.path.join(self.test_data_dir, 'Test.tsv'), self.input_file)
+
+    def tearDown(self):
+        self.output_dir.cleanup()
+
+    def test_split_by_rows(self):
+        chunks = TsvSplitter(self.input_file, 'rows', 10, [9]).execute()
+        self.assertEqual([[c['start'], c['end']] for c in chunks], [[1, 10], [11, 20], [21, 24]])
+        self.assertEqual([c['rows'] for c in chunks], [10, 10, 4])
+        with open("{}_11-20".format(self.input_file)) as fh:
+            self.assertEqual(len(fh.readlines()), 11)
+        with open("{}.chunks.yml".format(self.input_file)) as fh:
+            manifest = yaml.load(fh, Loader=yaml.FullLoader)
+        self.assertEqual(manifest['chunks'], chunks)
+
+    def test_single_chunk_matches_input(self):
+        chunks = TsvSplitter(self.input_file, 'rows', 100, [9]).execute()
+        self.assertEqual([[c['start'], c['end']] for c in chunks], [[1, 24]])
+        self.assertTrue(cmp("{}_1-24".format(self.input_file), os.path.join(self.test_data_dir, 'Test.tsv_1-24'), shallow=False))
+
+    def test_split_by_peptides(self):
+        splitter = TsvSplitter(self.input_file, 'peptides', 18 * 5, [9])
+        with open(self.input_file) as fh:
+            rows = list(csv.DictReader(fh, delimiter='\t'))
+        #A missense variant produces 9 WT and 9 MT 9-mers, the frameshift in row 16 produces 9 WT and 21 MT 9-mers
+        self.assertEqual(splitter.estimated_peptides(rows[4]), 18)
+        self.assertEqual(splitter.estimated_peptides(rows[15]), 30)
+        chunks = splitter.execute()
+        self.assertEqual([[c['start'], c['end']] for c in chunks], [[1, 5], [6, 10], [11, 15], [16, 20], [21, 24]])
+        self.assertEqual([c['estimated_peptides'] for c in chunks], [90, 90, 90, 102, 72])
+
+    def test_split_by_bytes(self):
+        chunks = TsvSplitter(self.input_file, 'bytes', 5000, [9]).execute()
+        self.assertEqual(chunks[0]['start'], 1)
+        self.assertEqual(chunks[-1]['end'], 24)
+        for (chunk, next_chunk) in zip(chunks, chunks[1:]):
+            self.assertGreaterEqual(chunk['bytes'], 5000)
+            self.assertEqual(next_chunk['start'], chunk['end'] + 1)
+
+    def test_manifest_is_reused(self):
+        chunks = TsvSplitter(self.input_file, 'rows', 10, [9]).execute()
+        chunk_file = "{}_1-10".format(self.input_file)
+        os.utime(chunk_file, (0, 0))
+        self.assertEqual(TsvSplitter(self.input_file, 'rows', 10, [9]).execute(), chunks)
+        self.assertEqual(os.path.getmtime(chunk_file), 0)
+
+    def test_changed_input_is_split_again(self):
+        TsvSplitter(self.input_file, 'rows', 10, [9]).execute()
+        with open(self.input_file) as fh:
+            lines = fh.readlines()
+        with open(self.input_file, 'w') as fh:
+            fh.writelines(lines[0:6])
+        chunks = TsvSplitter(self.input_file, 'rows', 10, [9]).execute()
+        self.assertEqual([[c['start'], c['end']] for c in chunks], [[1, 5]])
+
+    def test_empty_tsv(self):
+        with open(self.input_file) as fh:
+            header = fh.readline()
+        with open(self.input_file, 'w') as fh:
+            fh.write(header)
+        self.assertEqual(TsvSplitter(self.input_file, 'rows', 10, [9]).execute(), [])